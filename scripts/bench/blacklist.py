@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+"""
+Benchmark host_blacklist_validator-style matching against a blacklist of N entries
+(90% plain strings, 10% regexes): the old way (re.search with every pattern)
+vs. the compiled blacklist.Matcher. No database needed.
+
+Usage (from the repo root, with nsupdate installed):
+
+    DJANGO_SETTINGS_MODULE=nsupdate.settings.dev python scripts/bench/blacklist.py [entries] [names]
+"""
+
+import os
+import random
+import re
+import string
+import sys
+import time
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "nsupdate.settings.dev")
+
+import django
+django.setup()
+
+from nsupdate.main.blacklist import Matcher
+
+
+def random_word(rnd, length):
+    return ''.join(rnd.choice(string.ascii_lowercase) for _ in range(length))
+
+
+def make_patterns(rnd, count):
+    patterns = set()
+    while len(patterns) < count:
+        word = random_word(rnd, rnd.randint(5, 12))
+        if rnd.random() < 0.9:
+            patterns.add(word)
+        else:
+            patterns.add('^%s[0-9]+' % word)
+    return sorted(patterns)
+
+
+def main():
+    entries = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    count = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    rnd = random.Random(42)
+    patterns = make_patterns(rnd, entries)
+    names = [random_word(rnd, rnd.randint(5, 30)) for _ in range(count)]
+
+    t0 = time.perf_counter()
+    old = [any(re.search(pattern, name) for pattern in patterns) for name in names]
+    t_old = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    matcher = Matcher(patterns)
+    t_build = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    new = [matcher.search(name) for name in names]
+    t_new = time.perf_counter() - t0
+
+    assert old == new
+    print("%d blacklist entries, %d names:" % (entries, count))
+    print("re.search per pattern: %8.1f us/name" % (t_old / count * 1e6))
+    print("compiled Matcher:      %8.1f us/name (built once in %.1f ms)" % (t_new / count * 1e6, t_build * 1e3))
+
+
+if __name__ == '__main__':
+    main()
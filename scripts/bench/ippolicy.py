@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+"""
+Benchmark checking IPs against a blocklist of N prefixes (IPv4 and IPv6):
+netaddr IPSet membership (like the BAD_IPS_HOST check used to do it) vs. the
+prefix tables of ippolicy.PrefixTable. No database needed.
+
+Usage (from the repo root, with nsupdate installed):
+
+    DJANGO_SETTINGS_MODULE=nsupdate.settings.dev python scripts/bench/ippolicy.py [prefixes] [lookups]
+"""
+
+import ipaddress
+import os
+import random
+import sys
+import time
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "nsupdate.settings.dev")
+
+import django
+django.setup()
+
+from netaddr import IPAddress, IPSet
+
+from nsupdate.main.ippolicy import PrefixTable, BLOCK
+
+
+def make_networks(rnd, count):
+    networks = []
+    for i in range(count):
+        if rnd.random() < 0.8:
+            prefixlen = rnd.choice([16, 20, 24, 28, 32])
+            ip = ipaddress.IPv4Address(rnd.getrandbits(32))
+        else:
+            prefixlen = rnd.choice([32, 48, 56, 64, 128])
+            ip = ipaddress.IPv6Address(rnd.getrandbits(128))
+        networks.append(str(ipaddress.ip_network('%s/%d' % (ip, prefixlen), strict=False)))
+    return networks
+
+
+def make_ips(rnd, count):
+    ips = []
+    for i in range(count):
+        if rnd.random() < 0.8:
+            ips.append(str(ipaddress.IPv4Address(rnd.getrandbits(32))))
+        else:
+            ips.append(str(ipaddress.IPv6Address(rnd.getrandbits(128))))
+    return ips
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    lookups = int(sys.argv[2]) if len(sys.argv) > 2 else 100000
+    rnd = random.Random(42)
+    networks = make_networks(rnd, count)
+    ips = make_ips(rnd, lookups)
+
+    t0 = time.perf_counter()
+    ipset = IPSet(networks)
+    t_ipset_build = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    old = [IPAddress(ip) in ipset for ip in ips]
+    t_ipset = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    table = PrefixTable()
+    for network in networks:
+        table.add(network, BLOCK)
+    t_table_build = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    new = [table.lookup(ip) == BLOCK for ip in ips]
+    t_table = time.perf_counter() - t0
+
+    assert old == new
+    print("%d prefixes, %d lookups (%d blocked):" % (count, lookups, sum(new)))
+    print("netaddr IPSet: %6.2f us/lookup (built in %.0f ms)" % (t_ipset / lookups * 1e6, t_ipset_build * 1e3))
+    print("PrefixTable:   %6.2f us/lookup (built in %.0f ms)" % (t_table / lookups * 1e6, t_table_build * 1e3))
+
+
+if __name__ == '__main__':
+    main()
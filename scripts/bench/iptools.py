@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+"""
+Micro-benchmarks of the per-request IP address handling: the old way
+(netaddr for normalization and the netmask check, dnspython for validation)
+vs. one iptools.IP object (ipaddress, memoized by parse_ip). No database needed.
+
+Usage (from the repo root, with nsupdate installed):
+
+    DJANGO_SETTINGS_MODULE=nsupdate.settings.dev python scripts/bench/iptools.py [count] [distinct]
+"""
+
+import ipaddress
+import os
+import random
+import sys
+import timeit
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "nsupdate.settings.dev")
+
+import django
+django.setup()
+
+import dns.inet
+from netaddr import IPAddress, IPNetwork
+
+from nsupdate.main.iptools import parse_ip
+
+
+def old_normalize(ipaddr):
+    ipaddr = IPAddress(ipaddr)
+    if ipaddr.is_ipv4_compat() or ipaddr.is_ipv4_mapped():
+        ipaddr = ipaddr.ipv4()
+    return str(ipaddr)
+
+
+def old_check(ipaddr):
+    af = dns.inet.af_for_address(ipaddr)
+    IPNetwork(ipaddr)
+    return ('ipv4', 'ipv6')[af == dns.inet.AF_INET6]
+
+
+def old_is_network(ipaddr, netmask):
+    return IPNetwork("%s/%d" % (ipaddr, netmask)).network == IPAddress(ipaddr)
+
+
+def old_request(ipaddr, netmask):
+    ipaddr = old_normalize(ipaddr)
+    kind = old_check(ipaddr)
+    return kind, old_is_network(ipaddr, netmask[kind])
+
+
+def new_request(ipaddr, netmask):
+    ip = parse_ip(ipaddr).normalized()
+    return ip.kind, ip.is_network(netmask[ip.kind])
+
+
+def make_ips(rnd, count):
+    ips = []
+    for i in range(count):
+        r = rnd.random()
+        if r < 0.6:
+            ips.append(str(ipaddress.IPv4Address(rnd.getrandbits(32))))
+        elif r < 0.7:
+            ips.append('::ffff:%s' % ipaddress.IPv4Address(rnd.getrandbits(32)))
+        else:
+            ips.append(str(ipaddress.IPv6Address(rnd.getrandbits(128))))
+    return ips
+
+
+def bench(name, func, ips, *args):
+    n = len(ips)
+    t = min(timeit.repeat(lambda: [func(ip, *args) for ip in ips], number=1, repeat=3))
+    print("%-28s %6.2f us/call" % (name, t / n * 1e6))
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    distinct = int(sys.argv[2]) if len(sys.argv) > 2 else 1000
+    rnd = random.Random(42)
+    # clients come again and again, so there are much less distinct addresses than requests:
+    pool = make_ips(rnd, distinct)
+    ips = [rnd.choice(pool) for i in range(count)]
+    normalized = [old_normalize(ip) for ip in ips]
+    netmask = dict(ipv4=24, ipv6=64)
+
+    assert [old_request(ip, netmask) for ip in ips] == [new_request(ip, netmask) for ip in ips]
+    assert normalized == [parse_ip(ip).normalized().text for ip in ips]
+
+    print("%d calls, %d distinct addresses:" % (count, distinct))
+    bench("netaddr normalize", old_normalize, ips)
+    bench("IP normalize", lambda ip: parse_ip(ip).normalized().text, ips)
+    bench("dnspython+netaddr check", old_check, normalized)
+    bench("IP check", lambda ip: parse_ip(ip).kind, normalized)
+    bench("netaddr is_network", lambda ip: old_is_network(ip, 24 if '.' in ip else 64), normalized)
+    bench("IP is_network", lambda ip: parse_ip(ip).is_network(netmask[parse_ip(ip).kind]), normalized)
+    bench("old request path", old_request, ips, netmask)
+    bench("new request path", new_request, ips, netmask)
+    parse_ip.cache_clear()
+    bench("new request path (no memo)", lambda ip, nm: (parse_ip.cache_clear(), new_request(ip, nm)), ips, netmask)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+"""
+Benchmark /myip requests/second in one WSGI worker (no network, no web server),
+with and without FastPathMiddleware.
+
+Usage (from the repo root, with nsupdate installed):
+
+    DJANGO_SETTINGS_MODULE=nsupdate.settings.dev python scripts/bench/myip.py [requests]
+"""
+
+import logging
+import os
+import sys
+import time
+from io import BytesIO
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "nsupdate.settings.dev")
+
+import django
+django.setup()
+
+from django.conf import settings
+from django.core.handlers.wsgi import WSGIHandler
+
+
+def environ():
+    return {
+        'REQUEST_METHOD': 'GET',
+        'PATH_INFO': '/myip',
+        'QUERY_STRING': '',
+        'SERVER_NAME': 'localhost',
+        'SERVER_PORT': '80',
+        'HTTP_HOST': 'localhost',
+        'REMOTE_ADDR': '192.0.2.1',
+        'SERVER_PROTOCOL': 'HTTP/1.1',
+        'wsgi.url_scheme': 'http',
+        'wsgi.input': BytesIO(),
+        'wsgi.errors': sys.stderr,
+    }
+
+
+def start_response(status, headers):
+    assert status.startswith('200'), status
+
+
+def bench(middleware, count):
+    settings.MIDDLEWARE = middleware
+    handler = WSGIHandler()
+    for i in range(100):  # warm up
+        b''.join(handler(environ(), start_response))
+    t_start = time.perf_counter()
+    for i in range(count):
+        b''.join(handler(environ(), start_response))
+    return count / (time.perf_counter() - t_start)
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    # dev settings log every /myip request at DEBUG level to stderr, we do not want to measure that
+    logging.getLogger('nsupdate.api.views').setLevel(logging.INFO)
+    settings.ALLOWED_HOSTS = ['localhost']
+    full = tuple(settings.MIDDLEWARE)
+    without_fast_path = tuple(m for m in full if m != 'nsupdate.api.middleware.FastPathMiddleware')
+    before = bench(without_fast_path, count)
+    after = bench(full, count)
+    print("/myip without fast path: %8.0f requests/s" % before)
+    print("/myip with fast path:    %8.0f requests/s (%.1fx)" % (after, after / before))
+
+
+if __name__ == '__main__':
+    main()
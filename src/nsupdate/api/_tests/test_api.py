@@ -7,6 +7,7 @@ import pytest
 import base64
 from netaddr import IPSet, IPAddress
 
+from django.core import management
 from django.urls import reverse
 
 from nsupdate.main.dnstools import query_ns, FQDN
@@ -28,6 +29,50 @@ def test_myip(client):
     assert response.content in [b'127.0.0.1', b'::1']
 
 
+def test_myip_fast_path(client, django_assert_num_queries):
+    with django_assert_num_queries(0):
+        response = client.get(reverse('myip'))
+    assert response.status_code == 200
+    # the session middleware did not run
+    assert not hasattr(response.wsgi_request, 'session')
+    assert response['X-Content-Type-Options'] == 'nosniff'
+    assert response['Referrer-Policy'] == 'same-origin'
+    assert response['X-Frame-Options'] == 'DENY'
+
+
+def test_myip_fast_path_disallowed_host(client, settings):
+    settings.ALLOWED_HOSTS = ['nsupdate.example.org']
+    response = client.get(reverse('myip'), HTTP_HOST='evil.example.com')
+    assert response.status_code == 400
+    response = client.get(reverse('myip'), HTTP_HOST='nsupdate.example.org')
+    assert response.status_code == 200
+
+
+def test_nic_update_fast_path(client, settings):
+    settings.FAST_PATH_VIEWS = ['myip', 'nic_update']
+    response = client.get(reverse('nic_update'))
+    assert response.status_code == 401
+    assert response.content == b'badauth'
+    assert not hasattr(response.wsgi_request, 'session')
+
+
+def test_fast_path_async(async_client, settings):
+    from asgiref.sync import async_to_sync, iscoroutinefunction
+    from nsupdate.api.middleware import FastPathMiddleware
+
+    async def get_response(request):
+        pass  # pragma: no cover
+
+    assert iscoroutinefunction(FastPathMiddleware(get_response))
+    settings.FAST_PATH_VIEWS = ['myip', 'nic_update']
+    settings.NIC_UPDATE_ASYNC = True
+    response = async_to_sync(async_client.get)(reverse('myip'))
+    assert response.status_code == 200
+    response = async_to_sync(async_client.get)(reverse('nic_update'))
+    assert response.status_code == 401
+    assert response.content == b'badauth'
+
+
 def test_nic_update_noauth(client):
     response = client.get(reverse('nic_update'))
     assert response.status_code == 401
@@ -182,6 +227,8 @@ def test_nic_update_authorized_update_other_services(client):
     assert response.content == b'good 1.2.3.4'
     # XXX The test below cannot run in parallel (like on GitHub) if updating the same
     # "other service" target host.
+    # The update for the other service was queued, let the relay worker send it:
+    management.call_command('relay')
     # Now check if it updated the other service also:
     assert query_ns(TEST_HOST_OTHER, 'A') == '1.2.3.4'
     response = client.get(reverse('nic_update') + '?myip=2.3.4.5',
@@ -189,6 +236,7 @@ def test_nic_update_authorized_update_other_services(client):
     assert response.status_code == 200
     # Must be good (was different IP).
     assert response.content == b'good 2.3.4.5'
+    management.call_command('relay')
     # Now check if it updated the other service also:
     assert query_ns(TEST_HOST_OTHER, 'A') == '2.3.4.5'
 
@@ -360,3 +408,69 @@ def test_nic_delete_multiple_ips(client):
     if content == 'dnserr':
         pytest.skip("DNS server not available in test environment")
     assert content == 'deleted A,AAAA'
+
+
+@pytest.fixture
+def async_nameserver(monkeypatch):
+    """
+    send async updates to a fake nameserver, pretend that no records exist yet.
+    """
+    import dns.asyncquery
+    from dns.resolver import NXDOMAIN
+    from nsupdate.main import dnstools
+    from nsupdate.main._tests.test_dnspool import FakeNameserver
+    ns = FakeNameserver()
+    tcp = dns.asyncquery.tcp
+    monkeypatch.setattr(dns.asyncquery, 'tcp', lambda q, where, **kw: tcp(q, where, timeout=5, port=ns.port))
+
+    async def aquery_ns(fqdn, rdtype, prefer_primary=False, cached=True):
+        raise NXDOMAIN
+    monkeypatch.setattr(dnstools, 'aquery_ns', aquery_ns)
+    yield ns
+    ns.close()
+
+
+def async_nic_request(view_class, myip):
+    from asgiref.sync import async_to_sync
+    from django.contrib.auth.models import AnonymousUser
+    from django.test import RequestFactory
+    request = RequestFactory().get('/nic/update?myip=%s' % myip,
+                                   HTTP_AUTHORIZATION=make_basic_auth_header(TEST_HOST, TEST_SECRET))
+    request.session = {}
+    request.user = AnonymousUser()
+    return async_to_sync(view_class.as_view())(request)
+
+
+def test_async_nic_update(async_nameserver):
+    from nsupdate.api.views import AsyncNicUpdateView
+    # note: ipv6, so we do not relay the update to other services
+    response = async_nic_request(AsyncNicUpdateView, '2001:db8::1')
+    assert response.status_code == 200
+    assert response.content == b'good 2001:db8::1'
+    # the host and (separately) its related host
+    assert len(async_nameserver.messages) == 2
+
+
+def test_async_nic_delete(async_nameserver):
+    from nsupdate.api.views import AsyncNicDeleteView
+    response = async_nic_request(AsyncNicDeleteView, '::')
+    assert response.status_code == 200
+    assert response.content == b'deleted AAAA'
+
+
+def test_async_nic_update_related_host_fails(async_nameserver, monkeypatch):
+    from nsupdate.api.views import AsyncNicUpdateView
+    from nsupdate.main import dnstools
+    asend_update = dnstools._asend_update
+
+    async def _asend_update(upd, *args):
+        if any(str(rrset.name).startswith(TEST_HOST_RELATED.host) for rrset in upd.update):
+            raise dnstools.DnsUpdateError("related host update failed")
+        return await asend_update(upd, *args)
+    monkeypatch.setattr(dnstools, '_asend_update', _asend_update)
+    # the related hosts are best-effort, the host itself gets updated
+    response = async_nic_request(AsyncNicUpdateView, '2001:db8::1')
+    assert response.content == b'good 2001:db8::1'
+    assert len(async_nameserver.messages) == 1
+    names = set(str(rrset.name) for rrset in async_nameserver.messages[0].update)
+    assert names == {str(TEST_HOST) + '.'}
@@ -0,0 +1,105 @@
+"""
+Middleware for the (usually non-interactive, automated) web API.
+"""
+
+from asgiref.sync import async_to_sync, iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.middleware.clickjacking import XFrameOptionsMiddleware
+from django.middleware.security import SecurityMiddleware
+from django.urls import reverse
+
+from . import views
+
+
+# views that can be served by FastPathMiddleware (url name -> view)
+FAST_PATH_VIEWS = {
+    'myip': views.myip_view,
+    'nic_update': views.NicUpdateView.as_view(),
+    'nic_delete': views.NicDeleteView.as_view(),
+}
+
+# the views used instead if settings.NIC_UPDATE_ASYNC is set (see urls.py)
+FAST_PATH_ASYNC_VIEWS = {
+    'nic_update': views.AsyncNicUpdateView.as_view(),
+    'nic_delete': views.AsyncNicDeleteView.as_view(),
+}
+
+
+class FastPathMiddleware:
+    """
+    Serve some API views directly, bypassing the rest of the middleware stack.
+
+    /myip is our most frequently requested URL and, like /nic/update, it
+    needs neither sessions, csrf protection, auth, messages nor locale
+    handling. Put this middleware first in MIDDLEWARE and list the url names
+    of the views in settings.FAST_PATH_VIEWS.
+
+    Like CommonMiddleware, it validates the host against ALLOWED_HOSTS and
+    like SecurityMiddleware and XFrameOptionsMiddleware, it redirects to https
+    (if configured) and adds the security headers. The responses skip the
+    processing of the other middleware though.
+
+    The middleware supports sync and async requests, so it does not force
+    Django to run the (async) views of an ASGI deployment in a thread.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+        self.views = None
+        # we only use their process_request / process_response methods
+        self.security = SecurityMiddleware(get_response)
+        self.xframe = XFrameOptionsMiddleware(get_response)
+
+    def _get_views(self):
+        views = {}
+        for name in settings.FAST_PATH_VIEWS:
+            if settings.NIC_UPDATE_ASYNC and name in FAST_PATH_ASYNC_VIEWS:
+                views[reverse(name)] = FAST_PATH_ASYNC_VIEWS[name]
+            else:
+                views[reverse(name)] = FAST_PATH_VIEWS[name]
+        return views
+
+    def _get_view(self, request):
+        if self.views is None:
+            # the urlconf is not necessarily loaded when the middleware gets created
+            self.views = self._get_views()
+        return self.views.get(request.path_info)
+
+    def _process_request(self, request):
+        request.get_host()  # raises DisallowedHost if not in ALLOWED_HOSTS
+        return self.security.process_request(request)  # https redirect or None
+
+    def _process_response(self, request, response):
+        response = self.security.process_response(request, response)
+        return self.xframe.process_response(request, response)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        view = self._get_view(request)
+        if view is None:
+            return self.get_response(request)
+        response = self._process_request(request)
+        if response is None:
+            if iscoroutinefunction(view):
+                response = async_to_sync(view)(request)
+            else:
+                response = view(request)
+        return self._process_response(request, response)
+
+    async def __acall__(self, request):
+        view = self._get_view(request)
+        if view is None:
+            return await self.get_response(request)
+        response = self._process_request(request)
+        if response is None:
+            if iscoroutinefunction(view):
+                response = await view(request)
+            else:
+                response = await sync_to_async(view)(request)
+        return self._process_response(request, response)
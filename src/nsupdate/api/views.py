@@ -11,9 +11,7 @@ import base64
 import binascii
 from importlib import import_module
 
-from netaddr import IPAddress, IPNetwork
-from netaddr.core import AddrFormatError
-
+from asgiref.sync import sync_to_async
 from django.http import HttpResponse
 from django.conf import settings
 from django.views.generic.base import View
@@ -21,11 +19,12 @@ from django.contrib.auth.hashers import verify_password
 from django.contrib.auth.decorators import login_required
 from django.utils.decorators import method_decorator
 
-from ..utils import log, ddns_client
-from ..main.models import Host
-from ..main.dnstools import (FQDN, update, delete, check_ip, put_ip_into_session,
+from ..utils import log
+from ..main import credcache, ippolicy, relay
+from ..main.models import Host, host_unit_of_work
+from ..main.dnstools import (FQDN, UpdateBatch, put_ip_into_session, fill_rdns_into_session,
                              SameIpError, DnsUpdateError, NameServerNotAvailable)
-from ..main.iptools import normalize_ip
+from ..main.iptools import IP, normalize_ip, parse_ip
 from .utils import get_session_key_from_token
 
 
@@ -93,6 +92,8 @@ class AjaxGetIps(View):
         :param request: Django request object
         :return: HttpResponse object
         """
+        # the reverse lookups of new IPs are done in the background, maybe they are done now:
+        fill_rdns_into_session(request.session)
         response = dict(
             ipv4=request.session.get('ipv4', ''),
             ipv4_rdns=request.session.get('ipv4_rdns', ''),
@@ -160,10 +161,16 @@ def check_api_auth(username, password, logger=None):
         logger.debug('%s - received bad credentials (auth username == dyndns hostname not in our hosts DB)' % (fqdn, ))
         return None
     if host is not None:
-        ok, must_update = verify_password(password, host.update_secret, preferred='weakargon2')
-        if ok and must_update:
-            # If password is correct but uses a not desired hasher, change it now to the desired one.
-            host.generate_secret(password)
+        if credcache.is_verified(host, password):
+            # we recently verified this secret, no need to compute the hash again.
+            ok = True
+        else:
+            ok, must_update = verify_password(password, host.update_secret, preferred='weakargon2')
+            if ok and must_update:
+                # If password is correct but uses a not desired hasher, change it now to the desired one.
+                host.generate_secret(password)
+            if ok:
+                credcache.remember_verified(host, password)
 
         success_msg = ('failure', 'success')[ok]
         msg = "api authentication %s. [hostname: %s (given in basic auth)]" % (success_msg, fqdn, )
@@ -243,6 +250,7 @@ def _make_response(results):
 
 class NicUpdateView(View):
     @log.logger(__name__)
+    @host_unit_of_work
     def get(self, request, logger=None, delete=False):
         """
         DynDNS2-compatible /nic/update API.
@@ -269,6 +277,22 @@ class NicUpdateView(View):
         :param delete: False means update, True means delete - used by NicDeleteView
         :return: HttpResponse object
         """
+        checked = self.check_request(request, logger)
+        if isinstance(checked, HttpResponse):
+            return checked
+        host, ipaddrs, secure = checked
+        results = _update_or_delete(host, ipaddrs, secure, logger=logger, _delete=delete)
+        return _make_response(results)
+
+    def check_request(self, request, logger):
+        """
+        authenticate and check an update/delete request.
+
+        :param request: Django request object
+        :param logger: a logger object
+        :return: (host, ipaddrs, secure) tuple if the request shall be processed,
+                 HttpResponse object otherwise
+        """
         hostname = request.GET.get('hostname')
         if hostname in settings.BAD_HOSTS:
             return Response('abuse', status=403)
@@ -312,7 +336,7 @@ class NicUpdateView(View):
             logger.warning(msg)
             host.register_client_result(msg, fault=True)
             return Response('badagent')
-        remote_addr = normalize_ip(request.META.get('REMOTE_ADDR'))
+        remote_addr = parse_ip(request.META.get('REMOTE_ADDR')).normalized()
         ipaddr = request.GET.get('myip')
         if not ipaddr:  # None or ''
             ipaddrs = [remote_addr, ]
@@ -322,18 +346,15 @@ class NicUpdateView(View):
             # usually it will be 1 (v4 or v6) or 2 (v4 and v6) addresses.
             ipaddrs = []
             for ip in ipaddr.split(','):
-                ip = _strip_ip(ip)
                 try:
-                    check_ip(ip)
-                    ipaddrs.append(ip)
+                    ipaddrs.append(parse_ip(_strip_ip(ip)))
                 except ValueError:
                     return Response('dnserr')
             if not ipaddrs:
                 # if none of the given IPs are valid, we update to the remote_addr
                 ipaddrs = [remote_addr, ]
         secure = request.is_secure()
-        results = [_update_or_delete(host, ip, secure, logger=logger, _delete=delete) for ip in ipaddrs]
-        return _make_response(results)
+        return host, ipaddrs, secure
 
 
 class NicDeleteView(NicUpdateView):
@@ -354,6 +375,41 @@ class NicDeleteView(NicUpdateView):
         return super(NicDeleteView, self).get(request, logger=logger, delete=delete)
 
 
+class AsyncNicUpdateView(NicUpdateView):
+    @log.logger(__name__)
+    @host_unit_of_work
+    async def get(self, request, logger=None, delete=False):
+        """
+        async variant of NicUpdateView (for ASGI deployments).
+
+        While we wait for the nameserver, the process can serve other requests.
+        DB access still happens in a thread (via sync_to_async), only the DNS
+        I/O is done in the event loop.
+
+        :param request: Django request object
+        :param delete: False means update, True means delete - used by AsyncNicDeleteView
+        :return: HttpResponse object
+        """
+        checked = await sync_to_async(self.check_request)(request, logger)
+        if isinstance(checked, HttpResponse):
+            return checked
+        host, ipaddrs, secure = checked
+        results = await _aupdate_or_delete(host, ipaddrs, secure, logger=logger, _delete=delete)
+        return _make_response(results)
+
+
+class AsyncNicDeleteView(AsyncNicUpdateView):
+    @log.logger(__name__)
+    async def get(self, request, logger=None, delete=True):
+        """
+        async variant of NicDeleteView (for ASGI deployments).
+
+        :param request: django request object
+        :return: HttpResponse object
+        """
+        return await super(AsyncNicDeleteView, self).get(request, logger=logger, delete=delete)
+
+
 class AuthorizedNicUpdateView(View):
 
     @method_decorator(login_required)
@@ -361,6 +417,7 @@ class AuthorizedNicUpdateView(View):
         return super(AuthorizedNicUpdateView, self).dispatch(*args, **kwargs)
 
     @log.logger(__name__)
+    @host_unit_of_work
     def get(self, request, logger=None, delete=False):
         """
         similar to NicUpdateView, but the client is not a router or other dyndns client,
@@ -384,7 +441,7 @@ class AuthorizedNicUpdateView(View):
         logger.info("authenticated by session as user %s, creator of host %s" % (request.user.username, hostname))
         # note: we do not check the user agent here as this is interactive
         # and logged-in usage - thus misbehaved user agents are no problem.
-        remote_addr = normalize_ip(request.META.get('REMOTE_ADDR'))
+        remote_addr = parse_ip(request.META.get('REMOTE_ADDR')).normalized()
         ipaddr = request.GET.get('myip')
         if not ipaddr:  # None or empty string
             ipaddrs = [remote_addr, ]
@@ -394,16 +451,14 @@ class AuthorizedNicUpdateView(View):
             # usually it will be 1 (v4 or v6) or 2 (v4 and v6) addresses.
             ipaddrs = []
             for ip in ipaddr.split(','):
-                ip = _strip_ip(ip)
                 try:
-                    check_ip(ip)
-                    ipaddrs.append(ip)
+                    ipaddrs.append(parse_ip(_strip_ip(ip)))
                 except ValueError:
                     continue
             if not ipaddrs:
                 ipaddrs = [remote_addr, ]
         secure = request.is_secure()
-        results = [_update_or_delete(host, ip, secure, logger=logger, _delete=delete) for ip in ipaddrs]
+        results = _update_or_delete(host, ipaddrs, secure, logger=logger, _delete=delete)
         return _make_response(results)
 
 
@@ -420,16 +475,62 @@ class AuthorizedNicDeleteView(AuthorizedNicUpdateView):
         return super(AuthorizedNicDeleteView, self).get(request, logger=logger, delete=delete)
 
 
-def _update_or_delete(host, ipaddr, secure=False, logger=None, _delete=False):
+def _update_or_delete(host, ipaddrs, secure=False, logger=None, _delete=False):
     """
     common code shared by the 2 update/delete views
 
+    the dns changes for all given ip addresses are collected into one batch,
+    so they need only one dynamic update per zone. the changes of the related
+    hosts go into a second batch, sent afterwards: they are best-effort and
+    must not make the update of the host itself fail.
+
+    :param host: host object
+    :param ipaddrs: list of ip addrs (v4 or v6, str or iptools.IP objects)
+    :param secure: True if we use TLS/https
+    :param logger: a logger object
+    :param _delete: True for delete, False for update
+    :return: list of dyndns2 response strings (one per ip addr)
+    """
+    batch, related_batch = UpdateBatch(), UpdateBatch()
+    results = [_prepare_update_or_delete(host, ipaddr, batch, related_batch, secure, logger, _delete)
+               for ipaddr in ipaddrs]
+    batch.send()
+    related_batch.send()
+    return [result() if callable(result) else result for result in results]
+
+
+async def _aupdate_or_delete(host, ipaddrs, secure=False, logger=None, _delete=False):
+    """
+    async variant of _update_or_delete, see there.
+    """
+    batch, related_batch = UpdateBatch(), UpdateBatch()
+
+    def prepare():
+        return [_prepare_update_or_delete(host, ipaddr, batch, related_batch, secure, logger, _delete)
+                for ipaddr in ipaddrs]
+
+    def finish(results):
+        return [result() if callable(result) else result for result in results]
+
+    results = await sync_to_async(prepare)()
+    await batch.asend()
+    await related_batch.asend()
+    return await sync_to_async(finish)(results)
+
+
+def _prepare_update_or_delete(host, ipaddr, batch, related_batch, secure, logger, _delete):
+    """
+    check an update/delete request for one ip addr and queue the dns changes into batch.
+
     :param host: host object
-    :param ipaddr: ip addr (v4 or v6)
+    :param ipaddr: ip addr (v4 or v6, str or iptools.IP object)
+    :param batch: dnstools.UpdateBatch
+    :param related_batch: dnstools.UpdateBatch for the changes of the related hosts
     :param secure: True if we use TLS/https
     :param logger: a logger object
     :param _delete: True for delete, False for update
-    :return: dyndns2 response string
+    :return: dyndns2 response string (if there is nothing to send) or
+             a function returning it (to be called after the batch was sent)
     """
     mode = ('update', 'delete')[_delete]  # only use this for logging
     # we are doing abuse / available checks rather late, so the client might
@@ -448,17 +549,15 @@ def _update_or_delete(host, ipaddr, secure=False, logger=None, _delete=False):
         host.register_client_result(msg, fault=False)
         return 'nohost'
     try:
-        ipaddr = _strip_ip(ipaddr)
-        kind = check_ip(ipaddr, ('ipv4', 'ipv6'))
-        rdtype = 'A' if kind == 'ipv4' else 'AAAA'
-        IPNetwork(ipaddr)  # raise AddrFormatError here if there is an issue with ipaddr, see #394
-    except (ValueError, UnicodeError, AddrFormatError):
+        ip = ipaddr if isinstance(ipaddr, IP) else parse_ip(_strip_ip(ipaddr))
+    except (ValueError, UnicodeError):
         # invalid ip address string
         # some people manage to even give a non-ascii string instead of an ip addr
         msg = '%s - received bad ip address: %r' % (fqdn, ipaddr)
         logger.warning(msg)
         host.register_client_result(msg, fault=True)
         return 'dnserr'  # there should be a better response code for this
+    kind, rdtype, ipaddr = ip.kind, ip.rdtype, ip.text
 
     # If we receive an update request with an address that has only the network prefix,
     # but the interface id is all-zero, we will NOT update DNS with a useless A or AAAA record,
@@ -473,56 +572,68 @@ def _update_or_delete(host, ipaddr, secure=False, logger=None, _delete=False):
         else:
             raise ValueError('unknown ip address kind: %s' % kind)
         # we do not want to update A/AAAA records with network addresses:
-        is_network = not single_ip and IPNetwork("%s/%d" % (ipaddr, netmask)).network == IPAddress(ipaddr)
+        is_network = not single_ip and ip.is_network(netmask)
         if is_network:
             logger.info('%s - received %s for host %s, but address has only network prefix, deleting instead' % (fqdn, mode, ipaddr, ))
     else:
         is_network = False
 
-    if not _delete and IPAddress(ipaddr) in settings.BAD_IPS_HOST:
+    if not _delete and ippolicy.is_blocked(ip.address, fqdn.domain):
         msg = '%s - received %s to blacklisted ip address: %r' % (fqdn, mode, ipaddr)
         logger.warning(msg)
-        host.abuse = True
-        host.abuse_blocked = True
-        host.register_client_result(msg, fault=True)
+        host.register_abuse(msg)
         return 'abuse'
     host.poke(kind, secure)
-    try:
-        if _delete or is_network:
-            delete(fqdn, rdtype)
-        else:
-            update(fqdn, ipaddr)
-    except SameIpError:
-        msg = '%s - received no-change update, ip: %s tls: %r' % (fqdn, ipaddr, secure)
-        logger.warning(msg)
-        host.register_client_result(msg, fault=True)
-        return 'nochg %s' % ipaddr
-    except (DnsUpdateError, NameServerNotAvailable) as e:
-        msg = str(e)
-        msg = '%s - received %s that resulted in a dns error [%s], ip: %s tls: %r' % (
-            fqdn, mode, msg, ipaddr, secure)
-        logger.error(msg)
-        host.register_server_result(msg, fault=True)
-        return 'dnserr'
+    related_changes = []
+    if _delete or is_network:
+        change = batch.delete(fqdn, rdtype)
     else:
-        if _delete:
-            msg = '%s - received delete for record %s, tls: %r' % (fqdn, rdtype, secure)
+        change = batch.update(fqdn, ipaddr)
+        related_changes = _queue_related_hosts(host, fqdn, ip, related_batch, change, logger)
+
+    def finish():
+        try:
+            change.raise_error()
+        except SameIpError:
+            msg = '%s - received no-change update, ip: %s tls: %r' % (fqdn, ipaddr, secure)
+            logger.warning(msg)
+            host.register_client_result(msg, fault=True)
+            return 'nochg %s' % ipaddr
+        except (DnsUpdateError, NameServerNotAvailable) as e:
+            msg = str(e)
+            msg = '%s - received %s that resulted in a dns error [%s], ip: %s tls: %r' % (
+                fqdn, mode, msg, ipaddr, secure)
+            logger.error(msg)
+            host.register_server_result(msg, fault=True)
+            return 'dnserr'
         else:
-            msg = '%s - received good update -> ip: %s tls: %r' % (fqdn, ipaddr, secure)
-        logger.info(msg)
-        host.register_client_result(msg, fault=False)
-        if _delete:
-            # XXX unclear what to do for "other services" we relay updates to
-            return 'deleted %s' % rdtype
-        else:  # update
-            _on_update_success(host, fqdn, kind, ipaddr, secure, logger)
-            return 'good %s' % ipaddr
+            if _delete:
+                msg = '%s - received delete for record %s, tls: %r' % (fqdn, rdtype, secure)
+            else:
+                msg = '%s - received good update -> ip: %s tls: %r' % (fqdn, ipaddr, secure)
+            logger.info(msg)
+            host.register_client_result(msg, fault=False)
+            if _delete:
+                # XXX unclear what to do for "other services" we relay updates to
+                return 'deleted %s' % rdtype
+            else:  # update
+                _on_update_success(host, fqdn, kind, ipaddr, secure, logger, related_changes)
+                return 'good %s' % ipaddr
 
+    return finish
 
-def _on_update_success(host, fqdn, kind, ipaddr, secure, logger):
-    """after updating the host in dns, do related other updates"""
-    # update related hosts
-    rdtype = 'A' if kind == 'ipv4' else 'AAAA'
+
+def _queue_related_hosts(host, fqdn, ip, batch, main_change, logger):
+    """
+    queue the dns changes for the related hosts of host into batch.
+
+    they are only done if the change of the main host succeeds.
+
+    :param ip: the new IP object of host
+    :return: list of queued RecordChange objects
+    """
+    kind, rdtype = ip.kind, ip.rdtype
+    changes = []
     for rh in host.relatedhosts.all():
         if rh.available:
             if kind == 'ipv4':
@@ -536,49 +647,44 @@ def _on_update_success(host, fqdn, kind, ipaddr, secure, logger):
             try:
                 rh_fqdn = FQDN(rh.name + '.' + fqdn.host, fqdn.domain)
                 if not _delete:
-                    ifid = IPAddress(ifid)
-                    network = IPNetwork("%s/%d" % (ipaddr, netmask))
-                    rh_ipaddr = str(IPAddress(network.network) + int(ifid))
-            except (IndexError, AddrFormatError, ValueError) as e:
+                    rh_ipaddr = ip.with_interface_id(netmask, parse_ip(ifid)).text
+            except ValueError as e:
                 logger.warning("trouble computing address of related host %s [%s]" % (rh, e))
             else:
                 if not _delete:
-                    logger.info("updating related host %s -> %s" % (rh_fqdn, rh_ipaddr))
+                    changes.append(batch.update(rh_fqdn, rh_ipaddr, depends_on=main_change))
                 else:
-                    logger.info("deleting related host %s" % (rh_fqdn, ))
-                try:
-                    if not _delete:
-                        update(rh_fqdn, rh_ipaddr)
-                    else:
-                        delete(rh_fqdn, rdtype)
-                except SameIpError:
-                    msg = '%s - related hosts no-change update, ip: %s tls: %r' % (rh_fqdn, rh_ipaddr, secure)
-                    logger.warning(msg)
-                    host.register_client_result(msg, fault=True)
-                except (DnsUpdateError, NameServerNotAvailable) as e:
-                    msg = str(e)
-                    if not _delete:
-                        msg = '%s - related hosts update that resulted in a dns error [%s], ip: %s tls: %r' % (
-                            rh_fqdn, msg, rh_ipaddr, secure)
-                    else:
-                        msg = '%s - related hosts deletion that resulted in a dns error [%s], tls: %r' % (
-                            rh_fqdn, msg, secure)
-                    logger.error(msg)
-                    host.register_server_result(msg, fault=True)
-
-    # now check if there are other services we shall relay updates to:
-    for hc in host.serviceupdaterhostconfigs.all():
-        if (kind == 'ipv4' and hc.give_ipv4 and hc.service.accept_ipv4
-            or
-            kind == 'ipv6' and hc.give_ipv6 and hc.service.accept_ipv6):
-            kwargs = dict(
-                name=hc.name, password=hc.password,
-                hostname=hc.hostname, myip=ipaddr,
-                server=hc.service.server, path=hc.service.path, secure=hc.service.secure,
-            )
-            try:
-                ddns_client.dyndns2_update(**kwargs)
-            except Exception:
-                # we never want to crash here
-                kwargs.pop('password')
-                logger.exception("the dyndns2 updater raised an exception [%r]" % kwargs)
+                    changes.append(batch.delete(rh_fqdn, rdtype, depends_on=main_change))
+    return changes
+
+
+def _on_update_success(host, fqdn, kind, ipaddr, secure, logger, related_changes):
+    """after updating the host in dns, do related other updates"""
+    # check the results of the related hosts updates
+    for change in related_changes:
+        rh_fqdn, rh_ipaddr = change.fqdn, change.ipaddr
+        _delete = change.action == 'del'
+        if not _delete:
+            logger.info("updating related host %s -> %s" % (rh_fqdn, rh_ipaddr))
+        else:
+            logger.info("deleting related host %s" % (rh_fqdn, ))
+        try:
+            change.raise_error()
+        except SameIpError:
+            msg = '%s - related hosts no-change update, ip: %s tls: %r' % (rh_fqdn, rh_ipaddr, secure)
+            logger.warning(msg)
+            host.register_client_result(msg, fault=True)
+        except (DnsUpdateError, NameServerNotAvailable) as e:
+            msg = str(e)
+            if not _delete:
+                msg = '%s - related hosts update that resulted in a dns error [%s], ip: %s tls: %r' % (
+                    rh_fqdn, msg, rh_ipaddr, secure)
+            else:
+                msg = '%s - related hosts deletion that resulted in a dns error [%s], tls: %r' % (
+                    rh_fqdn, msg, secure)
+            logger.error(msg)
+            host.register_server_result(msg, fault=True)
+
+    # now check if there are other services we shall relay updates to,
+    # the relay worker will do that, so we need not wait for them here:
+    relay.enqueue(host, kind, ipaddr)
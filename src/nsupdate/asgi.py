@@ -0,0 +1,17 @@
+"""
+ASGI configuration for the nsupdate project.
+
+This module exposes a module-level variable named ``application`` for ASGI
+servers (like uvicorn, daphne or gunicorn with uvicorn workers).
+
+If you run nsupdate.info via ASGI, set NIC_UPDATE_ASYNC = True in your
+settings, so the /nic/update and /nic/delete views do their DNS I/O
+asynchronously.
+"""
+import os
+
+# see wsgi.py
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "nsupdate.settings.dev")
+
+from django.core.asgi import get_asgi_application
+application = get_asgi_application()
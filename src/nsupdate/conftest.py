@@ -65,6 +65,43 @@ def ddns_fqdn(ddns_hostname):
     yield FQDN(ddns_hostname, TESTDOMAIN)
 
 
+@pytest.fixture(autouse=True)
+def clear_answer_cache():
+    """
+    do not let dns answers remembered by one test influence other tests
+    """
+    from nsupdate.main.dnstools import answer_cache
+    answer_cache.clear()
+
+
+@pytest.fixture(autouse=True)
+def clear_rdns_cache():
+    """
+    do not let reverse dns names looked up for one test influence other tests
+    """
+    from nsupdate.main.dnstools import rdns_cache
+    rdns_cache.clear()
+
+
+@pytest.fixture(autouse=True)
+def clear_blacklist_cache():
+    """
+    the database changes of a test get rolled back without sending signals,
+    so do not let the blacklist of one test influence other tests
+    """
+    from nsupdate.main.blacklist import cache
+    cache.invalidate()
+
+
+@pytest.fixture(autouse=True)
+def clear_ip_policy_cache():
+    """
+    like clear_blacklist_cache, for the ip policy
+    """
+    from nsupdate.main.ippolicy import cache
+    cache.invalidate()
+
+
 # Note: fixture must be "function" scope (default), see https://github.com/pelme/pytest_django/issues/33
 @pytest.fixture(autouse=True)
 def db_init(db):  # note: db is a predefined fixture and required here to have the db available
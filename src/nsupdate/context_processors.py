@@ -9,7 +9,7 @@ logger = logging.getLogger(__name__)
 
 import time
 
-from .main.dnstools import put_ip_into_session
+from .main.dnstools import put_ip_into_session, fill_rdns_into_session, get_ip_timestamp
 from .main.iptools import normalize_ip
 from .api.utils import generate_detectip_token
 
@@ -44,16 +44,20 @@ def update_ips(request):
     """
     # XXX Is a context processor the right place for this?
     s = request.session
+    if settings.MINIMIZE_SESSION_WRITES and s.session_key is None and not request.user.is_authenticated:
+        # Do not create a session (a database record) just because someone (e.g.
+        # a crawler) looks at some page; views that need the IPs in the session
+        # (like the home view) create it, see create_session.
+        return {}
     t_now = int(time.time())
     # Update and keep fresh using info from the request we have anyway:
     ipaddr = normalize_ip(request.META['REMOTE_ADDR'])
     put_ip_into_session(s, ipaddr, max_age=MAX_IP_AGE / 2)
+    fill_rdns_into_session(s)
     # Remove stale data to not show outdated IPs (e.g., after losing IPv6 connectivity):
     for key in ['ipv4', 'ipv6']:
-        timestamp_key = "%s_timestamp" % key
-        try:
-            timestamp = s[timestamp_key]
-        except KeyError:
+        timestamp = get_ip_timestamp(s, key)
+        if timestamp is None:
             # Should always be there; initialize it:
             put_ip_into_session(s, '', kind=key)
         else:
@@ -72,11 +76,18 @@ def update_ips(request):
         # If we have a new session (== not loaded from database/storage), we
         # MUST save it here to create its session_key, as the base.html template
         # uses .session_key to build the URL for detectip:
-        try:
-            s.save()
-        except OperationalError:
-            # If, e.g., the database is locked (SQLite), do not raise here,
-            # because it causes ugly tracebacks in emails even if Django
-            # was just rendering the 404 template for the current request; see #356.
-            pass
+        create_session(request)
     return {}
+
+
+def create_session(request):
+    """
+    Save the (new) session of request, so it gets a session_key.
+    """
+    try:
+        request.session.save()
+    except OperationalError:
+        # If, e.g., the database is locked (SQLite), do not raise here,
+        # because it causes ugly tracebacks in emails even if Django
+        # was just rendering the 404 template for the current request; see #356.
+        pass
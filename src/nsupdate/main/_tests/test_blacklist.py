@@ -0,0 +1,70 @@
+"""
+Tests for the blacklist module.
+"""
+
+import re
+
+import pytest
+
+from django.contrib.auth import get_user_model
+from django.core.exceptions import ValidationError
+
+from ..blacklist import Matcher, literal, cache
+from ..models import BlacklistedHost, host_blacklist_validator
+
+
+@pytest.mark.parametrize("pattern, expected", [
+    ('paypal', 'paypal'),
+    (r'bank\.com', 'bank.com'),
+    ('bank.com', None),
+    ('^paypal$', None),
+    (r'\d+', None),
+    ('', None),
+])
+def test_literal(pattern, expected):
+    assert literal(pattern) == expected
+
+
+def test_matcher_like_re_search():
+    patterns = ['paypal', r'bank\.com', '^www$', 'x.y', r'(ab)\1', '(?i)evil', '[invalid']
+    matcher = Matcher(patterns)
+    for name in ['paypal', 'mypaypal-login', 'bank.com', 'bankxcom', 'www', 'wwwx', 'xzy', 'abab', 'ab',
+                 'EVIL', 'good', '']:
+        expected = any(re.search(p, name) for p in patterns[:-1])
+        assert matcher.search(name) == expected, name
+
+
+@pytest.mark.parametrize("patterns, name", [
+    (['(x)y', r'(a)\1'], 'aa'),
+    (['(x)y', r'(?P<c>a)(?P=c)'], 'aa'),
+    (['(x)y', r'(a)?(?(1)b|c)'], 'ab'),
+    (['(x)y', '(?i)evil'], 'EVIL'),
+    (['(?P<c>x)y', '(?P<c>a)b'], 'ab'),
+])
+def test_matcher_standalone_patterns(patterns, name):
+    # these patterns do not work (the same) in a combined regex, but must still match
+    assert re.search(patterns[1], name)
+    assert Matcher(patterns).search(name)
+    assert not Matcher(patterns).search('zzz')
+
+
+def test_validator_uses_cache(django_assert_num_queries):
+    user = get_user_model().objects.get(username='test')
+    BlacklistedHost.objects.create(name_re='forbidden', created_by=user)
+    with pytest.raises(ValidationError):
+        host_blacklist_validator('some-forbidden-name')
+    with django_assert_num_queries(0):
+        host_blacklist_validator('allowed')
+    version = cache.version
+    BlacklistedHost.objects.filter(name_re='forbidden').get().delete()
+    assert cache.version > version
+    host_blacklist_validator('some-forbidden-name')
+
+
+def test_validator_backreference():
+    user = get_user_model().objects.get(username='test')
+    BlacklistedHost.objects.create(name_re='(x)y', created_by=user)
+    BlacklistedHost.objects.create(name_re=r'(bad)-\1', created_by=user)
+    with pytest.raises(ValidationError):
+        host_blacklist_validator('very-bad-bad-name')
+    host_blacklist_validator('bad-good-name')
@@ -0,0 +1,50 @@
+"""
+Tests for the credcache module.
+"""
+
+from django.contrib.auth.hashers import make_password
+
+from nsupdate.api import views
+from nsupdate.api.views import check_api_auth
+from nsupdate.conftest import TEST_HOST, TEST_SECRET
+
+from ..credcache import cache
+from ..models import Host
+
+
+def test_skip_hashing_when_verified(monkeypatch):
+    calls = []
+    verify_password = views.verify_password
+
+    def counting_verify_password(*args, **kwargs):
+        calls.append(args)
+        return verify_password(*args, **kwargs)
+    monkeypatch.setattr(views, 'verify_password', counting_verify_password)
+    cache.clear()
+    assert check_api_auth(str(TEST_HOST), TEST_SECRET) is not None
+    assert check_api_auth(str(TEST_HOST), TEST_SECRET) is not None
+    assert len(calls) == 1
+    # wrong secrets are always checked
+    assert check_api_auth(str(TEST_HOST), 'wrong') is None
+    assert check_api_auth(str(TEST_HOST), 'wrong') is None
+    assert len(calls) == 3
+    # the verified secret is still remembered
+    assert check_api_auth(str(TEST_HOST), TEST_SECRET) is not None
+    assert len(calls) == 3
+
+
+def test_invalidated_by_new_secret():
+    cache.clear()
+    assert check_api_auth(str(TEST_HOST), TEST_SECRET) is not None
+    host = Host.get_by_fqdn(str(TEST_HOST))
+    new_secret = host.generate_secret()
+    assert check_api_auth(str(TEST_HOST), TEST_SECRET) is None
+    assert check_api_auth(str(TEST_HOST), new_secret) is not None
+
+
+def test_secret_changed_elsewhere():
+    # e.g. by another process, which could not invalidate our cache
+    cache.clear()
+    assert check_api_auth(str(TEST_HOST), TEST_SECRET) is not None
+    Host.objects.filter(name=TEST_HOST.host).update(update_secret=make_password('other', hasher='weakargon2'))
+    assert check_api_auth(str(TEST_HOST), TEST_SECRET) is None
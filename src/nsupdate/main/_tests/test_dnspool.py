@@ -0,0 +1,126 @@
+"""
+Tests for the dnspool module.
+"""
+
+import socket
+import struct
+import threading
+
+import pytest
+
+import dns.message
+import dns.rcode
+import dns.tsig
+import dns.tsigkeyring
+import dns.update
+
+from ..dnspool import ConnectionPool
+
+KEYNAME = 'tests.nsupdate.info'
+SECRET = 'YWFhYWFhYWFhYWFhYWFhYWFhYWFhYWFhYWFhYWFhYWFhYWFhYWFhYWFhYWFhYWFhYWFhYWFhYWFhYWFhYWFhYQ=='
+KEYRING = dns.tsigkeyring.from_text({KEYNAME: SECRET})
+
+
+def _recv_exactly(conn, count):
+    data = b''
+    while len(data) < count:
+        chunk = conn.recv(count - len(data))
+        if not chunk:
+            raise EOFError
+        data += chunk
+    return data
+
+
+class FakeNameserver:
+    """
+    A minimal TCP nameserver answering every (TSIG signed) message with NOERROR.
+
+    If close_after is set, it closes a connection after that many answers.
+    """
+    def __init__(self, close_after=None):
+        self.close_after = close_after
+        self.connections = 0
+        self.messages = []
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.bind(('127.0.0.1', 0))
+        self.sock.listen(16)
+        self.port = self.sock.getsockname()[1]
+        threading.Thread(target=self.serve, daemon=True).start()
+
+    def serve(self):
+        while True:
+            try:
+                conn, addr = self.sock.accept()
+            except OSError:
+                return
+            self.connections += 1
+            threading.Thread(target=self.handle, args=(conn, ), daemon=True).start()
+
+    def handle(self, conn):
+        answered = 0
+        with conn:
+            while self.close_after is None or answered < self.close_after:
+                try:
+                    length = struct.unpack('!H', _recv_exactly(conn, 2))[0]
+                    wire = _recv_exactly(conn, length)
+                except (EOFError, OSError):
+                    return
+                q = dns.message.from_wire(wire, keyring=KEYRING)
+                self.messages.append(q)
+                response = dns.message.make_response(q).to_wire()
+                conn.sendall(struct.pack('!H', len(response)) + response)
+                answered += 1
+
+    def close(self):
+        self.sock.close()
+
+
+@pytest.fixture
+def nameserver():
+    ns = FakeNameserver()
+    yield ns
+    ns.close()
+
+
+def make_update(ip='1.2.3.4'):
+    upd = dns.update.Update(KEYNAME, keyring=KEYRING, keyalgorithm=dns.tsig.HMAC_SHA512)
+    upd.replace('test', 60, 'A', ip)
+    return upd
+
+
+def test_reuses_connection(nameserver):
+    pool = ConnectionPool()
+    for ip in ['1.1.1.1', '2.2.2.2', '3.3.3.3']:
+        response = pool.query(make_update(ip), '127.0.0.1', timeout=5, port=nameserver.port)
+        assert response.rcode() == dns.rcode.NOERROR
+    assert len(nameserver.messages) == 3
+    assert nameserver.connections == 1
+    pool.close_all()
+
+
+def test_reconnects_after_close():
+    nameserver = FakeNameserver(close_after=1)
+    pool = ConnectionPool()
+    try:
+        for ip in ['1.1.1.1', '2.2.2.2']:
+            response = pool.query(make_update(ip), '127.0.0.1', timeout=5, port=nameserver.port)
+            assert response.rcode() == dns.rcode.NOERROR
+        assert len(nameserver.messages) == 2
+        assert nameserver.connections == 2
+    finally:
+        pool.close_all()
+        nameserver.close()
+
+
+def test_idle_eviction(nameserver):
+    pool = ConnectionPool(idle_timeout=0)
+    pool.query(make_update(), '127.0.0.1', timeout=5, port=nameserver.port)
+    pool.query(make_update(), '127.0.0.1', timeout=5, port=nameserver.port)
+    assert nameserver.connections == 2
+
+
+def test_max_idle(nameserver):
+    pool = ConnectionPool(max_idle=0)
+    pool.query(make_update(), '127.0.0.1', timeout=5, port=nameserver.port)
+    pool.query(make_update(), '127.0.0.1', timeout=5, port=nameserver.port)
+    assert nameserver.connections == 2
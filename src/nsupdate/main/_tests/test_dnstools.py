@@ -4,13 +4,20 @@ Tests for the dnstools module.
 
 from __future__ import print_function
 
+import threading
+
 import pytest
 
 pytestmark = pytest.mark.django_db
 
+import dns.resolver
 from dns.resolver import NXDOMAIN, NoAnswer
 
-from ..dnstools import (add, delete, update, query_ns, rev_lookup, update_ns,
+from nsupdate.utils.ttlcache import TTLCache
+
+from .. import dnstools
+from ..dnstools import (add, delete, update, query_ns, query_ns_many, rev_lookup, update_ns, UpdateBatch,
+                        ResolverRegistry, ReverseResolver, put_ip_into_session, fill_rdns_into_session,
                         SameIpError, DnsUpdateError, FQDN)
 
 # See also conftest.py
@@ -127,6 +134,61 @@ class TestReverseLookup(object):
         assert rev_lookup(ip) == name
 
 
+class TestReverseResolver(object):
+    @pytest.fixture
+    def gate(self):
+        gate = threading.Event()
+        gate.set()
+        return gate
+
+    @pytest.fixture
+    def lookups(self, monkeypatch, gate):
+        lookups = []
+
+        def fake_rev_lookup(ipaddr):
+            gate.wait(5)
+            lookups.append(ipaddr)
+            if ipaddr == '192.0.2.99':
+                raise OSError('resolver crashed')
+            return 'host-%s.example.org' % ipaddr.replace('.', '-') if ipaddr.startswith('192.') else ''
+
+        monkeypatch.setattr(dnstools, 'rev_lookup', fake_rev_lookup)
+        return lookups
+
+    def test_lookup(self, lookups, gate):
+        resolver = ReverseResolver(TTLCache(ttl=60), workers=2)
+        gate.clear()
+        assert resolver.lookup('192.0.2.1') is None  # not known yet, lookup started
+        assert resolver.lookup('192.0.2.1') is None  # still not known, no second lookup
+        assert resolver.lookup('198.51.100.1') is None
+        assert resolver.lookup('192.0.2.99') is None
+        gate.set()
+        resolver.shutdown()
+        assert resolver.lookup('192.0.2.1') == 'host-192-0-2-1.example.org'
+        assert resolver.lookup('198.51.100.1') == ''  # no reverse dns entry
+        assert resolver.lookup('192.0.2.99') == ''
+        assert sorted(lookups) == ['192.0.2.1', '192.0.2.99', '198.51.100.1']
+
+    def test_lookup_synchronous(self, lookups):
+        resolver = ReverseResolver(TTLCache(ttl=60), workers=0)
+        assert resolver.lookup('192.0.2.1') == 'host-192-0-2-1.example.org'
+        assert resolver.lookup('192.0.2.1') == 'host-192-0-2-1.example.org'
+        assert lookups == ['192.0.2.1']
+
+    def test_session(self, lookups):
+        session = {}
+        put_ip_into_session(session, '192.0.2.1')
+        assert session['ipv4'] == '192.0.2.1'
+        assert session['ipv4_rdns'] == ''  # filled in later
+        dnstools.rdns_resolver.shutdown()
+        fill_rdns_into_session(session)
+        assert session['ipv4_rdns'] == 'host-192-0-2-1.example.org'
+        # ip did not change, no new lookup
+        put_ip_into_session(session, '192.0.2.1')
+        assert session['ipv4_rdns'] == 'host-192-0-2-1.example.org'
+        assert lookups == ['192.0.2.1']
+
+
 class TestUpdate(object):
     def test_add_del_v4(self, ddns_fqdn):
         host, ip = ddns_fqdn, '1.1.1.1'
@@ -199,3 +261,222 @@ class TestUpdate(object):
         with pytest.raises(DnsUpdateError):
             response = update_ns(INVALID_HOST, 'A', '6.6.6.6', action='upd', ttl=60)
             print(response)
+
+
+class TestUpdateBatch(object):
+    @pytest.fixture
+    def nameserver(self, monkeypatch):
+        """
+        send all updates to a fake nameserver, pretend that all records do not exist yet.
+        """
+        from .. import dnstools
+        from ..dnspool import ConnectionPool
+        from .test_dnspool import FakeNameserver
+        ns = FakeNameserver()
+        pool = ConnectionPool()
+        monkeypatch.setattr(dnstools.pool, 'query', lambda q, where, **kw: pool.query(q, where, timeout=5, port=ns.port))
+
+        def query_ns(fqdn, rdtype, prefer_primary=False, cached=True):
+            raise NXDOMAIN
+
+        async def aquery_ns(fqdn, rdtype, prefer_primary=False, cached=True):
+            raise NXDOMAIN
+        monkeypatch.setattr(dnstools, 'query_ns', query_ns)
+        monkeypatch.setattr(dnstools, 'aquery_ns', aquery_ns)
+        monkeypatch.setattr(dnstools, 'answer_cache', TTLCache())
+        yield ns
+        pool.close_all()
+        ns.close()
+
+    def test_one_message_per_zone(self, nameserver):
+        from nsupdate.conftest import TEST_HOST
+        batch = UpdateBatch()
+        main = batch.update(TEST_HOST, '1.2.3.4')
+        rh4 = batch.update(FQDN('rh.' + TEST_HOST.host, TEST_HOST.domain), '1.2.3.1', depends_on=main)
+        rh6 = batch.delete(FQDN('rh.' + TEST_HOST.host, TEST_HOST.domain), 'AAAA', depends_on=main)
+        batch.send()
+        assert [c.error for c in (main, rh4, rh6)] == [None, None, None]
+        assert len(nameserver.messages) == 1
+        names = set(str(rrset.name) for rrset in nameserver.messages[0].update)
+        assert names == {str(TEST_HOST) + '.', 'rh.' + str(TEST_HOST) + '.'}
+
+    def test_skip_dependent_changes(self, nameserver, monkeypatch):
+        from nsupdate.conftest import TEST_HOST
+        from .. import dnstools
+
+        async def aquery_ns(fqdn, rdtype, prefer_primary=False, cached=True):
+            return '1.2.3.4'
+        monkeypatch.setattr(dnstools, 'aquery_ns', aquery_ns)
+        batch = UpdateBatch()
+        main = batch.update(TEST_HOST, '1.2.3.4')
+        rh = batch.update(FQDN('rh.' + TEST_HOST.host, TEST_HOST.domain), '1.2.3.1', depends_on=main)
+        batch.send()
+        assert isinstance(main.error, SameIpError)
+        assert rh.skipped and rh.error is None
+        assert nameserver.messages == []
+
+    def test_concurrent_checks(self, nameserver, monkeypatch):
+        import asyncio
+        from nsupdate.conftest import TEST_HOST
+        from .. import dnstools
+        queried = []
+
+        async def aquery_ns(fqdn, rdtype, prefer_primary=False, cached=True):
+            queried.append(rdtype)
+            for i in range(100):
+                if len(queried) == 2:  # both queries are in flight at the same time
+                    raise NXDOMAIN
+                await asyncio.sleep(0.01)
+            raise AssertionError("queries were not concurrent")
+        monkeypatch.setattr(dnstools, 'aquery_ns', aquery_ns)
+        batch = UpdateBatch()
+        v4 = batch.update(TEST_HOST, '1.2.3.4')
+        v6 = batch.update(TEST_HOST, '2001:db8::1')
+        batch.send()
+        assert [v4.error, v6.error] == [None, None]
+        assert sorted(queried) == ['A', 'AAAA']
+        assert len(nameserver.messages) == 1
+
+    def test_concurrent_checks_limited(self, nameserver, monkeypatch):
+        import asyncio
+        from nsupdate.conftest import TESTDOMAIN
+        from .. import dnstools
+        in_flight = []
+
+        async def aquery_ns(fqdn, rdtype, prefer_primary=False, cached=True):
+            in_flight.append(fqdn)
+            await asyncio.sleep(0.01)
+            assert len(in_flight) <= 2
+            in_flight.remove(fqdn)
+            raise NXDOMAIN
+        monkeypatch.setattr(dnstools, 'aquery_ns', aquery_ns)
+        monkeypatch.setattr(dnstools, 'QUERY_CONCURRENCY', 2)
+        batch = UpdateBatch()
+        changes = [batch.update(FQDN('host%d' % i, TESTDOMAIN), '1.2.3.4') for i in range(5)]
+        batch.send()
+        assert [change.error for change in changes] == [None] * 5
+        assert len(nameserver.messages) == 1
+
+
+class TestAnswerCache(object):
+    @pytest.fixture
+    def nameserver(self, monkeypatch):
+        """
+        send all updates to a fake nameserver, fail on any query to the nameserver.
+        """
+        from .. import dnstools
+        from ..dnspool import ConnectionPool
+        from .test_dnspool import FakeNameserver
+        ns = FakeNameserver()
+        pool = ConnectionPool()
+        monkeypatch.setattr(dnstools.pool, 'query', lambda q, where, **kw: pool.query(q, where, timeout=5, port=ns.port))
+
+        def resolve(*args, **kwargs):
+            raise AssertionError("unexpected query")
+        monkeypatch.setattr(dns.resolver.Resolver, 'resolve', resolve)
+        monkeypatch.setattr(dnstools, 'answer_cache', TTLCache())
+        yield ns
+        pool.close_all()
+        ns.close()
+
+    def test_remember_own_writes(self, nameserver):
+        from nsupdate.conftest import TEST_HOST
+        update_ns(TEST_HOST, 'A', '1.2.3.4', action='upd')
+        update_ns(TEST_HOST, 'AAAA', action='del')
+        assert query_ns(TEST_HOST, 'A') == '1.2.3.4'
+        with pytest.raises(NoAnswer):
+            query_ns(TEST_HOST, 'AAAA')
+        update(TEST_HOST, '2.3.4.5')
+        assert query_ns(TEST_HOST, 'A') == '2.3.4.5'
+        assert len(nameserver.messages) == 3
+
+    def test_verify_nochg(self, nameserver, monkeypatch):
+        from nsupdate.conftest import TEST_HOST
+        update_ns(TEST_HOST, 'A', '1.2.3.4', action='upd')
+        master = []
+        monkeypatch.setattr(dns.resolver.Resolver, 'resolve', lambda *args, **kwargs: master)
+        # another process changed the record meanwhile, our cached answer is outdated
+        master.append('5.6.7.8')
+        update(TEST_HOST, '1.2.3.4')
+        assert len(nameserver.messages) == 2
+        # the master server confirms that nothing needs to be done
+        master[:] = ['1.2.3.4']
+        with pytest.raises(SameIpError):
+            update(TEST_HOST, '1.2.3.4')
+        assert len(nameserver.messages) == 2
+
+    def test_bypass_cache(self, nameserver):
+        from nsupdate.conftest import TEST_HOST
+        update_ns(TEST_HOST, 'A', '1.2.3.4', action='upd')
+        with pytest.raises(AssertionError):
+            query_ns(TEST_HOST, 'A', cached=False)
+
+
+class TestResolverRegistry(object):
+    def test_reuse(self):
+        registry = ResolverRegistry()
+        r1 = registry.get('example.org', '192.0.2.1', '192.0.2.2')
+        r2 = registry.get('example.org', '192.0.2.1', '192.0.2.2')
+        assert r1 is r2
+        assert r1.nameservers == ['192.0.2.2', '192.0.2.1']
+        assert r1.flags == 0
+        r3 = registry.get('example.org', '192.0.2.1', '192.0.2.2', prefer_primary=True)
+        assert r3.nameservers == ['192.0.2.1', '192.0.2.2']
+        assert (registry.hits, registry.rebuilds) == (1, 2)
+
+    def test_rebuild_on_change(self):
+        registry = ResolverRegistry()
+        r1 = registry.get('example.org', '192.0.2.1', None)
+        r2 = registry.get('example.org', '192.0.2.3', None)
+        assert r1 is not r2
+        assert r2.nameservers == ['192.0.2.3']
+        assert registry.get('example.org', '192.0.2.3', None) is r2
+        assert (registry.hits, registry.rebuilds) == (1, 2)
+
+
+class TestQueryMany(object):
+    class FakeResolver(object):
+        """answers 'a' queries with 192.0.2.<n> (slowly for 'slow*' names), raises for 'dead*' names"""
+        def __init__(self):
+            self.queries = 0
+
+        async def resolve(self, qname, rdtype, search=True):
+            import asyncio
+            self.queries += 1
+            if qname.startswith('dead'):
+                raise dns.resolver.NoNameservers
+            await asyncio.sleep(10 if qname.startswith('slow') else 0.2)
+            return ['192.0.2.%d' % int(qname.split('.')[0][4:])]
+
+    @pytest.fixture
+    def resolver(self, monkeypatch):
+        from .. import dnstools
+        resolver = self.FakeResolver()
+        monkeypatch.setattr(dnstools.resolvers, 'get', lambda *args, **kwargs: resolver)
+        monkeypatch.setattr(dnstools, 'answer_cache', TTLCache())
+        return resolver
+
+    def test_concurrent(self, resolver):
+        import time
+        from nsupdate.conftest import TESTDOMAIN
+        queries = [(FQDN('host%d' % i, TESTDOMAIN), 'A') for i in range(50)]
+        t_start = time.monotonic()
+        results = query_ns_many(queries + queries)
+        assert time.monotonic() - t_start < 2.0
+        assert resolver.queries == 50
+        assert results[(FQDN('host7', TESTDOMAIN), 'A')] == '192.0.2.7'
+        # the answers went into the answer cache
+        assert query_ns(FQDN('host7', TESTDOMAIN), 'A') == '192.0.2.7'
+
+    def test_deadline_and_errors(self, resolver):
+        from nsupdate.conftest import TESTDOMAIN
+        from ..models import Domain
+        fast, slow, dead = FQDN('host1', TESTDOMAIN), FQDN('slow2', TESTDOMAIN), FQDN('dead3', TESTDOMAIN)
+        results = query_ns_many([(fast, 'A'), (slow, 'A')], deadline=0.5)
+        assert results[(fast, 'A')] == '192.0.2.1'
+        assert isinstance(results[(slow, 'A')], dns.resolver.Timeout)
+        # the deadline is no reason to flag the nameserver unavailable
+        assert Domain.objects.get(name=TESTDOMAIN).available
+        results = query_ns_many([(dead, 'A'), (dead, 'AAAA')])
+        assert isinstance(results[(dead, 'A')], dns.resolver.NoNameservers)
+        assert not Domain.objects.get(name=TESTDOMAIN).available
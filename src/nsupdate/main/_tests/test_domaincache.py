@@ -0,0 +1,70 @@
+"""
+Tests for the domaincache module.
+"""
+
+import pytest
+
+from nsupdate.conftest import TEST_HOST, TESTDOMAIN, NAMESERVER_UPDATE_SECRET
+
+from ..dnstools import get_ns_info, NameServerNotAvailable
+from ..domaincache import cache
+from ..models import Domain
+
+
+def test_no_db_queries_when_cached(django_assert_num_queries):
+    get_ns_info(TEST_HOST)  # warm up
+    with django_assert_num_queries(0):
+        nameserver, nameserver2, origin, domain, name, keyname, key, algo = get_ns_info(TEST_HOST)
+        cache.get_keyring(keyname, key)
+    assert domain == TESTDOMAIN
+    assert key == NAMESERVER_UPDATE_SECRET
+
+
+def test_keyring_is_cached():
+    keyring = cache.get_keyring(TESTDOMAIN, NAMESERVER_UPDATE_SECRET)
+    assert cache.get_keyring(TESTDOMAIN, NAMESERVER_UPDATE_SECRET) is keyring
+
+
+def test_only_changed_zone_is_reloaded(django_assert_num_queries):
+    other = Domain.objects.exclude(name=TESTDOMAIN).first()
+    cache.get(TESTDOMAIN)
+    cache.get(other.name)
+    assert cache.get('no-such-zone.example.org') is None
+    d = Domain.objects.get(name=TESTDOMAIN)
+    d.available = False
+    d.save()
+    # the other zone and the unknown name are still cached, only the changed one gets reloaded
+    with django_assert_num_queries(1):
+        assert cache.get(other.name).name == other.name
+        assert cache.get('no-such-zone.example.org') is None
+        assert cache.get(TESTDOMAIN).available is False
+
+
+def test_invalidated_on_rename():
+    d = Domain.objects.get(name=TESTDOMAIN)
+    assert cache.get(TESTDOMAIN) is not None
+    d.name = 'renamed.' + TESTDOMAIN
+    d.save()
+    assert cache.get(TESTDOMAIN) is None
+    assert cache.get(d.name).name == d.name
+
+
+def test_invalidated_on_save():
+    get_ns_info(TEST_HOST)
+    version = cache.version
+    d = Domain.objects.get(name=TESTDOMAIN)
+    d.nameserver_ip = '127.0.0.2'
+    d.save()
+    assert cache.version > version
+    assert get_ns_info(TEST_HOST)[0] == '127.0.0.2'
+    d.available = False
+    d.save()
+    with pytest.raises(NameServerNotAvailable):
+        get_ns_info(TEST_HOST)
+
+
+def test_invalidated_on_delete():
+    get_ns_info(TEST_HOST)
+    Domain.objects.filter(name=TESTDOMAIN).delete()
+    with pytest.raises(Domain.DoesNotExist):
+        get_ns_info(TEST_HOST)
@@ -0,0 +1,91 @@
+"""
+Tests for the ippolicy module.
+"""
+
+import ipaddress
+
+import pytest
+from netaddr import IPSet, IPNetwork
+
+from django.contrib.auth import get_user_model
+
+from nsupdate.conftest import TESTDOMAIN
+
+from ..ippolicy import PrefixTable, IPPolicy, BLOCK, ALLOW, is_blocked, cache
+from ..models import BlacklistedNetwork, Domain
+
+
+def test_prefix_table_longest_match():
+    t = PrefixTable()
+    t.add('10.0.0.0/8', 'a')
+    t.add('10.1.0.0/16', 'b')
+    t.add('10.1.2.3', 'c')
+    t.add('2001:db8::/32', 'd')
+    assert t.lookup('10.2.3.4') == 'a'
+    assert t.lookup('10.1.3.4') == 'b'
+    assert t.lookup('10.1.2.3') == 'c'
+    assert t.match('10.1.2.3') == (32, 'c')
+    assert t.match('11.0.0.0') is None
+    assert t.lookup(ipaddress.ip_address('10.1.2.3')) == 'c'
+    assert t.lookup('11.0.0.0') is None
+    assert t.lookup('2001:db8:1::1') == 'd'
+    assert t.lookup('2001:db9::1') is None
+    assert len(t) == 4
+    with pytest.raises(ValueError):
+        t.lookup('invalid')
+
+
+def test_prefix_table_like_ipset():
+    networks = ['192.0.2.0/25', '198.51.100.7', '203.0.113.64/26', '2001:db8:abcd::/48', '0.0.0.0/32']
+    ipset = IPSet(networks)
+    t = PrefixTable()
+    for network in networks:
+        t.add(network, BLOCK)
+    for network in ['192.0.2.0/24', '198.51.100.0/29', '203.0.113.0/24']:
+        for ip in IPNetwork(network):
+            assert (t.lookup(str(ip)) == BLOCK) == (ip in ipset), ip
+
+
+def test_policy_domains():
+    p = IPPolicy()
+    p.add('192.0.2.0/24', BLOCK)
+    p.add('192.0.2.128/25', ALLOW)
+    p.add('198.51.100.0/24', BLOCK, 'example.org')
+    p.add('192.0.2.1', ALLOW, 'example.org')
+    assert p.is_blocked('192.0.2.1')
+    assert not p.is_blocked('192.0.2.200')
+    assert not p.is_blocked('198.51.100.1')
+    assert p.is_blocked('198.51.100.1', 'example.org')
+    assert not p.is_blocked('192.0.2.1', 'example.org')
+    assert p.is_blocked('192.0.2.2', 'example.org')
+
+
+def test_policy_most_specific_wins():
+    p = IPPolicy()
+    p.add('10.1.0.0/16', ALLOW, 'example.org')
+    p.add('10.1.2.3', BLOCK)
+    p.add('10.2.0.0/16', BLOCK)
+    p.add('10.2.0.0/16', ALLOW, 'example.org')
+    # a more specific global network wins over a wider domain network
+    assert p.is_blocked('10.1.2.3', 'example.org')
+    assert not p.is_blocked('10.1.2.4', 'example.org')
+    # same network: the domain's entry wins
+    assert not p.is_blocked('10.2.0.1', 'example.org')
+    assert p.is_blocked('10.2.0.1', 'other.org')
+
+
+def test_is_blocked_from_settings_and_db(settings):
+    settings.BAD_IPS_HOST = IPSet(['192.0.2.0/24'])
+    assert is_blocked('192.0.2.1')
+    user = get_user_model().objects.get(username='test')
+    version = cache.version
+    BlacklistedNetwork.objects.create(network='192.0.2.1', allow=True, created_by=user)
+    BlacklistedNetwork.objects.create(network='2001:db8::/32', domain=Domain.objects.get(name=TESTDOMAIN),
+                                      created_by=user)
+    assert cache.version > version
+    assert not is_blocked('192.0.2.1')
+    assert is_blocked('192.0.2.2')
+    assert is_blocked('2001:db8::1', TESTDOMAIN)
+    assert not is_blocked('2001:db8::1', 'other.org')
+    settings.BAD_IPS_HOST = IPSet([])
+    assert not is_blocked('192.0.2.2')
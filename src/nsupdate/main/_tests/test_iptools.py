@@ -0,0 +1,66 @@
+"""
+Tests for the iptools module.
+"""
+
+import pytest
+from netaddr import IPAddress, IPNetwork
+
+from ..iptools import IP, parse_ip, normalize_ip
+
+
+@pytest.mark.parametrize('ipaddr, expected', [
+    ('192.0.2.1', '192.0.2.1'),
+    ('::ffff:192.0.2.1', '192.0.2.1'),
+    ('::192.0.2.1', '192.0.2.1'),
+    ('2001:DB8::1', '2001:db8::1'),
+    ('::ffff:0:192.0.2.1', '::ffff:0:c000:201'),
+])
+def test_normalize_ip(ipaddr, expected):
+    assert normalize_ip(ipaddr) == expected
+
+
+@pytest.mark.parametrize('ipaddr', ['', '1.2.3', '010.1.1.1', ' 1.2.3.4', 'fe80::1%eth0', 'xyz', 'ä', 3232235521, None])
+def test_parse_ip_invalid(ipaddr):
+    with pytest.raises(ValueError):
+        parse_ip(ipaddr)
+
+
+def test_parse_ip():
+    ip = parse_ip('192.0.2.1')
+    assert (ip.kind, ip.rdtype, ip.text, str(ip)) == ('ipv4', 'A', '192.0.2.1', '192.0.2.1')
+    ip = parse_ip('2001:0db8::0001')
+    assert (ip.kind, ip.rdtype, ip.text) == ('ipv6', 'AAAA', '2001:db8::1')
+    assert ip == parse_ip('2001:db8::1')
+    # memoized
+    assert parse_ip('192.0.2.1') is parse_ip('192.0.2.1')
+
+
+@pytest.mark.parametrize('ipaddr, netmask', [
+    ('192.0.2.0', 24), ('192.0.2.1', 24), ('192.0.2.0', 32), ('192.0.2.128', 25), ('0.0.0.0', 0),
+    ('2001:db8:1:2::', 64), ('2001:db8:1:2::1', 64), ('2001:db8::', 128), ('2001:db8:1:2::', 56),
+])
+def test_network_like_netaddr(ipaddr, netmask):
+    ip = parse_ip(ipaddr)
+    network = IPNetwork("%s/%d" % (ipaddr, netmask)).network
+    assert ip.network(netmask).text == str(network)
+    single_ip = netmask == ip.address.max_prefixlen
+    assert ip.is_network(netmask) == (not single_ip and network == IPAddress(ipaddr))
+
+
+def test_with_interface_id():
+    ip = parse_ip('2001:db8:1:2:3:4:5:6')
+    assert ip.with_interface_id(64, parse_ip('::1:2:3:4')).text == '2001:db8:1:2:1:2:3:4'
+    ip = parse_ip('192.0.2.33')
+    assert ip.with_interface_id(24, parse_ip('0.0.0.42')).text == '192.0.2.42'
+    with pytest.raises(ValueError):
+        parse_ip('255.255.255.0').with_interface_id(24, parse_ip('::1:0:0:0'))
+    with pytest.raises(ValueError):
+        ip.network(33)
+
+
+def test_ip_object():
+    ip = IP(parse_ip('192.0.2.1').address)
+    assert repr(ip) == "IP('192.0.2.1')"
+    assert int(ip) == 0xc0000201
+    assert {ip, parse_ip('192.0.2.1')} == {ip}
+    assert parse_ip('192.0.2.1').normalized() is parse_ip('192.0.2.1')
@@ -4,6 +4,9 @@ Tests for the main views module.
 
 from __future__ import print_function
 
+import time
+
+import pytest
 
 from django.urls import reverse
 
@@ -109,3 +112,39 @@ def test_views_logged_in(client):
         print("%s, %s, %s" % (view, kwargs, status_code))
         response = client.get(reverse(view, kwargs=kwargs))
         assert response.status_code == status_code
+
+
+def test_no_session_for_anon(client):
+    from django.contrib.sessions.models import Session
+    count = Session.objects.count()
+    response = client.get('/no-such-page/')
+    assert response.status_code == 404
+    response = client.get(reverse('about'))
+    assert response.status_code == 200
+    assert Session.objects.count() == count
+    # the home view shows the IPs, so it needs a session
+    response = client.get(reverse('home'), REMOTE_ADDR='192.0.2.1')
+    assert response.status_code == 200
+    assert Session.objects.count() == count + 1
+    assert client.session['ipv4'] == '192.0.2.1'
+
+
+@pytest.mark.parametrize('minimize', [True, False])
+def test_session_ip_timestamp(client, settings, monkeypatch, minimize):
+    from django.contrib.sessions.models import Session
+    from nsupdate.main import dnstools
+    monkeypatch.setattr(dnstools, 'rev_lookup', lambda ipaddr: '')
+    monkeypatch.setattr(dnstools.rdns_resolver, 'workers', 0)
+    settings.MINIMIZE_SESSION_WRITES = minimize
+    client.get(reverse('home'), REMOTE_ADDR='192.0.2.1')
+    session = client.session
+    # the ip was seen a while ago, so the next page view refreshes the timestamp
+    dnstools.set_ip_timestamp(session, 'ipv4', int(time.time()) - 100)
+    session.save()
+    data = Session.objects.get(pk=session.session_key).session_data
+    client.get(reverse('about'), REMOTE_ADDR='192.0.2.1')
+    session = client.session
+    assert dnstools.get_ip_timestamp(session, 'ipv4') >= int(time.time()) - 5
+    assert session['ipv4'] == '192.0.2.1'
+    written = Session.objects.get(pk=session.session_key).session_data != data
+    assert written != minimize
@@ -0,0 +1,73 @@
+"""
+Tests for the models module.
+"""
+
+from django.db.models.signals import post_save
+
+from nsupdate.conftest import TEST_HOST
+
+from ..models import Host, HostUnitOfWork, host_unit_of_work
+
+
+class TestHostUnitOfWork(object):
+    def test_single_narrow_write(self, django_assert_num_queries):
+        host = Host.get_by_fqdn(str(TEST_HOST))
+        host.get_fqdn()  # load host.domain, so it does not count below
+        saves = []
+
+        def count_saves(sender, update_fields=None, **kwargs):
+            saves.append(update_fields)
+        post_save.connect(count_saves, sender=Host)
+        try:
+            uow = HostUnitOfWork()
+            with uow.active():
+                with django_assert_num_queries(0):
+                    host.register_api_auth_result('ok')
+                    host.poke('ipv4', True)
+                    host.register_client_result('nochg', fault=True)
+                    host.register_client_result('nochg', fault=True)
+            with django_assert_num_queries(1):
+                uow.flush()
+        finally:
+            post_save.disconnect(count_saves, sender=Host)
+        assert saves == [frozenset(['api_auth_result_msg', 'last_update_ipv4', 'tls_update_ipv4',
+                                    'client_result_msg', 'client_faults', 'last_update'])]
+        assert host.client_faults == 2
+        host.refresh_from_db()
+        assert host.client_faults == 2
+        assert host.client_result_msg.endswith(' nochg')
+        assert host.tls_update_ipv4
+
+    def test_concurrent_increments(self):
+        host = Host.get_by_fqdn(str(TEST_HOST))
+        other = Host.objects.get(pk=host.pk)
+
+        @host_unit_of_work
+        def fault(h):
+            h.register_server_result('error', fault=True)
+        fault(host)
+        fault(other)
+        host.refresh_from_db()
+        assert host.server_faults == 2
+
+    def test_without_unit_of_work(self):
+        host = Host.get_by_fqdn(str(TEST_HOST))
+        host.register_abuse('abuse')
+        host.refresh_from_db()
+        assert host.abuse and host.abuse_blocked
+        assert host.client_faults == 1
+
+
+def test_prefetch_ips(monkeypatch):
+    from .. import models
+    host = Host.get_by_fqdn(str(TEST_HOST))
+    monkeypatch.setattr(models.dnstools, 'query_ns_many',
+                        lambda queries, deadline=None: {q: ('192.0.2.1' if q[1] == 'A' else
+                                                            models.dnstools.NameServerNotAvailable()) for q in queries})
+    models.prefetch_ips([host])
+
+    def no_query(*args, **kwargs):
+        raise AssertionError('query_ns must not be called')
+    monkeypatch.setattr(models.dnstools, 'query_ns', no_query)
+    assert host.get_ipv4() == '192.0.2.1'
+    assert host.get_ipv6() == 'error'
@@ -0,0 +1,79 @@
+"""
+Tests for the relay module.
+"""
+
+from datetime import timedelta
+
+from django.utils.timezone import now
+
+from nsupdate.conftest import TEST_HOST
+
+from .. import relay
+from ..models import Host, RelayTask, ServiceUpdater, ServiceUpdaterHostConfig
+
+
+def test_enqueue_replaces_older_update():
+    host = Host.get_by_fqdn(str(TEST_HOST))
+    assert relay.enqueue(host, 'ipv4', '192.0.2.1') == 1
+    assert relay.enqueue(host, 'ipv4', '192.0.2.2') == 1
+    assert relay.enqueue(host, 'ipv6', '2001:db8::1') == 0  # the service does not accept ipv6
+    assert list(RelayTask.objects.values_list('myip', flat=True)) == ['192.0.2.2']
+
+
+def test_enqueue_dual_stack(monkeypatch):
+    ServiceUpdater.objects.update(accept_ipv6=True)
+    ServiceUpdaterHostConfig.objects.update(give_ipv6=True)
+    sent = []
+
+    def dyndns2_update(**kwargs):
+        sent.append(kwargs['myip'])
+        return 200, 'good %s' % kwargs['myip']
+    monkeypatch.setattr(relay.ddns_client, 'dyndns2_update', dyndns2_update)
+    host = Host.get_by_fqdn(str(TEST_HOST))
+    # a dual-stack client updates both addresses in the same request
+    assert relay.enqueue(host, 'ipv4', '192.0.2.1') == 1
+    assert relay.enqueue(host, 'ipv6', '2001:db8::1') == 1
+    assert sorted(RelayTask.objects.values_list('kind', 'myip')) == [('ipv4', '192.0.2.1'), ('ipv6', '2001:db8::1')]
+    assert relay.process() == (2, 0)
+    assert sorted(sent) == ['192.0.2.1', '2001:db8::1']
+    assert not RelayTask.objects.exists()
+
+
+def test_process(monkeypatch, settings):
+    settings.RELAY_BACKOFF = 60
+    settings.RELAY_MAX_ATTEMPTS = 3
+    responses = []
+
+    def dyndns2_update(**kwargs):
+        response = responses.pop(0)
+        if isinstance(response, Exception):
+            raise response
+        return response
+    monkeypatch.setattr(relay.ddns_client, 'dyndns2_update', dyndns2_update)
+    host = Host.get_by_fqdn(str(TEST_HOST))
+    relay.enqueue(host, 'ipv4', '192.0.2.1')
+
+    def make_due():
+        RelayTask.objects.update(next_try=now())
+
+    responses.append(relay.ddns_client.Timeout())
+    assert relay.process() == (0, 1)
+    task = RelayTask.objects.get()
+    assert task.attempts == 1
+    assert task.next_try > now() + timedelta(seconds=50)
+    assert relay.process() == (0, 0)  # not due yet
+    make_due()
+    responses.append((200, '911'))
+    assert relay.process() == (0, 1)
+    assert RelayTask.objects.get().next_try > now() + timedelta(seconds=110)  # backoff doubled
+    make_due()
+    responses.append((200, 'good 192.0.2.1'))
+    assert relay.process() == (1, 0)
+    assert not RelayTask.objects.exists()
+    # giving up after RELAY_MAX_ATTEMPTS
+    relay.enqueue(host, 'ipv4', '192.0.2.1')
+    for i in range(3):
+        make_due()
+        responses.append((500, 'oops'))
+        assert relay.process() == (0, 1)
+    assert not RelayTask.objects.exists()
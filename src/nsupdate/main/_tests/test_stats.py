@@ -0,0 +1,76 @@
+"""
+Tests for the stats module.
+"""
+
+from datetime import timedelta
+
+from django.contrib.auth import get_user_model
+from django.core import management
+from django.utils.timezone import now
+
+from nsupdate.conftest import TEST_HOST
+
+from ..models import Host, Domain, StatsSnapshot
+from .. import stats
+
+
+def test_compute_stats(django_assert_num_queries):
+    host = Host.get_by_fqdn(str(TEST_HOST))
+    host.last_update_ipv4 = now() - timedelta(days=3)
+    host.tls_update_ipv4 = True
+    host.save()
+    with django_assert_num_queries(3):
+        s = stats.compute_stats()
+    assert s['domains_total'] == Domain.objects.count()
+    assert s['domains_public'] == Domain.objects.filter(public=True).count()
+    assert s['hosts_total'] == Host.objects.count()
+    assert s['hosts_abuse'] == Host.objects.filter(abuse=True).count()
+    assert s['hosts_ipv4_tls_2d'] == 0
+    assert s['hosts_ipv4_tls_2w'] == 1
+    assert s['users_total'] == get_user_model().objects.count()
+
+
+def test_get_stats_cached(settings, django_assert_num_queries):
+    settings.STATUS_STATS_REFRESH = 60
+    stats.cache.clear()
+    s = stats.get_stats()
+    Host.objects.filter(name=TEST_HOST.host).delete()
+    with django_assert_num_queries(0):
+        assert stats.get_stats() == s
+    stats.cache.clear()
+    assert stats.get_stats()['hosts_total'] == s['hosts_total'] - 1
+    settings.STATUS_STATS_REFRESH = 0
+    stats.cache.clear()
+    stats.get_stats()
+    assert len(stats.cache) == 0
+
+
+def test_snapshot(settings, django_assert_num_queries):
+    settings.STATUS_STATS_REFRESH = 60
+    stats.cache.clear()
+    management.call_command('stats', keep_days=730)
+    snapshot = StatsSnapshot.objects.latest()
+    assert snapshot.data['hosts_total'] == Host.objects.count()
+    with django_assert_num_queries(2):  # no counting, just reading the snapshots
+        s = stats.get_stats()
+        history = stats.get_history()
+    assert s['hosts_total'] == snapshot.data['hosts_total']
+    assert s['stats_created'] == snapshot.created
+    assert len(history) == 1
+    assert history[0]['hosts_total'] == snapshot.data['hosts_total']
+
+
+def test_history_daily():
+    stats.cache.clear()
+    t_now = now()
+    for age, hosts_total in [(timedelta(days=1, seconds=1), 10), (timedelta(days=1), 11),
+                             (timedelta(days=3), 30), (timedelta(days=100), 100)]:
+        snapshot = StatsSnapshot.objects.create(data=dict(hosts_total=hosts_total, hosts_ipv4_2d=3,
+                                                          hosts_ipv4_tls_2d=1, hosts_ipv6_2d=1))
+        StatsSnapshot.objects.filter(pk=snapshot.pk).update(created=t_now - age)
+    history = stats.get_history(days=30)
+    # the newer snapshot of the same day wins, the snapshot of 100 days ago is too old
+    assert [h['hosts_total'] for h in history] == [11, 30]
+    assert history[0]['hosts_tls_percent_2d'] == 25
+    management.call_command('stats', keep_days=30)
+    assert StatsSnapshot.objects.count() == 4
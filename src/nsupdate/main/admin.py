@@ -6,7 +6,8 @@ from django.contrib import admin
 from django.urls import reverse
 from django.utils.safestring import mark_safe
 
-from .models import Host, RelatedHost, Domain, BlacklistedHost, ServiceUpdater, ServiceUpdaterHostConfig
+from .models import (Host, RelatedHost, Domain, BlacklistedHost, BlacklistedNetwork, ServiceUpdater,
+                     ServiceUpdaterHostConfig, RelayTask)
 
 
 @admin.register(Domain)
@@ -46,6 +47,13 @@ class BlacklistedHostAdmin(admin.ModelAdmin):
     list_filter = ("created", )
 
 
+@admin.register(BlacklistedNetwork)
+class BlacklistedNetworkAdmin(admin.ModelAdmin):
+    list_display = ("network", "allow", "domain", "comment", "created_by")
+    list_filter = ("created", "allow", "domain")
+    search_fields = ("network", "comment")
+
+
 @admin.register(ServiceUpdater)
 class ServiceUpdaterAdmin(admin.ModelAdmin):
     list_display = ("name", "comment", "created_by")
@@ -56,3 +64,9 @@ class ServiceUpdaterAdmin(admin.ModelAdmin):
 class ServiceUpdaterHostConfigAdmin(admin.ModelAdmin):
     list_display = ("host", "service", "hostname", "comment", "created_by")
     list_filter = ("created", )
+
+
+@admin.register(RelayTask)
+class RelayTaskAdmin(admin.ModelAdmin):
+    list_display = ("hostconfig", "kind", "myip", "attempts", "next_try", "last_error")
+    list_filter = ("created", )
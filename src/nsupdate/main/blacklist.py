@@ -0,0 +1,166 @@
+"""
+In-process cache of the host name blacklist (BlacklistedHost), compiled for fast matching.
+
+A blacklist entry is a regex that is searched in the host name. Searching
+thousands of regexes one by one (and compiling them, as the re module only
+caches a few hundred compiled patterns) for every validated name is slow, so:
+
+- entries that are plain strings (like "paypal" or "bank\\.com") are
+  looked up by checking all substrings of the name (of the lengths we
+  have entries for) in a set - this does not get slower with more entries.
+- all other entries get combined into one alternation regex, except the
+  ones that would not work inside of it (group references, global flags),
+  these are searched one by one.
+
+The cache is invalidated by the post_save / post_delete signals of
+BlacklistedHost (see models.py). As other processes do not see our signals,
+it also expires after MAX_AGE seconds.
+"""
+
+import os
+
+# reload the blacklist after this time [s], to notice changes done by other processes
+MAX_AGE = float(os.environ.get('BLACKLIST_CACHE_MAX_AGE', '60.0'))
+
+
+import re
+import threading
+import time
+
+import logging
+logger = logging.getLogger(__name__)
+
+from django.db import transaction
+
+REGEX_SPECIAL = set('.^$*+?{}[]|()\\')
+
+# patterns that must not be combined with others: group references (\N, (?P=name),
+# (?(N)...) - the group numbers change in the combined regex) and global flags.
+STANDALONE_RE = re.compile(r'\\[1-9]|\(\?P=|\(\?\(|^\(\?[aiLmsux]+\)')
+
+
+def literal(pattern):
+    """
+    :param pattern: regex pattern (str)
+    :return: the string the pattern matches if it is a plain (maybe escaped) string, else None
+    """
+    chars = []
+    escaped = False
+    for c in pattern:
+        if escaped:
+            if c.isalnum():
+                return None  # \d, \w, \1, ...
+            chars.append(c)
+            escaped = False
+        elif c == '\\':
+            escaped = True
+        elif c in REGEX_SPECIAL:
+            return None
+        else:
+            chars.append(c)
+    if escaped or not chars:
+        return None
+    return ''.join(chars)
+
+
+class Matcher:
+    """
+    matches names against many regex patterns at once, like:
+    any(re.search(pattern, name) for pattern in patterns)
+
+    :param patterns: iterable of regex patterns (str), invalid ones get ignored
+    """
+    def __init__(self, patterns):
+        self.literals = {}  # length -> set of strings
+        regexes = []
+        self.regexes = []
+        for pattern in patterns:
+            s = literal(pattern)
+            if s is not None:
+                self.literals.setdefault(len(s), set()).add(s)
+                continue
+            try:
+                regex = re.compile(pattern)
+            except re.error as e:
+                logger.warning("ignoring invalid blacklist regex %r [%s]" % (pattern, e))
+                continue
+            if STANDALONE_RE.search(pattern):
+                self.regexes.append(regex)
+            else:
+                regexes.append(pattern)
+        self.regex = None
+        if regexes:
+            try:
+                self.regex = re.compile('|'.join('(?:%s)' % pattern for pattern in regexes))
+            except re.error:
+                # e.g. the same group name in multiple patterns
+                self.regexes.extend(re.compile(pattern) for pattern in regexes)
+
+    def search(self, name):
+        """
+        :param name: the name to check
+        :return: True if some pattern matches (somewhere in) name
+        """
+        for length, strings in self.literals.items():
+            for i in range(len(name) - length + 1):
+                if name[i:i + length] in strings:
+                    return True
+        if self.regex is not None and self.regex.search(name):
+            return True
+        return any(regex.search(name) for regex in self.regexes)
+
+
+class BlacklistCache:
+    """
+    Versioned cache of the Matcher for all BlacklistedHost records.
+
+    invalidate() bumps the version, so a reload that raced with a change
+    of the BlacklistedHost table does not get stored.
+    """
+    def __init__(self, max_age=MAX_AGE):
+        self.max_age = max_age
+        self.version = 0
+        self.loads = 0
+        self._matcher = None
+        self._loaded_at = 0.0
+        self._lock = threading.Lock()
+
+    def _load(self):
+        from .models import BlacklistedHost
+        with self._lock:
+            version = self.version
+            matcher = Matcher(BlacklistedHost.objects.values_list('name_re', flat=True))
+            if version == self.version:
+                self._matcher, self._loaded_at = matcher, time.monotonic()
+                self.loads += 1
+        return matcher
+
+    def get_matcher(self):
+        matcher = self._matcher
+        if matcher is None or time.monotonic() - self._loaded_at > self.max_age:
+            matcher = self._load()
+        return matcher
+
+    def invalidate(self):
+        """forget the matcher, the next access will reload from the database"""
+        with self._lock:
+            self.version += 1
+            self._matcher = None
+
+
+cache = BlacklistCache()
+
+
+def is_blacklisted(name):
+    """
+    :param name: host name
+    :return: True if some blacklist entry matches name
+    """
+    return cache.get_matcher().search(name)
+
+
+def invalidate_blacklist_cache(sender, **kwargs):
+    cache.invalidate()
+    # if we are in a transaction, another thread might reload the old state
+    # before the changes get committed, so invalidate again after the commit.
+    transaction.on_commit(cache.invalidate)
@@ -0,0 +1,57 @@
+"""
+Cache of recently verified update secrets.
+
+Verifying an update secret means computing an argon2 hash. Update clients
+send the same secret again and again, so after a successful verification
+we remember a keyed HMAC of the secret for the host (together with the
+hash it was verified against) for a while. Wrong secrets are never cached,
+so guessing secrets still costs a full hash computation per attempt.
+"""
+
+import hashlib
+import hmac
+
+from django.conf import settings
+
+from ..utils.ttlcache import TTLCache
+
+
+cache = TTLCache(maxsize=settings.UPDATE_SECRET_CACHE_SIZE, ttl=settings.UPDATE_SECRET_CACHE_TTL)
+
+
+def _digest(secret):
+    return hmac.new(settings.SECRET_KEY.encode('utf-8'), secret.encode('utf-8', 'replace'), hashlib.sha256).digest()
+
+
+def is_verified(host, secret):
+    """
+    check whether secret was recently verified for host.
+
+    :param host: Host object
+    :param secret: the update secret given by the client (str)
+    :return: True if it was verified against the current update_secret of host
+    """
+    entry = cache.get(host.pk)
+    if entry is None:
+        return False
+    digest, update_secret = entry
+    return update_secret == host.update_secret and hmac.compare_digest(digest, _digest(secret))
+
+
+def remember_verified(host, secret):
+    """
+    remember that secret was verified for host.
+
+    :param host: Host object
+    :param secret: the update secret given by the client (str)
+    """
+    cache.set(host.pk, (_digest(secret), host.update_secret))
+
+
+def forget(host):
+    """
+    forget the verified secret of host (e.g. because it changed).
+
+    :param host: Host object
+    """
+    cache.delete(host.pk)
@@ -0,0 +1,172 @@
+"""
+Pool of persistent TCP (or DNS-over-TLS) connections to the nameservers.
+
+Sending each dynamic update over a fresh TCP connection costs a TCP handshake
+(and, for DoT, also a TLS handshake) per update. As we usually talk to only a
+few nameservers, we rather keep some connections open and reuse them.
+"""
+
+import os
+
+# max. count of idle connections we keep per nameserver
+MAX_IDLE = int(os.environ.get('DNS_POOL_MAX_IDLE', '4'))
+
+# close connections that were idle longer than this [s].
+# note: bind9 closes idle connections after 30s (tcp-idle-timeout), so stay below that.
+IDLE_TIMEOUT = float(os.environ.get('DNS_POOL_IDLE_TIMEOUT', '20.0'))
+
+
+import select
+import socket
+import ssl
+import threading
+import time
+
+import logging
+logger = logging.getLogger(__name__)
+
+import dns.query
+
+
+def make_ssl_context():
+    # we connect to the nameserver by IP and nameservers often use self-signed
+    # certificates, so we can't verify the certificate. The updates are
+    # authenticated by TSIG anyway, TLS is "only" used for privacy.
+    ctx = ssl.create_default_context()
+    ctx.check_hostname = False
+    ctx.verify_mode = ssl.CERT_NONE
+    return ctx
+
+
+def _is_alive(sock):
+    """
+    check whether an idle connection is still usable.
+
+    an idle connection must not be readable: if it is, the peer either
+    closed the connection (EOF) or sent something we did not ask for.
+    """
+    try:
+        if isinstance(sock, ssl.SSLSocket) and sock.pending():
+            return False
+        readable, _, _ = select.select([sock], [], [], 0)
+    except (OSError, ValueError):
+        return False
+    return not readable
+
+
+def _close(sock):
+    try:
+        sock.close()
+    except OSError:
+        pass
+
+
+class ConnectionPool:
+    """
+    Keeps idle connections per (nameserver, port, tls) for later reuse.
+
+    Connections are checked before reuse, evicted when idle for too long
+    and transparently replaced if the nameserver closed them meanwhile.
+    """
+    def __init__(self, max_idle=MAX_IDLE, idle_timeout=IDLE_TIMEOUT):
+        self.max_idle = max_idle
+        self.idle_timeout = idle_timeout
+        self._idle = {}  # (where, port, tls) -> [(sock, last_used), ...]
+        self._lock = threading.Lock()
+
+    def _connect(self, where, port, tls, timeout):
+        sock = socket.create_connection((where, port), timeout=timeout)
+        if tls:
+            try:
+                sock = make_ssl_context().wrap_socket(sock)  # blocking handshake, limited by timeout
+            except BaseException:
+                _close(sock)
+                raise
+        # dnspython wants a non-blocking socket, it does the timeout handling itself.
+        sock.setblocking(False)
+        return sock
+
+    def _get(self, key):
+        expired = []
+        sock = None
+        t_now = time.monotonic()
+        with self._lock:
+            conns = self._idle.get(key, [])
+            while conns:
+                candidate, last_used = conns.pop()
+                if t_now - last_used < self.idle_timeout:
+                    sock = candidate
+                    break
+                expired.append(candidate)
+        for candidate in expired:
+            _close(candidate)
+        if sock is not None and not _is_alive(sock):
+            logger.debug("discarding dead connection to %s port %d" % key[:2])
+            _close(sock)
+            sock = None
+        return sock
+
+    def _put(self, key, sock):
+        t_now = time.monotonic()
+        expired = []
+        with self._lock:
+            conns = self._idle.setdefault(key, [])
+            expired = [s for s, last_used in conns if t_now - last_used >= self.idle_timeout]
+            conns[:] = [(s, last_used) for s, last_used in conns if t_now - last_used < self.idle_timeout]
+            if len(conns) < self.max_idle:
+                conns.append((sock, t_now))
+                sock = None
+        for s in expired:
+            _close(s)
+        if sock is not None:
+            _close(sock)  # pool is full
+
+    def _query(self, q, where, timeout, sock):
+        try:
+            return dns.query.tcp(q, where, timeout=timeout, sock=sock)
+        except BaseException:
+            # we do not know in what state the connection is now, do not reuse it.
+            _close(sock)
+            raise
+
+    def query(self, q, where, timeout=None, port=None, tls=False):
+        """
+        send a message via a pooled connection and return the response
+
+        :param q: dns message (e.g. dns.update.Update)
+        :param where: nameserver IP (str)
+        :param timeout: timeout [s] for connecting and for the query
+        :param port: port (default: 53 for TCP, 853 for DoT)
+        :param tls: True to use DNS-over-TLS
+        :return: dns response
+        :raises: see dns.query.tcp
+        """
+        if port is None:
+            port = 853 if tls else 53
+        key = (where, port, tls)
+        sock = self._get(key)
+        if sock is None:
+            sock = self._connect(where, port, tls, timeout)
+            response = self._query(q, where, timeout, sock)
+        else:
+            try:
+                response = self._query(q, where, timeout, sock)
+            except (EOFError, OSError) as e:
+                # the nameserver closed the connection while it was idle,
+                # retry once using a fresh connection.
+                logger.debug("reconnecting to %s port %d [%s]" % (where, port, e))
+                sock = self._connect(where, port, tls, timeout)
+                response = self._query(q, where, timeout, sock)
+        self._put(key, sock)
+        return response
+
+    def close_all(self):
+        """close all idle connections"""
+        with self._lock:
+            idle, self._idle = self._idle, {}
+        for conns in idle.values():
+            for sock, last_used in conns:
+                _close(sock)
+
+
+pool = ConnectionPool()
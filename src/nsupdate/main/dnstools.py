@@ -2,6 +2,9 @@
 Misc. DNS related code: query, dynamic update, etc.
 
 Usually, higher level code wants to call the add/update/delete functions.
+
+For async code, there are async variants (prefixed with "a", e.g. aupdate)
+which do the dns I/O using dnspython's asyncio API.
 """
 
 import os
@@ -15,8 +18,32 @@ UPDATE_TIMEOUT = float(os.environ.get('DNS_UPDATE_TIMEOUT', '20.0'))
 # time after we retry to reach a previously unreachable ns [s]
 UNAVAILABLE_RETRY = 120.0
 
+# transport used for sending dynamic updates: 'tcp' or 'tls' (DNS-over-TLS)
+UPDATE_TRANSPORT = os.environ.get('DNS_UPDATE_TRANSPORT', 'tcp')
+
+# time we remember A/AAAA answers and the records we have written ourselves [s], 0 disables the cache
+ANSWER_CACHE_TTL = float(os.environ.get('DNS_ANSWER_CACHE_TTL', '60.0'))
+
+# max. count of (fqdn, rdtype) answers we remember
+ANSWER_CACHE_SIZE = int(os.environ.get('DNS_ANSWER_CACHE_SIZE', '10000'))
+
+# max. count of queries query_ns_many has in flight at the same time
+QUERY_CONCURRENCY = int(os.environ.get('DNS_QUERY_CONCURRENCY', '32'))
+
+# time we remember reverse dns lookup results [s]
+RDNS_CACHE_TTL = float(os.environ.get('DNS_RDNS_CACHE_TTL', '600.0'))
 
+# max. count of reverse dns lookup results we remember
+RDNS_CACHE_SIZE = int(os.environ.get('DNS_RDNS_CACHE_SIZE', '10000'))
+
+# count of background threads doing reverse dns lookups, 0 = look up synchronously
+RDNS_WORKERS = int(os.environ.get('DNS_RDNS_WORKERS', '4'))
+
+
+import asyncio
 import binascii
+import threading
+from concurrent.futures import ThreadPoolExecutor
 import time
 from datetime import timedelta
 from collections import namedtuple
@@ -28,6 +55,8 @@ import socket
 import random
 import struct
 
+import dns.asyncquery
+import dns.asyncresolver
 import dns.inet
 import dns.message
 import dns.name
@@ -35,11 +64,28 @@ import dns.resolver
 import dns.query
 import dns.update
 import dns.tsig
-import dns.tsigkeyring
 import dns.exception
 
+from asgiref.sync import async_to_sync, sync_to_async
+from django.conf import settings
+from django.core.cache import cache
 from django.utils.timezone import now
 
+from ..utils.ttlcache import TTLCache
+from .dnspool import pool, make_ssl_context
+from .domaincache import cache as domain_cache
+
+# we are the only writer of the A/AAAA records of our hosts, so we can remember
+# what we have written (and read) and spare the query before the next update.
+# note: this is per process - another process might have changed a record
+# meanwhile, so if a cached answer says that an update or delete is not needed
+# (nochg), we ask the master server again before believing it (see RecordChange).
+answer_cache = TTLCache(maxsize=ANSWER_CACHE_SIZE, ttl=ANSWER_CACHE_TTL)
+
+# ip -> hostname ('' if there is no reverse dns entry), filled by rdns_resolver
+rdns_cache = TTLCache(maxsize=RDNS_CACHE_SIZE, ttl=RDNS_CACHE_TTL)
+CACHED_RDTYPES = ('A', 'AAAA', )
+
 
 class FQDN(namedtuple('FQDN', ['host', 'domain'])):
     """
@@ -89,6 +135,15 @@ class NameServerNotAvailable(Exception):
     """
 
 
+class DeadlineExceeded(dns.resolver.LifetimeTimeout):
+    """
+    query_ns_many did not get an answer for a query within its deadline.
+
+    this is not necessarily an issue of the nameserver, the query might not
+    even have been sent.
+    """
+
+
 def check_ip(ipaddr, keys=('ipv4', 'ipv6')):
     """
     Check if a string is a valid ip address and also
@@ -145,7 +200,8 @@ def add(fqdn, ipaddr, ttl=60):
     assert isinstance(fqdn, FQDN)
     rdtype = check_ip(ipaddr, keys=('A', 'AAAA'))
     try:
-        current_ipaddr = query_ns(fqdn, rdtype)
+        # not cached: the record might have been changed by another process
+        current_ipaddr = query_ns(fqdn, rdtype, cached=False)
         # check if ip really changed
         ok = ipaddr != current_ipaddr
         action = 'upd'
@@ -176,22 +232,11 @@ def delete(fqdn, rdtype=None):
         rdtypes = [rdtype, ]
     else:
         rdtypes = ['A', 'AAAA']
-    for rdtype in rdtypes:
-        try:
-            # check if we have a DNS entry
-            query_ns(fqdn, rdtype)
-            # there is a dns entry
-            ok = True
-        except (dns.resolver.NXDOMAIN, dns.resolver.NoAnswer):
-            # no dns entry, it is already deleted
-            ok = False
-        except (dns.resolver.Timeout, dns.resolver.NoNameservers) as e:  # OSError (socket.error) also?
-            # maybe could be caused by secondary DNS Timeout and master still ok?
-            # assume the delete is OK...
-            ok = True
-        if ok:
-            # send a del
-            update_ns(fqdn, rdtype, action='del')
+    batch = UpdateBatch()
+    changes = [batch.delete(fqdn, rdtype) for rdtype in rdtypes]
+    batch.send()
+    for change in changes:
+        change.raise_error()
 
 
 def update(fqdn, ipaddr, ttl=60):
@@ -206,30 +251,408 @@ def update(fqdn, ipaddr, ttl=60):
     :raises: ValueError if ipaddr is no valid ip address string
     """
     assert isinstance(fqdn, FQDN)
+    batch = UpdateBatch()
+    change = batch.update(fqdn, ipaddr, ttl=ttl)
+    batch.send()
+    change.raise_error()
+
+
+async def aadd(fqdn, ipaddr, ttl=60):
+    """
+    async variant of add, see there.
+    """
+    assert isinstance(fqdn, FQDN)
     rdtype = check_ip(ipaddr, keys=('A', 'AAAA'))
     try:
-        current_ipaddr = query_ns(fqdn, rdtype)
+        # not cached: the record might have been changed by another process
+        current_ipaddr = await aquery_ns(fqdn, rdtype, cached=False)
         # check if ip really changed
         ok = ipaddr != current_ipaddr
+        action = 'upd'
     except (dns.resolver.NXDOMAIN, dns.resolver.NoAnswer):
         # no dns entry yet, ok
         ok = True
-    except (dns.resolver.Timeout, dns.resolver.NoNameservers) as e:  # OSError (socket.error) also?
-        # maybe could be caused by secondary DNS Timeout and master still ok?
-        # assume the update is OK...
-        ok = True
-    except dns.message.UnknownTSIGKey:
-        raise DnsUpdateError("UnknownTSIGKey")
+        action = 'add'
     if ok:
+        await aupdate_ns(fqdn, rdtype, ipaddr, action=action, ttl=ttl)
+    else:
+        raise SameIpError
+
+
+async def adelete(fqdn, rdtype=None):
+    """
+    async variant of delete, see there.
+    """
+    assert isinstance(fqdn, FQDN)
+    if rdtype is not None:
+        assert rdtype in ['A', 'AAAA', ]
+        rdtypes = [rdtype, ]
+    else:
+        rdtypes = ['A', 'AAAA']
+    batch = UpdateBatch()
+    changes = [batch.delete(fqdn, rdtype) for rdtype in rdtypes]
+    await batch.asend()
+    for change in changes:
+        change.raise_error()
+
+
+async def aupdate(fqdn, ipaddr, ttl=60):
+    """
+    async variant of update, see there.
+    """
+    assert isinstance(fqdn, FQDN)
+    batch = UpdateBatch()
+    change = batch.update(fqdn, ipaddr, ttl=ttl)
+    await batch.asend()
+    change.raise_error()
+
+
+class RecordChange:
+    """
+    a change of the A or AAAA record of a fqdn, queued in an UpdateBatch.
+
+    after the batch was sent, .error is None if the change was done (or
+    was not needed, for deletes), otherwise it is the exception that
+    happened (e.g. SameIpError, DnsUpdateError, NameServerNotAvailable).
+    .skipped is True if the change was not tried because the change it
+    depends on failed.
+    """
+    def __init__(self, fqdn, rdtype, ipaddr, action, ttl, depends_on=None):
+        self.fqdn = fqdn
+        self.rdtype = rdtype
+        self.ipaddr = ipaddr
+        self.action = action
+        self.ttl = ttl
+        self.depends_on = depends_on
+        self.error = None
+        self.skipped = False
+
+    def raise_error(self):
+        if self.error is not None:
+            raise self.error
+
+    def _cached_change_needed(self):
+        """
+        check the current state as far as the answer cache knows it.
+
+        :return: True if we need to send this change, False if we do not know
+                 (no cached answer) or if the cache says the change is not needed
+        """
+        try:
+            current_ipaddr, exc = _cached_answer(self.fqdn, self.rdtype), None
+        except (dns.resolver.NXDOMAIN, dns.resolver.NoAnswer) as e:
+            current_ipaddr, exc = None, e
+        else:
+            if current_ipaddr is None:
+                return False
+        try:
+            return self._evaluate(current_ipaddr, exc)
+        except SameIpError:
+            # the cached answer might be outdated (e.g. another process changed
+            # the record meanwhile), so we must not answer nochg (and count it
+            # as a client fault) because of it - the master server decides.
+            return False
+
+    def _check(self):
+        """
+        check the current state on the master server.
+
+        :return: True if we need to send this change
+        :raises: SameIpError if the update is not needed
+        """
+        if self._cached_change_needed():
+            return True
+        try:
+            current_ipaddr = query_ns(self.fqdn, self.rdtype, cached=False)
+        except Exception as e:
+            return self._evaluate(None, e)
+        return self._evaluate(current_ipaddr, None)
+
+    async def _acheck(self):
+        """
+        async variant of _check.
+        """
+        if self._cached_change_needed():
+            return True
+        try:
+            current_ipaddr = await aquery_ns(self.fqdn, self.rdtype, cached=False)
+        except Exception as e:
+            return self._evaluate(None, e)
+        return self._evaluate(current_ipaddr, None)
+
+    def _evaluate(self, current_ipaddr, exc):
+        """
+        decide whether we need to send this change.
+
+        :param current_ipaddr: ip address the master server answered with
+        :param exc: exception raised when querying the master server (or None)
+        :return: True if we need to send this change
+        :raises: SameIpError if the update is not needed
+        """
+        if self.action == 'del':
+            if exc is None:
+                # there is a dns entry
+                return True
+            if isinstance(exc, (dns.resolver.NXDOMAIN, dns.resolver.NoAnswer)):
+                # no dns entry, it is already deleted
+                return False
+            if isinstance(exc, (dns.resolver.Timeout, dns.resolver.NoNameservers)):  # OSError (socket.error) also?
+                # maybe could be caused by secondary DNS Timeout and master still ok?
+                # assume the delete is OK...
+                return True
+            raise exc
+        if exc is None:
+            # check if ip really changed
+            ok = self.ipaddr != current_ipaddr
+        elif isinstance(exc, (dns.resolver.NXDOMAIN, dns.resolver.NoAnswer)):
+            # no dns entry yet, ok
+            ok = True
+        elif isinstance(exc, (dns.resolver.Timeout, dns.resolver.NoNameservers)):  # OSError (socket.error) also?
+            # maybe could be caused by secondary DNS Timeout and master still ok?
+            # assume the update is OK...
+            ok = True
+        elif isinstance(exc, dns.message.UnknownTSIGKey):
+            raise DnsUpdateError("UnknownTSIGKey")
+        else:
+            raise exc
+        if not ok:
+            raise SameIpError
         # only send an update if the ip really changed as the update
         # causes write I/O on the nameserver and also traffic to the
         # dns slaves (they get a notify if we update the zone).
-        update_ns(fqdn, rdtype, ipaddr, action='upd', ttl=ttl)
-    else:
-        raise SameIpError
+        return True
+
+    def _failed_dependency(self):
+        return self.depends_on is not None and (self.depends_on.error is not None or self.depends_on.skipped)
+
+
+class UpdateBatch:
+    """
+    collect A/AAAA record changes (e.g. for the v4 and v6 address of a host)
+    and send them with as few dynamic updates as possible: all changes for
+    the same zone (and update key) go into one TSIG-signed update message.
+
+    like update() and delete(), it first checks the current state on the
+    master server (for all changes concurrently) and only sends the changes
+    that are needed.
+
+    note: the changes in one update message succeed or fail together, so use
+    a separate batch for changes that shall not affect each other.
+    """
+    def __init__(self):
+        self.changes = []
+
+    def update(self, fqdn, ipaddr, ttl=60, depends_on=None):
+        """
+        queue an update of the A or AAAA record of fqdn, see update().
+
+        :param fqdn: fully qualified domain name (FQDN)
+        :param ipaddr: new ip address
+        :param ttl: time to live, default 60s (int)
+        :param depends_on: a RecordChange - only do this change if that one succeeds
+        :return: RecordChange
+        :raises: ValueError if ipaddr is no valid ip address string
+        """
+        assert isinstance(fqdn, FQDN)
+        rdtype = check_ip(ipaddr, keys=('A', 'AAAA'))
+        change = RecordChange(fqdn, rdtype, ipaddr, 'upd', ttl, depends_on)
+        self.changes.append(change)
+        return change
+
+    def delete(self, fqdn, rdtype, depends_on=None):
+        """
+        queue a deletion of the A or AAAA record of fqdn, see delete().
+
+        :param fqdn: fully qualified domain name (FQDN)
+        :param rdtype: 'A' or 'AAAA'
+        :param depends_on: a RecordChange - only do this change if that one succeeds
+        :return: RecordChange
+        """
+        assert isinstance(fqdn, FQDN)
+        assert rdtype in ['A', 'AAAA', ]
+        change = RecordChange(fqdn, rdtype, None, 'del', None, depends_on)
+        self.changes.append(change)
+        return change
+
+    def _pending(self):
+        """
+        :return: list of the changes we need to check (skip the ones depending on a failed change)
+        """
+        pending = []
+        for change in self.changes:
+            if change._failed_dependency():
+                change.skipped = True
+            else:
+                pending.append(change)
+        return pending
+
+    async def _acheck_all(self, changes):
+        """
+        check the changes concurrently, so the queries to the master servers
+        run in parallel (but not more than QUERY_CONCURRENCY at the same time).
+
+        :return: dict ns info -> [change, ...] of the changes we need to send
+        """
+        semaphore = asyncio.Semaphore(QUERY_CONCURRENCY)
+
+        async def check(change):
+            async with semaphore:
+                try:
+                    if await change._acheck():
+                        return await sync_to_async(get_ns_info)(change.fqdn)
+                except Exception as e:
+                    change.error = e
+
+        groups = {}  # ns info -> [change, ...]
+        ns_infos = await asyncio.gather(*[check(change) for change in changes])
+        for change, ns_info in zip(changes, ns_infos):
+            if ns_info is not None:
+                groups.setdefault(self._group_key(ns_info), []).append(change)
+        return groups
+
+    def send(self):
+        """
+        check the queued changes and send the needed ones, one dynamic
+        update per zone. the outcome is recorded in the RecordChange objects.
+        """
+        changes = self._pending()
+        if len(changes) > 1:
+            groups = async_to_sync(self._acheck_all)(changes)
+        else:
+            groups = {}  # ns info -> [change, ...]
+            for change in changes:
+                try:
+                    if change._check():
+                        groups.setdefault(self._group_key(get_ns_info(change.fqdn)), []).append(change)
+                except Exception as e:
+                    change.error = e
+        for ns_info, changes in groups.items():
+            changes = self._unskipped(changes)
+            if not changes:
+                continue
+            try:
+                _send_update(*self._build_update(ns_info, changes))
+            except Exception as e:
+                for change in changes:
+                    change.error = e
+            self._remember(changes)
+
+    async def asend(self):
+        """
+        async variant of send.
+        """
+        groups = await self._acheck_all(self._pending())
+        for ns_info, changes in groups.items():
+            changes = self._unskipped(changes)
+            if not changes:
+                continue
+            try:
+                await _asend_update(*self._build_update(ns_info, changes))
+            except Exception as e:
+                for change in changes:
+                    change.error = e
+            self._remember(changes)
+
+    @staticmethod
+    def _group_key(ns_info):
+        # changes for different hosts in the same zone go into the same update message
+        nameserver, nameserver2, origin, domain, name, keyname, key, algo = ns_info
+        return nameserver, origin, domain, keyname, key, algo
+
+    @staticmethod
+    def _unskipped(changes):
+        # a change in an earlier update message might have failed meanwhile
+        for change in changes:
+            if change._failed_dependency():
+                change.skipped = True
+        return [change for change in changes if not change.skipped]
+
+    @staticmethod
+    def _build_update(ns_info, changes):
+        """
+        :return: arguments for _send_update / _asend_update
+        """
+        nameserver, origin, domain, keyname, key, algo = ns_info
+        upd = _make_update(origin, keyname, key, algo)
+        for change in changes:
+            _add_to_update(upd, change.action, change.fqdn.host, change.rdtype, change.ipaddr, change.ttl)
+        logger.debug("performing %d changes for origin %s" % (len(changes), origin))
+        return upd, nameserver, origin, domain, "%d changes for origin %s" % (len(changes), origin)
 
+    @staticmethod
+    def _remember(changes):
+        for change in changes:
+            _remember_change(change.fqdn, change.rdtype, change.ipaddr, change.action, change.error is None)
 
-def query_ns(fqdn, rdtype, prefer_primary=False):
+
+class ResolverRegistry:
+    """
+    Configured resolvers, one per Domain (and nameserver preference).
+
+    Setting up a resolver is not expensive, but we need one for every query,
+    so we rather reuse them. A resolver gets rebuilt if the nameserver IPs
+    of the zone (or the timeout) changed.
+    """
+    def __init__(self):
+        self.hits = 0
+        self.rebuilds = 0
+        self._resolvers = {}  # (domain, prefer_primary, asynchronous) -> (config, resolver)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _build(nameserver, nameserver2, prefer_primary, lifetime, asynchronous):
+        resolver_class = dns.asyncresolver.Resolver if asynchronous else dns.resolver.Resolver
+        resolver = resolver_class(configure=False)
+        # we do not configure it from resolv.conf, but patch in the values we
+        # want into the documented attributes:
+        resolver.nameservers = [nameserver, ]
+        if nameserver2:
+            pos = 1 if prefer_primary else 0
+            resolver.nameservers.insert(pos, nameserver2)
+        # we must put the root zone into the search list, so that if a fqdn without "."
+        # at the end comes in, it will append "." (and not the service server's domain).
+        resolver.search = [dns.name.root, ]
+        resolver.lifetime = lifetime
+        # as we query directly the (authoritative) master dns, we do not desire
+        # recursion. But: RD (recursion desired) is the internal default for flags
+        # (used if flags = None is given). Thus, we explicitly give flags (all off):
+        resolver.flags = 0
+        return resolver
+
+    def get(self, domain, nameserver, nameserver2, prefer_primary=False, asynchronous=False):
+        """
+        get a resolver querying the nameserver(s) of a zone
+
+        note: do not modify the resolver, it is shared.
+
+        :param domain: name of the Domain
+        :param nameserver: primary nameserver IP
+        :param nameserver2: secondary nameserver IP (or None)
+        :param prefer_primary: whether we rather want to query the primary first
+        :param asynchronous: True to get a dns.asyncresolver.Resolver
+        :return: dns.resolver.Resolver
+        """
+        key = (domain, prefer_primary, asynchronous)
+        config = (nameserver, nameserver2, RESOLVER_TIMEOUT)
+        with self._lock:
+            entry = self._resolvers.get(key)
+            if entry is not None and entry[0] == config:
+                self.hits += 1
+                return entry[1]
+            resolver = self._build(nameserver, nameserver2, prefer_primary, RESOLVER_TIMEOUT, asynchronous)
+            self._resolvers[key] = (config, resolver)
+            self.rebuilds += 1
+            return resolver
+
+    def clear(self):
+        with self._lock:
+            self._resolvers.clear()
+
+
+resolvers = ResolverRegistry()
+
+
+def query_ns(fqdn, rdtype, prefer_primary=False, cached=True):
     """
     query a dns name from our DNS server(s)
 
@@ -238,37 +661,180 @@ def query_ns(fqdn, rdtype, prefer_primary=False):
     :param rdtype: the query type
     :type rdtype: int or str
     :param prefer_primary: whether we rather want to query the primary first
+    :param cached: whether an A/AAAA answer may come from the answer cache
     :return: IP (as str)
     :raises: see dns.resolver.Resolver.resolve
     """
     assert isinstance(fqdn, FQDN)
-    nameserver, nameserver2, origin = get_ns_info(fqdn)[0:3]
-    resolver = dns.resolver.Resolver(configure=False)
-    # we do not configure it from resolv.conf, but patch in the values we
-    # want into the documented attributes:
-    resolver.nameservers = [nameserver, ]
-    if nameserver2:
-        pos = 1 if prefer_primary else 0
-        resolver.nameservers.insert(pos, nameserver2)
-    # we must put the root zone into the search list, so that if a fqdn without "."
-    # at the end comes in, it will append "." (and not the service server's domain).
-    resolver.search = [dns.name.root, ]
-    resolver.lifetime = RESOLVER_TIMEOUT
-    # as we query directly the (authoritative) master dns, we do not desire
-    # recursion. But: RD (recursion desired) is the internal default for flags
-    # (used if flags = None is given). Thus, we explicitly give flags (all off):
-    resolver.flags = 0
+    nameserver, nameserver2, origin, domain = get_ns_info(fqdn)[0:4]
+    if cached:
+        ip = _cached_answer(fqdn, rdtype)
+        if ip is not None:
+            return ip
+    resolver = resolvers.get(domain, nameserver, nameserver2, prefer_primary)
     try:
         answer = resolver.resolve(str(fqdn), rdtype, search=True)
-        ip = str(list(answer)[0])
-        logger.debug("query: %s answer: %s" % (fqdn, ip))
-        return ip
-    except (dns.resolver.Timeout, dns.resolver.LifetimeTimeout,
-            dns.resolver.NoNameservers, dns.message.UnknownTSIGKey) as e:  # OSError (socket.error) also?
-        logger.warning("error when querying for name '%s' in zone '%s' with rdtype '%s' [%s]." % (
-                       fqdn.host, origin, rdtype, str(e)))
-        set_ns_availability(origin, False)
+    except Exception as e:
+        if _query_failed(fqdn, rdtype, origin, e):
+            set_ns_availability(origin, False)
+        raise
+    return _query_answered(fqdn, rdtype, answer)
+
+
+async def aquery_ns(fqdn, rdtype, prefer_primary=False, cached=True):
+    """
+    async variant of query_ns, see there.
+    """
+    assert isinstance(fqdn, FQDN)
+    nameserver, nameserver2, origin, domain = (await sync_to_async(get_ns_info)(fqdn))[0:4]
+    if cached:
+        ip = _cached_answer(fqdn, rdtype)
+        if ip is not None:
+            return ip
+    resolver = resolvers.get(domain, nameserver, nameserver2, prefer_primary, asynchronous=True)
+    try:
+        answer = await resolver.resolve(str(fqdn), rdtype, search=True)
+    except Exception as e:
+        if _query_failed(fqdn, rdtype, origin, e):
+            await sync_to_async(set_ns_availability)(origin, False)
         raise
+    return _query_answered(fqdn, rdtype, answer)
+
+
+def _cached_answer(fqdn, rdtype):
+    """
+    :return: IP (as str) or None if we have no cached answer
+    :raises: NXDOMAIN or NoAnswer if that is the cached answer
+    """
+    if rdtype in CACHED_RDTYPES:
+        answer = answer_cache.get((str(fqdn), rdtype))
+        if isinstance(answer, str):
+            logger.debug("query: %s answer: %s (cached)" % (fqdn, answer))
+            return answer
+        if answer is not None:
+            raise answer()  # NXDOMAIN or NoAnswer
+
+
+def _query_answered(fqdn, rdtype, answer):
+    ip = str(list(answer)[0])
+    logger.debug("query: %s answer: %s" % (fqdn, ip))
+    if rdtype in CACHED_RDTYPES:
+        answer_cache.set((str(fqdn), rdtype), ip)
+    return ip
+
+
+def _query_failed(fqdn, rdtype, origin, exc):
+    """
+    :return: True if the nameserver shall be flagged unavailable
+    """
+    if isinstance(exc, (dns.resolver.NXDOMAIN, dns.resolver.NoAnswer)):
+        if rdtype in CACHED_RDTYPES:
+            answer_cache.set((str(fqdn), rdtype), type(exc))
+        return False
+    if isinstance(exc, (dns.resolver.Timeout, dns.resolver.LifetimeTimeout,
+                        dns.resolver.NoNameservers, dns.message.UnknownTSIGKey)):  # OSError (socket.error) also?
+        logger.warning("error when querying for name '%s' in zone '%s' with rdtype '%s' [%s]." % (
+                       fqdn.host, origin, rdtype, str(exc)))
+        return True
+    return False
+
+
+def query_ns_many(queries, deadline=None, prefer_primary=False, concurrency=None, flag_unavailable=True):
+    """
+    query many dns names from our DNS server(s) concurrently
+
+    this is like calling query_ns for each query, but the total time is
+    bounded by the slowest query (and the deadline) instead of the sum.
+
+    :param queries: iterable of (fqdn, rdtype) tuples
+    :param deadline: max. time to wait for all answers [s], default: RESOLVER_TIMEOUT
+    :param prefer_primary: whether we rather want to query the primary first
+    :param concurrency: max. count of queries in flight, default: QUERY_CONCURRENCY
+    :param flag_unavailable: whether to flag the zones of failed queries as not available
+                             (set to False if the caller does that on its own)
+    :return: dict (fqdn, rdtype) -> IP (as str) or the exception query_ns would have raised
+             (DeadlineExceeded if there was no answer within the deadline)
+    """
+    if deadline is None:
+        deadline = RESOLVER_TIMEOUT
+    results = {}
+    todo = []
+    for fqdn, rdtype in queries:
+        assert isinstance(fqdn, FQDN)
+        key = (fqdn, rdtype)
+        if key in results:
+            continue
+        try:
+            ns_info = get_ns_info(fqdn)
+            ip = _cached_answer(fqdn, rdtype)
+        except Exception as e:
+            results[key] = e
+            continue
+        if ip is not None:
+            results[key] = ip
+        else:
+            results[key] = None  # placeholder, also deduplicates
+            todo.append((fqdn, rdtype, ns_info))
+    if todo:
+        answers = async_to_sync(_aresolve_many)(todo, deadline, prefer_primary, concurrency or QUERY_CONCURRENCY)
+        unavailable = set()
+        for (fqdn, rdtype, ns_info), answer in zip(todo, answers):
+            origin = ns_info[2]
+            if answer is None:
+                # not answered within the deadline, not necessarily a nameserver issue
+                results[(fqdn, rdtype)] = DeadlineExceeded(timeout=deadline, errors=[])
+            elif isinstance(answer, Exception):
+                if _query_failed(fqdn, rdtype, origin, answer):
+                    unavailable.add(origin)
+                results[(fqdn, rdtype)] = answer
+            else:
+                results[(fqdn, rdtype)] = _query_answered(fqdn, rdtype, answer)
+        if flag_unavailable:
+            # flag each unavailable zone only once (and not from many threads)
+            for origin in unavailable:
+                set_ns_availability(origin, False)
+    return results
+
+
+async def _aresolve_many(todo, deadline, prefer_primary, concurrency):
+    """
+    :param todo: list of (fqdn, rdtype, ns_info) tuples
+    :param deadline: max. time to wait for all answers [s]
+    :param prefer_primary: whether we rather want to query the primary first
+    :param concurrency: max. count of queries in flight
+    :return: list of answers, exceptions or None (if not answered within the deadline)
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def resolve(fqdn, rdtype, ns_info):
+        nameserver, nameserver2, origin, domain = ns_info[0:4]
+        resolver = resolvers.get(domain, nameserver, nameserver2, prefer_primary, asynchronous=True)
+        async with semaphore:
+            try:
+                return await resolver.resolve(str(fqdn), rdtype, search=True)
+            except Exception as e:
+                return e
+
+    tasks = [asyncio.ensure_future(resolve(*item)) for item in todo]
+    done, pending = await asyncio.wait(tasks, timeout=deadline)
+    for task in pending:
+        task.cancel()
+    return [task.result() if task in done else None for task in tasks]
+
+
+def _remember_change(fqdn, rdtype, ipaddr, action, ok):
+    """
+    update the answer cache after we sent a change to the master server
+
+    :param ok: whether the change was done - if not, we do not know the state
+    """
+    key = (str(fqdn), rdtype)
+    if not ok:
+        answer_cache.delete(key)
+    elif action == 'del':
+        answer_cache.set(key, dns.resolver.NoAnswer)
+    else:
+        answer_cache.set(key, ipaddr)
 
 
 def rev_lookup(ipaddr):
@@ -306,6 +872,65 @@ def rev_lookup(ipaddr):
     return ''
 
 
+class ReverseResolver:
+    """
+    Does reverse DNS lookups (rev_lookup) in background threads, so a slow
+    lookup does not stall the request. The results go into a TTLCache.
+
+    :param cache: TTLCache ip -> hostname
+    :param workers: count of threads, 0 = look up synchronously
+    """
+    def __init__(self, cache, workers=RDNS_WORKERS):
+        self.cache = cache
+        self.workers = workers
+        self._executor = None
+        self._pending = set()  # ips we are currently looking up
+        self._lock = threading.Lock()
+
+    def lookup(self, ipaddr):
+        """
+        get the hostname of ipaddr from the cache, start a background lookup if it is not there.
+
+        :param ipaddr: ip address (str)
+        :return: hostname ('' if lookup failed) or None if we do not know it yet
+        """
+        name = self.cache.get(ipaddr)
+        if name is None:
+            if not self.workers:
+                name = rev_lookup(ipaddr)
+                self.cache.set(ipaddr, name)
+                return name
+            with self._lock:
+                if ipaddr not in self._pending:
+                    self._pending.add(ipaddr)
+                    if self._executor is None:
+                        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='rdns')
+                    self._executor.submit(self._resolve, ipaddr)
+        return name
+
+    def _resolve(self, ipaddr):
+        try:
+            name = rev_lookup(ipaddr)
+        except Exception as e:
+            logger.warning("reverse lookup of %s failed [%r]" % (ipaddr, e))
+            name = ''
+        try:
+            self.cache.set(ipaddr, name)
+        finally:
+            with self._lock:
+                self._pending.discard(ipaddr)
+
+    def shutdown(self, wait=True):
+        """stop the threads (a new lookup will start new ones)"""
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=wait)
+
+
+rdns_resolver = ReverseResolver(rdns_cache)
+
+
 def get_ns_info(fqdn):
     """
     Get the master nameserver for fqdn, the key secret needed to update the zone and the key algorithm used.
@@ -316,17 +941,18 @@ def get_ns_info(fqdn):
     """
     assert isinstance(fqdn, FQDN)
     from .models import Domain
-    try:
-        # first we check if we have an entry for the fqdn
-        # single-host update secret use case
-        # XXX we need 2 DB accesses for the usual case just to support this rare case
-        domain = str(fqdn)
-        d = Domain.objects.get(name=domain)
-    except Domain.DoesNotExist:
+    # first we check if we have an entry for the fqdn
+    # single-host update secret use case
+    # note: the zone metadata is cached, so this costs no DB access
+    domain = str(fqdn)
+    d = domain_cache.get(domain)
+    if d is None:
         # now check the base zone, the usual case
         # zone update secret use case
         domain = fqdn.domain
-        d = Domain.objects.get(name=domain)
+        d = domain_cache.get(domain)
+        if d is None:
+            raise Domain.DoesNotExist("Domain matching query does not exist.")
     if not d.available:
         if d.last_update + timedelta(seconds=UNAVAILABLE_RETRY) > now():
             # if there are troubles with a nameserver, we set available=False
@@ -336,9 +962,9 @@ def get_ns_info(fqdn):
         else:
             # retry timeout is over, set it available again
             set_ns_availability(domain, True)
-    algorithm = getattr(dns.tsig, d.nameserver_update_algorithm)
+    algorithm = getattr(dns.tsig, d.update_algorithm)
     return (d.nameserver_ip, d.nameserver2_ip, fqdn.domain, domain, fqdn.host, domain,
-            d.nameserver_update_secret, algorithm)
+            d.update_secret, algorithm)
 
 
 def dns_update_error(domain, exc, error):
@@ -347,6 +973,93 @@ def dns_update_error(domain, exc, error):
     raise DnsUpdateError(error) from exc
 
 
+def _make_update(origin, keyname, key, algo):
+    try:
+        keyring = domain_cache.get_keyring(keyname, key)
+    except (UnicodeError, binascii.Error) as e:
+        msg = "Exception when building keyring for %s: [%s]" % (keyname, str(e))
+        logger.error(msg)
+        raise DnsUpdateError(msg)
+    return dns.update.Update(origin, keyring=keyring, keyalgorithm=algo)
+
+
+def _add_to_update(upd, action, name, rdtype, ipaddr, ttl):
+    if action == 'add':
+        assert ipaddr is not None
+        upd.add(name, ttl, rdtype, ipaddr)
+    elif action == 'del':
+        upd.delete(name, rdtype)
+    elif action == 'upd':
+        assert ipaddr is not None
+        upd.replace(name, ttl, rdtype, ipaddr)
+
+
+def _send_update(upd, nameserver, origin, domain, what):
+    """
+    send a dynamic update to the master server
+
+    :param upd: the update message
+    :param nameserver: master nameserver IP
+    :param origin: zone
+    :param domain: domain (for availability flagging)
+    :param what: description of the update (for error messages)
+    :return: dns response
+    :raises: DnsUpdateError
+    """
+    try:
+        # reuse a persistent connection to the nameserver, if we have one
+        response = pool.query(upd, nameserver, timeout=UPDATE_TIMEOUT, tls=UPDATE_TRANSPORT == 'tls')
+    except (OSError, EOFError, dns.exception.DNSException) as e:  # OSError was: socket.error (deprecated)
+        dns_update_error(domain, e, _update_error_msg(e, origin, what))
+    return _check_response(response, what)
+
+
+async def _asend_update(upd, nameserver, origin, domain, what):
+    """
+    async variant of _send_update, see there.
+    """
+    try:
+        if UPDATE_TRANSPORT == 'tls':
+            response = await dns.asyncquery.tls(upd, nameserver, timeout=UPDATE_TIMEOUT,
+                                                ssl_context=make_ssl_context())
+        else:
+            response = await dns.asyncquery.tcp(upd, nameserver, timeout=UPDATE_TIMEOUT)
+    except (OSError, EOFError, dns.exception.DNSException) as e:
+        await sync_to_async(dns_update_error)(domain, e, _update_error_msg(e, origin, what))
+    return _check_response(response, what)
+
+
+def _check_response(response, what):
+    rcode = response.rcode()
+    if rcode != dns.rcode.NOERROR:
+        rcode_text = dns.rcode.to_text(rcode)
+        logger.warning("DNS error [%s] performing %s" % (rcode_text, what))
+        raise DnsUpdateError(rcode_text)
+    return response
+
+
+def _update_error_msg(e, origin, what):
+    """
+    :return: error message for an exception raised while sending an update
+    """
+    # TODO simplify exception handling when https://github.com/rthalley/dnspython/pull/85 is merged/released
+    if isinstance(e, OSError):
+        return f"OSError [{e}] - zone: {origin}"
+    if isinstance(e, EOFError):
+        return f"EOFError [{e}] - zone: {origin}"
+    if isinstance(e, dns.exception.Timeout):
+        return f"timeout when performing {what}"
+    if isinstance(e, dns.tsig.PeerBadSignature):
+        return f"PeerBadSignature - shared secret mismatch? zone: {origin}"
+    if isinstance(e, dns.tsig.PeerBadKey):
+        return f"PeerBadKey - shared secret mismatch? zone: {origin}"
+    if isinstance(e, dns.tsig.PeerBadTime):
+        return f"PeerBadTime - DNS server did not like the time we sent. zone: {origin}"
+    if isinstance(e, dns.message.UnknownTSIGKey):
+        return f"UnknownTSIGKey [{e}] - zone: {origin}"
+    return str(e)
+
+
 def update_ns(fqdn, rdtype='A', ipaddr=None, action='upd', ttl=60):
     """
     update the master server
@@ -361,50 +1074,43 @@ def update_ns(fqdn, rdtype='A', ipaddr=None, action='upd', ttl=60):
     """
     assert isinstance(fqdn, FQDN)
     assert action in ['add', 'del', 'upd', ]
-    nameserver, nameserver2, origin, domain, name, keyname, key, algo = get_ns_info(fqdn)
+    args = _build_update(get_ns_info(fqdn), rdtype, ipaddr, action, ttl)
+    ok = False
     try:
-        keyring = dns.tsigkeyring.from_text({keyname: key})
-    except (UnicodeError, binascii.Error) as e:
-        msg = "Exception when building keyring for %s: [%s]" % (keyname, str(e))
-        logger.error(msg)
-        raise DnsUpdateError(msg)
-    upd = dns.update.Update(origin, keyring=keyring, keyalgorithm=algo)
-    if action == 'add':
-        assert ipaddr is not None
-        upd.add(name, ttl, rdtype, ipaddr)
-    elif action == 'del':
-        upd.delete(name, rdtype)
-    elif action == 'upd':
-        assert ipaddr is not None
-        upd.replace(name, ttl, rdtype, ipaddr)
-    logger.debug("performing %s for name %s and origin %s with rdtype %s and ipaddr %s" % (
-                 action, name, origin, rdtype, ipaddr))
+        response = _send_update(*args)
+        ok = True
+        return response
+    finally:
+        _remember_change(fqdn, rdtype, ipaddr, action, ok)
+
+
+async def aupdate_ns(fqdn, rdtype='A', ipaddr=None, action='upd', ttl=60):
+    """
+    async variant of update_ns, see there.
+    """
+    assert isinstance(fqdn, FQDN)
+    assert action in ['add', 'del', 'upd', ]
+    args = _build_update(await sync_to_async(get_ns_info)(fqdn), rdtype, ipaddr, action, ttl)
+    ok = False
     try:
-        response = dns.query.tcp(upd, nameserver, timeout=UPDATE_TIMEOUT)
-        rcode = response.rcode()
-        if rcode != dns.rcode.NOERROR:
-            rcode_text = dns.rcode.to_text(rcode)
-            logger.warning("DNS error [%s] performing %s for name %s and origin %s with rdtype %s and ipaddr %s" % (
-                           rcode_text, action, name, origin, rdtype, ipaddr))
-            raise DnsUpdateError(rcode_text)
+        response = await _asend_update(*args)
+        ok = True
         return response
-    # TODO simplify exception handling when https://github.com/rthalley/dnspython/pull/85 is merged/released
-    except OSError as e:  # was: socket.error (deprecated)
-        dns_update_error(domain, e, f"OSError [{e}] - zone: {origin}")
-    except EOFError as e:
-        dns_update_error(domain, e, f"EOFError [{e}] - zone: {origin}")
-    except dns.exception.Timeout as e:
-        dns_update_error(domain, e, f"timeout when performing {action} for name {name} and origin {origin} with rdtype {rdtype} and ipaddr {ipaddr}")
-    except dns.tsig.PeerBadSignature as e:
-        dns_update_error(domain, e, f"PeerBadSignature - shared secret mismatch? zone: {origin}")
-    except dns.tsig.PeerBadKey as e:
-        dns_update_error(domain, e, f"PeerBadKey - shared secret mismatch? zone: {origin}")
-    except dns.tsig.PeerBadTime as e:
-        dns_update_error(domain, e, f"PeerBadTime - DNS server did not like the time we sent. zone: {origin}")
-    except dns.message.UnknownTSIGKey as e:
-        dns_update_error(domain, e, f"UnknownTSIGKey [{e}] - zone: {origin}")
-    except dns.exception.DNSException as e:
-        dns_update_error(domain, e, str(e))
+    finally:
+        _remember_change(fqdn, rdtype, ipaddr, action, ok)
+
+
+def _build_update(ns_info, rdtype, ipaddr, action, ttl):
+    """
+    :return: arguments for _send_update / _asend_update
+    """
+    nameserver, nameserver2, origin, domain, name, keyname, key, algo = ns_info
+    upd = _make_update(origin, keyname, key, algo)
+    _add_to_update(upd, action, name, rdtype, ipaddr, ttl)
+    logger.debug("performing %s for name %s and origin %s with rdtype %s and ipaddr %s" % (
+                 action, name, origin, rdtype, ipaddr))
+    return (upd, nameserver, origin, domain,
+            f"{action} for name {name} and origin {origin} with rdtype {rdtype} and ipaddr {ipaddr}")
 
 
 def set_ns_availability(domain, available):
@@ -446,11 +1152,74 @@ def put_ip_into_session(session, ipaddr, kind=None, max_age=0,
         # we have a new ip, remember it, with timestamp
         session[kind + '_timestamp'] = int(time.time())
         session[kind] = ipaddr
-        session[kind + '_rdns'] = rev_lookup(ipaddr)  # may be slow
+        # if the lookup is not done yet, fill_rdns_into_session puts it in later:
+        session[kind + '_rdns'] = (rdns_resolver.lookup(ipaddr) or '') if ipaddr else ''
     else:
-        old_timestamp = session.get(kind + '_timestamp')
+        old_timestamp = get_ip_timestamp(session, kind)
         if not max_age or old_timestamp is None or old_timestamp + max_age < int(time.time()):
             # keep it fresh (to avoid that it gets killed and triggers detection)
-            session[kind + '_timestamp'] = int(time.time())
+            set_ip_timestamp(session, kind, int(time.time()))
     if save and session.modified:
         session.save()
+
+
+def _ip_timestamp_key(session, kind):
+    """
+    :return: django cache key for the timestamp of the ip of that kind in the session
+             or None if we keep the timestamp in the session
+    """
+    session_key = getattr(session, 'session_key', None)
+    if not settings.MINIMIZE_SESSION_WRITES or session_key is None:
+        return None
+    # the ip is part of the key, so a timestamp never gets applied to another ip
+    return 'ip_timestamp:%s:%s:%s' % (session_key, kind, session.get(kind))
+
+
+def get_ip_timestamp(session, kind):
+    """
+    get the time when the ip of that kind in the session was last seen.
+
+    :param session: the session object
+    :param kind: 'ipv4' or 'ipv6'
+    :return: timestamp [int, s since epoch] or None
+    """
+    key = _ip_timestamp_key(session, kind)
+    if key is not None:
+        timestamp = cache.get(key)
+        if timestamp is not None:
+            return timestamp
+    # set when the ip was put into the session
+    return session.get(kind + '_timestamp')
+
+
+def set_ip_timestamp(session, kind, timestamp):
+    """
+    remember that the ip of that kind in the session was seen at timestamp.
+
+    with settings.MINIMIZE_SESSION_WRITES, the timestamp is kept in the django cache,
+    so we need not write the session just because the same ip was seen again.
+
+    :param session: the session object
+    :param kind: 'ipv4' or 'ipv6'
+    :param timestamp: [int, s since epoch]
+    """
+    key = _ip_timestamp_key(session, kind)
+    if key is not None:
+        cache.set(key, timestamp, timeout=settings.SESSION_COOKIE_AGE)
+    else:
+        session[kind + '_timestamp'] = timestamp
+
+
+def fill_rdns_into_session(session):
+    """
+    put the reverse dns names of the ips in the session into the session,
+    if the background lookups (see put_ip_into_session) have finished meanwhile.
+
+    :param session: the session object
+    """
+    for kind in ('ipv4', 'ipv6'):
+        ipaddr = session.get(kind)
+        if ipaddr and not session.get(kind + '_rdns'):
+            name = rdns_resolver.lookup(ipaddr)
+            if name:
+                session[kind + '_rdns'] = name
@@ -0,0 +1,140 @@
+"""
+In-process cache of the zone metadata from the Domain table.
+
+Every query and update needs the nameserver IPs, the update key and the
+availability of the zone, so we keep them in memory instead of hitting the
+database (up to 2x) for every dns operation. As users can add their own
+domains, there might be many Domain records, so we load them one by one when
+they are needed (and also remember names that are no Domain, as get_ns_info
+first looks for a zone named like the host).
+
+The cache entry of a Domain is invalidated by the post_save / post_delete
+signals of Domain (see models.py). As other processes do not see our signals,
+entries also expire after MAX_AGE seconds.
+"""
+
+import os
+
+# reload the zone metadata after this time [s], to notice changes done by other processes
+MAX_AGE = float(os.environ.get('DOMAIN_CACHE_MAX_AGE', '60.0'))
+
+# max. count of zone names (and of update keys) we remember
+CACHE_SIZE = int(os.environ.get('DOMAIN_CACHE_SIZE', '10000'))
+
+
+from collections import namedtuple
+import functools
+import threading
+
+import logging
+logger = logging.getLogger(__name__)
+
+import dns.tsigkeyring
+
+from django.db import transaction
+
+from ..utils.ttlcache import TTLCache
+
+
+ZoneInfo = namedtuple('ZoneInfo', ['name', 'nameserver_ip', 'nameserver2_ip',
+                                   'update_secret', 'update_algorithm', 'available', 'last_update'])
+
+# cached "there is no such Domain"
+NO_ZONE = 'no zone'
+
+
+class DomainCache:
+    """
+    Versioned cache of Domain records (as ZoneInfo tuples) and of the
+    TSIG keyrings built from their update secrets.
+
+    invalidate() bumps the version, so a load that raced with a change
+    of the Domain table does not get stored.
+    """
+    def __init__(self, max_age=MAX_AGE, maxsize=CACHE_SIZE):
+        self.max_age = max_age
+        self.version = 0
+        self.loads = 0
+        self._zones = TTLCache(maxsize=maxsize, ttl=max_age)  # name -> ZoneInfo or NO_ZONE
+        self._names = {}  # Domain pk -> name, to find the entry of a renamed Domain
+        self._keyrings = TTLCache(maxsize=maxsize, ttl=max_age)
+        self._lock = threading.Lock()
+
+    def _load(self, name):
+        from .models import Domain
+        version = self.version
+        d = Domain.objects.filter(name=name).first()
+        if d is None:
+            zone = NO_ZONE
+        else:
+            zone = ZoneInfo(d.name, d.nameserver_ip, d.nameserver2_ip,
+                            d.nameserver_update_secret, d.nameserver_update_algorithm,
+                            d.available, d.last_update)
+        with self._lock:
+            if version == self.version:
+                self._zones.set(name, zone)
+                if d is not None:
+                    self._names[d.pk] = name
+                self.loads += 1
+        return zone
+
+    def get(self, name):
+        """
+        get the metadata of a zone
+
+        :param name: zone name (str)
+        :return: ZoneInfo or None if we have no such Domain
+        """
+        zone = self._zones.get(name)
+        if zone is None:
+            zone = self._load(name)
+        return None if zone is NO_ZONE else zone
+
+    def get_keyring(self, keyname, secret):
+        """
+        get the (parsed) keyring for an update key
+
+        :param keyname: name of the key (str)
+        :param secret: base64 encoded secret (str)
+        :return: keyring
+        :raises: UnicodeError, binascii.Error if the secret is invalid
+        """
+        key = (keyname, secret)
+        keyring = self._keyrings.get(key)
+        if keyring is None:
+            keyring = dns.tsigkeyring.from_text({keyname: secret})
+            self._keyrings.set(key, keyring)
+        return keyring
+
+    def invalidate(self, name=None, pk=None):
+        """
+        forget a zone (or everything), the next access will reload it from the database
+
+        :param name: zone name (str) or None (everything)
+        :param pk: Domain pk, to also forget the zone under its old name if it was renamed
+        """
+        with self._lock:
+            self.version += 1
+            if name is None:
+                self._zones.clear()
+                self._names.clear()
+                self._keyrings.clear()
+            else:
+                self._zones.delete(name)
+                old_name = self._names.pop(pk, None)
+                if old_name is not None:
+                    self._zones.delete(old_name)
+
+
+cache = DomainCache()
+
+
+def invalidate_domain_cache(sender, instance=None, **kwargs):
+    if instance is not None:
+        invalidate = functools.partial(cache.invalidate, instance.name, instance.pk)
+    else:
+        invalidate = cache.invalidate
+    invalidate()
+    # if we are in a transaction, another thread might reload the old state
+    # before the changes get committed, so invalidate again after the commit.
+    transaction.on_commit(invalidate)
@@ -0,0 +1,212 @@
+"""
+IP address policy: which IP addresses are not acceptable for hosts.
+
+The policy comes from settings.BAD_IPS_HOST (blocked for all domains) and
+from the BlacklistedNetwork table (blocked or allowed networks, for all or
+for a specific domain). As that can be a lot of networks, we compile them
+into prefix tables: per prefix length, a dict of the network addresses.
+Looking up an address costs one dict lookup per prefix length we have
+networks for (at most 33 for IPv4, 129 for IPv6), no matter how many
+networks there are. The longest matching prefix wins, so an allowed
+network can make an exception in a wider blocked one.
+
+The cache is invalidated by the post_save / post_delete signals of
+BlacklistedNetwork (see models.py) and if settings.BAD_IPS_HOST gets changed
+(tests). As other processes do not see our signals, it also expires after
+MAX_AGE seconds.
+"""
+
+import os
+
+# reload the policy after this time [s], to notice changes done by other processes
+MAX_AGE = float(os.environ.get('IP_POLICY_CACHE_MAX_AGE', '60.0'))
+
+
+import ipaddress
+import threading
+import time
+
+import logging
+logger = logging.getLogger(__name__)
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.db import transaction
+
+BLOCK, ALLOW = 'block', 'allow'
+
+
+class PrefixTable:
+    """
+    maps IP networks to values, lookup by longest prefix match.
+    """
+    def __init__(self):
+        # version -> [(prefixlen, {network address (int) >> host bits: value}), ...] longest prefix first
+        self._tables = {4: [], 6: []}
+
+    def add(self, network, value):
+        """
+        :param network: IP network (str, like '192.0.2.0/24' or '2001:db8::1')
+        :param value: value for addresses in network
+        """
+        network = ipaddress.ip_network(network, strict=False)
+        tables = self._tables[network.version]
+        shift = network.max_prefixlen - network.prefixlen
+        for prefixlen, table in tables:
+            if prefixlen == network.prefixlen:
+                break
+        else:
+            table = {}
+            tables.append((network.prefixlen, table))
+            tables.sort(key=lambda item: item[0], reverse=True)
+        table[int(network.network_address) >> shift] = value
+
+    def match(self, ip):
+        """
+        :param ip: IP address (str or ipaddress.IPv4Address / IPv6Address)
+        :return: (prefixlen, value) of the longest matching network or None
+        :raises: ValueError if ip is not a valid address
+        """
+        if isinstance(ip, str):
+            ip = ipaddress.ip_address(ip)
+        ip_int, max_prefixlen = int(ip), ip.max_prefixlen
+        for prefixlen, table in self._tables[ip.version]:
+            value = table.get(ip_int >> (max_prefixlen - prefixlen))
+            if value is not None:
+                return prefixlen, value
+        return None
+
+    def lookup(self, ip):
+        """
+        :param ip: IP address (str or ipaddress.IPv4Address / IPv6Address)
+        :return: value of the longest matching network or None
+        :raises: ValueError if ip is not a valid address
+        """
+        match = self.match(ip)
+        return None if match is None else match[1]
+
+    def __len__(self):
+        return sum(len(table) for tables in self._tables.values() for _, table in tables)
+
+
+class IPPolicy:
+    """
+    the compiled policy: a global PrefixTable plus one per domain.
+
+    The longest matching network of both wins, if both have the same
+    network, the domain's entry wins.
+    """
+    def __init__(self):
+        self.all_domains = PrefixTable()
+        self.domains = {}  # domain name -> PrefixTable
+
+    def add(self, network, action, domain=None):
+        """
+        :param network: IP network (str)
+        :param action: BLOCK or ALLOW
+        :param domain: domain name (str) or None (all domains)
+        """
+        if domain is None:
+            table = self.all_domains
+        else:
+            table = self.domains.setdefault(domain, PrefixTable())
+        table.add(network, action)
+
+    def is_blocked(self, ip, domain=None):
+        """
+        :param ip: IP address (str or ipaddress.IPv4Address / IPv6Address)
+        :param domain: domain name (str) of the host or None
+        :return: True if ip is not acceptable for hosts (in that domain)
+        """
+        if isinstance(ip, str):
+            ip = ipaddress.ip_address(ip)
+        match = self.all_domains.match(ip)
+        table = self.domains.get(domain)
+        if table is not None:
+            domain_match = table.match(ip)
+            if domain_match is not None and (match is None or domain_match[0] >= match[0]):
+                match = domain_match
+        return match is not None and match[1] == BLOCK
+
+
+def load_policy():
+    """
+    build the IPPolicy from settings.BAD_IPS_HOST and the BlacklistedNetwork table
+    """
+    from .models import BlacklistedNetwork
+    policy = IPPolicy()
+    for cidr in settings.BAD_IPS_HOST.iter_cidrs():
+        policy.add(str(cidr), BLOCK)
+    for network, allow, domain in BlacklistedNetwork.objects.values_list('network', 'allow', 'domain__name'):
+        try:
+            policy.add(network, ALLOW if allow else BLOCK, domain)
+        except ValueError as e:
+            logger.warning("ignoring invalid blacklisted network %r [%s]" % (network, e))
+    return policy
+
+
+class IPPolicyCache:
+    """
+    Versioned cache of the IPPolicy.
+
+    invalidate() bumps the version, so a reload that raced with a change
+    of the BlacklistedNetwork table does not get stored.
+    """
+    def __init__(self, max_age=MAX_AGE):
+        self.max_age = max_age
+        self.version = 0
+        self.loads = 0
+        self._policy = None
+        self._loaded_at = 0.0
+        self._lock = threading.Lock()
+
+    def _load(self):
+        with self._lock:
+            version = self.version
+            policy = load_policy()
+            if version == self.version:
+                self._policy, self._loaded_at = policy, time.monotonic()
+                self.loads += 1
+        return policy
+
+    def get_policy(self):
+        policy = self._policy
+        if policy is None or time.monotonic() - self._loaded_at > self.max_age:
+            policy = self._load()
+        return policy
+
+    def invalidate(self):
+        """forget the policy, the next access will reload it"""
+        with self._lock:
+            self.version += 1
+            self._policy = None
+
+
+cache = IPPolicyCache()
+
+
+def is_blocked(ip, domain=None):
+    """
+    check whether an IP address is not acceptable for hosts.
+
+    :param ip: IP address (str or ipaddress.IPv4Address / IPv6Address)
+    :param domain: domain name (str) of the host or None
+    :return: True if blocked
+    :raises: ValueError if ip is not a valid address
+    """
+    return cache.get_policy().is_blocked(ip, domain)
+
+
+def invalidate_ip_policy_cache(sender, **kwargs):
+    cache.invalidate()
+    # if we are in a transaction, another thread might reload the old state
+    # before the changes get committed, so invalidate again after the commit.
+    transaction.on_commit(cache.invalidate)
+
+
+def _setting_changed(setting, **kwargs):
+    if setting == 'BAD_IPS_HOST':
+        cache.invalidate()
+
+
+setting_changed.connect(_setting_changed)
@@ -1,8 +1,129 @@
 """
-Miscellaneous IP tools: normalize and handle mapped addresses.
+Miscellaneous IP tools: parse, normalize and handle mapped addresses.
+
+Every request needs its REMOTE_ADDR (and maybe a myip) parsed, normalized,
+validated, checked against the host's netmask and the IP policy. Instead of
+doing that with different libraries (netaddr, dnspython, ...) for every
+step, we parse the address once into an IP object (using the stdlib's
+ipaddress module) and use that for all steps. As the same addresses come
+in again and again (a client usually updates its own address), parse_ip
+memoizes the most recently parsed ones.
 """
 
-from netaddr import IPAddress
+import os
+
+# how many recently parsed ip addresses parse_ip keeps
+PARSE_CACHE_SIZE = int(os.environ.get('IP_PARSE_CACHE_SIZE', '4096'))
+
+
+import functools
+import ipaddress
+
+
+class IP:
+    """
+    a parsed (valid) IP address, v4 or v6.
+
+    IP objects are shared via the parse_ip cache, so they must not be modified.
+
+    :ivar address: ipaddress.IPv4Address or IPv6Address
+    :ivar kind: 'ipv4' or 'ipv6'
+    :ivar rdtype: 'A' or 'AAAA'
+    :ivar text: the (compressed) address as str
+    """
+    __slots__ = ('address', 'kind', 'rdtype', 'text')
+
+    def __init__(self, address):
+        self.address = address
+        if address.version == 4:
+            self.kind, self.rdtype = 'ipv4', 'A'
+        else:
+            self.kind, self.rdtype = 'ipv6', 'AAAA'
+        self.text = str(address)
+
+    def __str__(self):
+        return self.text
+
+    def __repr__(self):
+        return 'IP(%r)' % self.text
+
+    def __eq__(self, other):
+        if isinstance(other, IP):
+            return self.address == other.address
+        return NotImplemented
+
+    def __hash__(self):
+        return hash(self.address)
+
+    def __int__(self):
+        return int(self.address)
+
+    def normalized(self):
+        """
+        Convert an IPv4-mapped IPv6 address into an IPv4 address. Handles both the
+        ::ffff:192.0.2.128 format as well as the deprecated ::192.0.2.128 format.
+
+        :return: IP object (self if there is nothing to convert)
+        """
+        address = self.address
+        if address.version == 6:
+            if address.ipv4_mapped is not None:
+                return IP(address.ipv4_mapped)
+            if int(address) >> 32 == 0:  # ipv4 compatible
+                return IP(ipaddress.IPv4Address(int(address)))
+        return self
+
+    def _host_bits(self, netmask):
+        max_prefixlen = self.address.max_prefixlen
+        if not 0 <= netmask <= max_prefixlen:
+            raise ValueError('invalid netmask /%d for %s' % (netmask, self.text))
+        return max_prefixlen - netmask
+
+    def network(self, netmask):
+        """
+        :param netmask: prefix length (int)
+        :return: IP object of the network address (host bits all zero)
+        :raises: ValueError if netmask is invalid
+        """
+        host_bits = self._host_bits(netmask)
+        return IP(self.address.__class__(int(self.address) >> host_bits << host_bits))
+
+    def is_network(self, netmask):
+        """
+        :param netmask: prefix length (int)
+        :return: True if this is the network address of a network with more than one address
+        :raises: ValueError if netmask is invalid
+        """
+        host_bits = self._host_bits(netmask)
+        return host_bits > 0 and int(self.address) & ((1 << host_bits) - 1) == 0
+
+    def with_interface_id(self, netmask, ifid):
+        """
+        :param netmask: prefix length (int)
+        :param ifid: interface id (IP object), gets added to the network address
+        :return: IP object of the address in our network with that interface id
+        :raises: ValueError if netmask is invalid or the result is out of the address space
+        """
+        value = int(self.network(netmask)) + int(ifid)
+        return IP(self.address.__class__(value))  # raises AddressValueError (a ValueError) if too big
+
+
+@functools.lru_cache(maxsize=PARSE_CACHE_SIZE)
+def parse_ip(ipaddr):
+    """
+    Parse an ip address string (memoized).
+
+    :param ipaddr: IP address [str]
+    :return: IP object
+    :raises: ValueError if ipaddr is not a valid ip address
+    """
+    if not isinstance(ipaddr, str):
+        # ipaddress would also accept ints and bytes
+        raise ValueError('ip address must be a str, not %r' % type(ipaddr))
+    address = ipaddress.ip_address(ipaddr)
+    if address.version == 6 and address.scope_id is not None:
+        raise ValueError('ip address with scope id is not supported: %r' % ipaddr)
+    return IP(address)
 
 
 def normalize_mapped_address(ipaddr):
@@ -12,11 +133,9 @@ def normalize_mapped_address(ipaddr):
 
     :param ipaddr: IP address [str]
     :return: Normalized IP address [str]
+    :raises: ValueError if ipaddr is not a valid ip address
     """
-    ipaddr = IPAddress(ipaddr)
-    if ipaddr.is_ipv4_compat() or ipaddr.is_ipv4_mapped():
-        ipaddr = ipaddr.ipv4()
-    return str(ipaddr)
+    return parse_ip(ipaddr).normalized().text
 
 
 # currently, normalize_ip does no more than normalize_mapped_address:
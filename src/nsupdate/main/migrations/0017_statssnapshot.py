@@ -0,0 +1,26 @@
+# Generated by Django 5.2.18 on 2026-10-18 07:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0016_alter_domain_comment_alter_host_api_auth_result_msg_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StatsSnapshot',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created', models.DateTimeField(auto_now_add=True, db_index=True, verbose_name='created at')),
+                ('data', models.JSONField(default=dict, help_text='Statistics (name -> count)', verbose_name='data')),
+            ],
+            options={
+                'verbose_name': 'statistics snapshot',
+                'verbose_name_plural': 'statistics snapshots',
+                'get_latest_by': 'created',
+            },
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-18 07:47
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0017_statssnapshot'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RelayTask',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('ipv4', 'IPv4'), ('ipv6', 'IPv6')], max_length=4, verbose_name='kind')),
+                ('myip', models.CharField(max_length=45, verbose_name='IP')),
+                ('attempts', models.IntegerField(default=0, verbose_name='attempts')),
+                ('next_try', models.DateTimeField(db_index=True, default=django.utils.timezone.now, verbose_name='next try')),
+                ('last_error', models.CharField(blank=True, default='', max_length=255, verbose_name='last error')),
+                ('created', models.DateTimeField(auto_now_add=True, verbose_name='created at')),
+                ('hostconfig', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='relaytasks', to='main.serviceupdaterhostconfig', verbose_name='host config')),
+            ],
+            options={
+                'verbose_name': 'relay task',
+                'verbose_name_plural': 'relay tasks',
+                'constraints': [models.UniqueConstraint(fields=('hostconfig', 'kind'), name='unique_relaytask_hostconfig_kind')],
+            },
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.2.18 on 2026-10-18 08:00
+
+import django.db.models.deletion
+import nsupdate.main.models
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0018_relaytask'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BlacklistedNetwork',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('network', models.CharField(help_text='IP address or network (CIDR notation) that is not acceptable for hosts.', max_length=43, validators=[nsupdate.main.models.ip_network_validator], verbose_name='network')),
+                ('allow', models.BooleanField(default=False, help_text='Check to rather allow this network (an exception in a wider blacklisted network).', verbose_name='allow')),
+                ('comment', models.CharField(blank=True, default='', max_length=255, verbose_name='comment')),
+                ('last_update', models.DateTimeField(auto_now=True, verbose_name='last update')),
+                ('created', models.DateTimeField(auto_now_add=True, verbose_name='created at')),
+                ('created_by', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='blacklisted_networks', to=settings.AUTH_USER_MODEL, verbose_name='created by')),
+                ('domain', models.ForeignKey(blank=True, help_text='Only apply to hosts in this domain (empty: all domains).', null=True, on_delete=django.db.models.deletion.CASCADE, related_name='blacklisted_networks', to='main.domain', verbose_name='domain')),
+            ],
+            options={
+                'verbose_name': 'blacklisted network',
+                'verbose_name_plural': 'blacklisted networks',
+            },
+        ),
+    ]
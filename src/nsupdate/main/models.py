@@ -2,24 +2,34 @@
 Models for hosts, domains, and service updaters.
 """
 
-import re
 import secrets
 import time
 import base64
+import inspect
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
 
 import dns.resolver
 import dns.message
+from netaddr import IPNetwork, AddrFormatError
 
+from asgiref.sync import sync_to_async
 from django.db import models
+from django.db.models import F
 from django.core.exceptions import ValidationError
 from django.core.validators import RegexValidator
 from django.conf import settings
-from django.db.models.signals import pre_delete, post_save
+from django.db.models.signals import pre_delete, post_save, post_delete
 from django.contrib.auth.hashers import make_password
 from django.utils.timezone import now
 from django.utils.translation import gettext_lazy as _
 
-from . import dnstools
+from . import credcache, dnstools
+from .blacklist import invalidate_blacklist_cache, is_blacklisted
+from .domaincache import invalidate_domain_cache
+from .ippolicy import invalidate_ip_policy_cache
 
 RESULT_MSG_LEN = 255
 
@@ -58,10 +68,61 @@ class BlacklistedHost(models.Model):
         verbose_name_plural = _('blacklisted hosts')
 
 
+def ip_network_validator(value):
+    try:
+        IPNetwork(value)
+    except (AddrFormatError, ValueError, TypeError):
+        raise ValidationError(u'This is not a valid IP network (like 192.0.2.0/24 or 2001:db8::/32).')
+
+
+class BlacklistedNetwork(models.Model):
+    network = models.CharField(
+        _('network'),
+        max_length=43,  # 2001:0db8:0000:0000:0000:0000:0000:0000/128
+        validators=[ip_network_validator],
+        help_text=_('IP address or network (CIDR notation) that is not acceptable for hosts.'))
+    allow = models.BooleanField(
+        _('allow'),
+        default=False,
+        help_text=_('Check to rather allow this network (an exception in a wider blacklisted network).'))
+    domain = models.ForeignKey(
+        'Domain', on_delete=models.CASCADE, null=True, blank=True,
+        related_name='blacklisted_networks',
+        verbose_name=_('domain'),
+        help_text=_('Only apply to hosts in this domain (empty: all domains).'))
+    comment = models.CharField(
+        _("comment"),
+        max_length=255,  # should be enough
+        default='', blank=True)
+
+    last_update = models.DateTimeField(_('last update'), auto_now=True)
+    created = models.DateTimeField(_('created at'), auto_now_add=True)
+    created_by = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        related_name='blacklisted_networks',
+        verbose_name=_('created by'), on_delete=models.CASCADE)
+
+    def __str__(self):
+        return self.network
+
+    class Meta:
+        verbose_name = _('blacklisted network')
+        verbose_name_plural = _('blacklisted networks')
+
+
+# the ippolicy module caches the prefix tables, make sure they do not use outdated data
+post_save.connect(invalidate_ip_policy_cache, sender=BlacklistedNetwork)
+post_delete.connect(invalidate_ip_policy_cache, sender=BlacklistedNetwork)
+
+
+# the blacklist module caches the compiled blacklist, make sure it does not use outdated data
+post_save.connect(invalidate_blacklist_cache, sender=BlacklistedHost)
+post_delete.connect(invalidate_blacklist_cache, sender=BlacklistedHost)
+
+
 def host_blacklist_validator(value):
-    for bd in BlacklistedHost.objects.all():
-        if re.search(bd.name_re, value):
-            raise ValidationError(u'This name is blacklisted.')
+    if is_blacklisted(value):
+        raise ValidationError(u'This name is blacklisted.')
 
 
 from collections import namedtuple
@@ -153,6 +214,38 @@ class Domain(models.Model):
         ordering = ('name',)
 
 
+# dnstools caches the zone metadata, make sure it does not use outdated data
+post_save.connect(invalidate_domain_cache, sender=Domain)
+post_delete.connect(invalidate_domain_cache, sender=Domain)
+
+
+def prefetch_ips(objs, deadline=None):
+    """
+    Query the A and AAAA records of many hosts (or related hosts) concurrently,
+    so that their get_ipv4() / get_ipv6() methods do not need to query one by one.
+
+    :param objs: list of Host or RelatedHost objects
+    :param deadline: max. time to wait for all answers [s], see dnstools.query_ns_many
+    """
+    fqdns = [obj.get_fqdn() for obj in objs]
+    results = dnstools.query_ns_many([(fqdn, record) for fqdn in fqdns for record in ('A', 'AAAA')], deadline)
+    for obj, fqdn in zip(objs, fqdns):
+        obj._prefetched_ips = {record: results[(fqdn, record)] for record in ('A', 'AAAA')}
+
+
+def _query_ip(obj, record):
+    """
+    query_ns for a Host or RelatedHost, using the results of prefetch_ips (if any)
+    """
+    prefetched = getattr(obj, '_prefetched_ips', None)
+    if prefetched is None:
+        return dnstools.query_ns(obj.get_fqdn(), record)
+    result = prefetched[record]
+    if isinstance(result, Exception):
+        raise result
+    return result
+
+
 class Host(models.Model):
     name = models.CharField(
         _("name"),
@@ -285,7 +378,7 @@ class Host(models.Model):
     def get_ip(self, kind):
         record = 'A' if kind == 'ipv4' else 'AAAA'
         try:
-            return dnstools.query_ns(self.get_fqdn(), record)
+            return _query_ip(self, record)
         except (dns.resolver.NXDOMAIN, dns.resolver.NoAnswer):
             return None
         except (dns.resolver.NoNameservers, dns.resolver.Timeout, dnstools.NameServerNotAvailable,
@@ -302,28 +395,37 @@ class Host(models.Model):
         if kind == 'ipv4':
             self.last_update_ipv4 = now()
             self.tls_update_ipv4 = secure
+            self._save_changes(['last_update_ipv4', 'tls_update_ipv4'])
         else:
             self.last_update_ipv6 = now()
             self.tls_update_ipv6 = secure
-        self.save()
+            self._save_changes(['last_update_ipv6', 'tls_update_ipv6'])
 
     def register_client_result(self, msg, fault=False):
         if fault:
             self.client_faults += 1
         self.client_result_msg = result_fmt(msg)
-        self.save()
+        self._save_changes(['client_result_msg'], increment='client_faults' if fault else None)
 
     def register_server_result(self, msg, fault=False):
         if fault:
             self.server_faults += 1
         self.server_result_msg = result_fmt(msg)
-        self.save()
+        self._save_changes(['server_result_msg'], increment='server_faults' if fault else None)
 
     def register_api_auth_result(self, msg, fault=False):
         if fault:
             self.api_auth_faults += 1
         self.api_auth_result_msg = result_fmt(msg)
-        self.save()
+        self._save_changes(['api_auth_result_msg'], increment='api_auth_faults' if fault else None)
+
+    def register_abuse(self, msg):
+        """flag and block the host for abuse, msg is registered as client fault"""
+        self.abuse = True
+        self.abuse_blocked = True
+        self.client_faults += 1
+        self.client_result_msg = result_fmt(msg)
+        self._save_changes(['abuse', 'abuse_blocked', 'client_result_msg'], increment='client_faults')
 
     def generate_secret(self, secret=None):
         # note: we use a quick hasher for the update_secret as expensive,
@@ -338,9 +440,92 @@ class Host(models.Model):
             secret,
             hasher='weakargon2'
         )
-        self.save()
+        credcache.forget(self)
+        self._save_changes(['update_secret'])
         return secret
 
+    def _save_changes(self, fields, increment=None):
+        """
+        save the changed fields now or, if a HostUnitOfWork is active, when it gets flushed.
+
+        :param fields: names of the changed fields
+        :param increment: name of a counter field that was incremented by 1 (or None)
+        """
+        uow = _host_unit_of_work.get()
+        if uow is None or self.pk is None:
+            self.save()
+        else:
+            uow.add(self, fields, increment)
+
+
+class HostUnitOfWork:
+    """
+    Collect the changes of Host objects (done by poke(), register_*_result(),
+    register_abuse() and generate_secret()) while it is active and write them
+    with one narrow UPDATE per host when flushed, instead of saving the full
+    row for each change. Counters are incremented in the database (F()
+    expressions), so concurrent requests do not lose increments.
+    """
+    def __init__(self):
+        self._changes = {}  # id(host) -> (host, fields, increments)
+
+    @contextmanager
+    def active(self):
+        token = _host_unit_of_work.set(self)
+        try:
+            yield self
+        finally:
+            _host_unit_of_work.reset(token)
+
+    def add(self, host, fields, increment=None):
+        host, changed_fields, increments = self._changes.setdefault(id(host), (host, set(), Counter()))
+        changed_fields.update(fields)
+        if increment is not None:
+            increments[increment] += 1
+
+    def flush(self):
+        changes, self._changes = self._changes, {}
+        for host, fields, increments in changes.values():
+            local_values = {name: getattr(host, name) for name in increments}
+            for name, count in increments.items():
+                setattr(host, name, F(name) + count)
+            try:
+                # note: last_update (auto_now) only gets updated if we give it
+                host.save(update_fields=fields | set(increments) | {'last_update'})
+            finally:
+                for name, value in local_values.items():
+                    setattr(host, name, value)
+
+
+_host_unit_of_work = ContextVar('host_unit_of_work', default=None)
+
+
+def host_unit_of_work(func):
+    """
+    Decorator running func (function or coroutine function) with an active
+    HostUnitOfWork that gets flushed when func returns.
+    """
+    if inspect.iscoroutinefunction(func):
+        @wraps(func)
+        async def acaller(*args, **kwargs):
+            uow = HostUnitOfWork()
+            try:
+                with uow.active():
+                    return await func(*args, **kwargs)
+            finally:
+                await sync_to_async(uow.flush)()
+        return acaller
+
+    @wraps(func)
+    def caller(*args, **kwargs):
+        uow = HostUnitOfWork()
+        try:
+            with uow.active():
+                return func(*args, **kwargs)
+        finally:
+            uow.flush()
+    return caller
+
 
 def pre_delete_host(sender, **kwargs):
     obj = kwargs['instance']
@@ -432,7 +617,7 @@ class RelatedHost(models.Model):
     def get_ip(self, kind):
         record = 'A' if kind == 'ipv4' else 'AAAA'
         try:
-            return dnstools.query_ns(self.get_fqdn(), record)
+            return _query_ip(self, record)
         except (dns.resolver.NXDOMAIN, dns.resolver.NoAnswer):
             return 'none'
         except (dns.resolver.NoNameservers, dns.resolver.Timeout, dnstools.NameServerNotAvailable):
@@ -538,3 +723,50 @@ class ServiceUpdaterHostConfig(models.Model):
     class Meta(object):
         verbose_name = _('service updater host config')
         verbose_name_plural = _('service updater host configs')
+
+
+class StatsSnapshot(models.Model):
+    """
+    The statistics shown on the status page at some point in time,
+    recorded regularly by the stats management command.
+    """
+    created = models.DateTimeField(_("created at"), auto_now_add=True, db_index=True)
+    data = models.JSONField(_("data"), default=dict, help_text=_("Statistics (name -> count)"))
+
+    def __str__(self):
+        return u"%s" % (self.created, )
+
+    class Meta(object):
+        verbose_name = _('statistics snapshot')
+        verbose_name_plural = _('statistics snapshots')
+        get_latest_by = 'created'
+
+
+class RelayTask(models.Model):
+    """
+    An update we still need to relay to another dyndns2 service (see relay.py).
+
+    There is at most one task per ServiceUpdaterHostConfig and address kind
+    (ipv4 / ipv6), a newer IP replaces the one of a not yet relayed update.
+    """
+    hostconfig = models.ForeignKey(
+        ServiceUpdaterHostConfig,
+        on_delete=models.CASCADE,
+        related_name='relaytasks',
+        verbose_name=_("host config"))
+    kind = models.CharField(_("kind"), max_length=4, choices=[('ipv4', 'IPv4'), ('ipv6', 'IPv6')])
+    myip = models.CharField(_("IP"), max_length=45)
+    attempts = models.IntegerField(_("attempts"), default=0)
+    next_try = models.DateTimeField(_("next try"), default=now, db_index=True)
+    last_error = models.CharField(_("last error"), max_length=255, default='', blank=True)
+    created = models.DateTimeField(_("created at"), auto_now_add=True)
+
+    def __str__(self):
+        return u"%s -> %s" % (self.hostconfig, self.myip)
+
+    class Meta(object):
+        constraints = [
+            models.UniqueConstraint(fields=['hostconfig', 'kind'], name='unique_relaytask_hostconfig_kind'),
+        ]
+        verbose_name = _('relay task')
+        verbose_name_plural = _('relay tasks')
@@ -0,0 +1,119 @@
+"""
+Relaying updates to other dyndns2 services (ServiceUpdater).
+
+Contacting another service can take long (or time out), so we do not do it
+while our client waits for its /nic/update response. Instead, we queue a
+RelayTask in the database and the relay management command (the worker)
+sends the queued updates, retrying failed ones with exponential backoff.
+"""
+
+from datetime import timedelta
+
+import logging
+logger = logging.getLogger(__name__)
+
+from django.conf import settings
+from django.utils.timezone import now
+
+from ..utils import ddns_client
+from .models import RelayTask
+
+# while a worker sends an update, other workers will not touch the task for that long [s]
+LEASE = ddns_client.TIMEOUT + 30.0
+
+
+def enqueue(host, kind, ipaddr):
+    """
+    queue relaying the new ip of host to all services configured for it
+
+    :param host: Host object
+    :param kind: 'ipv4' or 'ipv6'
+    :param ipaddr: new ip address (str)
+    :return: count of queued tasks
+    """
+    count = 0
+    for hc in host.serviceupdaterhostconfigs.select_related('service'):
+        if (kind == 'ipv4' and hc.give_ipv4 and hc.service.accept_ipv4
+            or
+            kind == 'ipv6' and hc.give_ipv6 and hc.service.accept_ipv6):
+            RelayTask.objects.update_or_create(
+                hostconfig=hc, kind=kind, defaults=dict(myip=ipaddr, attempts=0, next_try=now(), last_error=''))
+            count += 1
+    return count
+
+
+def backoff(attempts):
+    """
+    :param attempts: count of failed attempts so far
+    :return: time to wait before the next attempt
+    """
+    return timedelta(seconds=min(settings.RELAY_BACKOFF * 2 ** (attempts - 1), settings.RELAY_BACKOFF_MAX))
+
+
+def _claim(task):
+    """
+    claim task for this worker (optimistic, works without select_for_update)
+
+    :return: True if we got it
+    """
+    lease_end = now() + timedelta(seconds=LEASE)
+    return RelayTask.objects.filter(pk=task.pk, next_try=task.next_try).update(next_try=lease_end) == 1
+
+
+def _send(task):
+    """
+    send the update of task to the other service
+
+    :return: error message or None if the update was done (or we shall not retry it)
+    """
+    hc = task.hostconfig
+    kwargs = dict(
+        name=hc.name, password=hc.password,
+        hostname=hc.hostname, myip=task.myip,
+        server=hc.service.server, path=hc.service.path, secure=hc.service.secure,
+    )
+    try:
+        status_code, text = ddns_client.dyndns2_update(**kwargs)
+    except Exception as e:
+        kwargs.pop('password')
+        logger.warning("the dyndns2 updater raised an exception [%r]" % kwargs, exc_info=True)
+        return repr(e)
+    if status_code >= 500 or text.startswith(('911', 'dnserr')):
+        # the other service has an issue, maybe it works later
+        return "%d %s" % (status_code, text)
+    if not text.startswith(('good', 'nochg')):
+        # e.g. badauth or nohost - retrying will not help
+        logger.warning("relaying update to %s failed: %d %s" % (hc.service, status_code, text))
+    return None
+
+
+def process(limit=None):
+    """
+    send the due queued updates
+
+    :param limit: max. count of tasks to process (None = all due tasks)
+    :return: (done, failed) counts
+    """
+    done = failed = 0
+    tasks = (RelayTask.objects.filter(next_try__lte=now())
+             .select_related('hostconfig__service').order_by('next_try'))
+    if limit is not None:
+        tasks = tasks[:limit]
+    for task in tasks:
+        if not _claim(task):
+            continue  # another worker got it
+        error = _send(task)
+        if error is None:
+            # only delete it if no newer update was queued meanwhile
+            RelayTask.objects.filter(pk=task.pk, myip=task.myip, attempts=task.attempts).delete()
+            done += 1
+            continue
+        failed += 1
+        attempts = task.attempts + 1
+        if attempts >= settings.RELAY_MAX_ATTEMPTS:
+            logger.error("giving up relaying update %s after %d attempts [%s]" % (task, attempts, error))
+            RelayTask.objects.filter(pk=task.pk, myip=task.myip, attempts=task.attempts).delete()
+        else:
+            RelayTask.objects.filter(pk=task.pk, myip=task.myip, attempts=task.attempts).update(
+                attempts=attempts, next_try=now() + backoff(attempts), last_error=error[:255])
+    return done, failed
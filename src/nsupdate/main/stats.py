@@ -0,0 +1,146 @@
+"""
+Statistics for the status page.
+
+Counting everything with separate queries means ~36 table scans, so we use
+one conditional aggregation query per table. As the numbers do not need to
+be exact to the second, the result is cached for STATUS_STATS_REFRESH seconds.
+
+The stats management command records the statistics regularly as
+StatsSnapshot records. If there are snapshots, the status page only reads
+the latest one (and the history) and does not touch the Host table at all.
+"""
+
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db.models import Count, Q
+from django.utils.timezone import now, localdate
+
+from ..utils.ttlcache import TTLCache
+from .models import Host, Domain, StatsSnapshot
+
+
+# suffix -> age, used for the "updated / created / logged in within ..." counts
+PERIODS = [
+    ('2d', timedelta(hours=48)),
+    ('2w', timedelta(days=14)),
+    ('2m', timedelta(days=61)),
+    ('2y', timedelta(days=730)),
+]
+
+cache = TTLCache(maxsize=10)
+
+
+def _domain_aggregates():
+    return dict(
+        domains_total=Count('pk'),
+        domains_unavailable=Count('pk', filter=Q(available=False)),
+        domains_public=Count('pk', filter=Q(public=True)),
+    )
+
+
+def _host_aggregates(t_now):
+    aggregates = dict(
+        hosts_total=Count('pk'),
+        hosts_unavailable=Count('pk', filter=Q(available=False)),
+        hosts_abuse=Count('pk', filter=Q(abuse=True)),
+        hosts_abuse_blocked=Count('pk', filter=Q(abuse_blocked=True)),
+    )
+    for suffix, age in PERIODS:
+        before = t_now - age
+        for kind in ('ipv4', 'ipv6'):
+            updated = Q(**{'last_update_%s__gt' % kind: before})
+            aggregates['hosts_%s_%s' % (kind, suffix)] = Count('pk', filter=updated)
+            aggregates['hosts_%s_tls_%s' % (kind, suffix)] = Count(
+                'pk', filter=updated & Q(**{'tls_update_%s' % kind: True}))
+    return aggregates
+
+
+def _user_aggregates(t_now):
+    aggregates = dict(
+        users_total=Count('pk'),
+        users_active=Count('pk', filter=Q(is_active=True)),
+    )
+    for suffix, age in PERIODS:
+        before = t_now - age
+        aggregates['users_created_%s' % suffix] = Count('pk', filter=Q(date_joined__gt=before))
+        aggregates['users_loggedin_%s' % suffix] = Count('pk', filter=Q(last_login__gt=before))
+    return aggregates
+
+
+def compute_stats():
+    """
+    compute the statistics (3 queries)
+
+    :return: dict name -> count
+    """
+    t_now = now()
+    stats = {}
+    stats.update(Domain.objects.aggregate(**_domain_aggregates()))
+    stats.update(Host.objects.aggregate(**_host_aggregates(t_now)))
+    stats.update(get_user_model().objects.aggregate(**_user_aggregates(t_now)))
+    return stats
+
+
+def take_snapshot():
+    """
+    compute the statistics and record them in the database
+
+    :return: StatsSnapshot object
+    """
+    return StatsSnapshot.objects.create(data=compute_stats())
+
+
+def get_stats():
+    """
+    get the statistics from the latest snapshot or, if there is none,
+    computed at most STATUS_STATS_REFRESH seconds ago.
+
+    :return: dict name -> count, plus stats_created (datetime)
+    """
+    stats = cache.get('stats')
+    if stats is None:
+        snapshot = StatsSnapshot.objects.order_by('-created').first()
+        if snapshot is not None:
+            stats = dict(snapshot.data, stats_created=snapshot.created)
+        else:
+            stats = dict(compute_stats(), stats_created=now())
+        cache.set('stats', stats, ttl=settings.STATUS_STATS_REFRESH)
+    return stats
+
+
+def _percent(part, total):
+    return round(100.0 * part / total) if total else 0
+
+
+def get_history(days=None):
+    """
+    get the daily history of some key numbers from the snapshots
+
+    :param days: how many days to look back, default: STATUS_HISTORY_DAYS
+    :return: list of dicts (newest first), one per day (the last snapshot of that day)
+    """
+    if days is None:
+        days = settings.STATUS_HISTORY_DAYS
+    history = cache.get(('history', days))
+    if history is None:
+        history = []
+        snapshots = (StatsSnapshot.objects.filter(created__gt=now() - timedelta(days=days))
+                     .order_by('-created').values_list('created', 'data'))
+        for created, data in snapshots:
+            if history and localdate(history[-1]['created']) == localdate(created):
+                continue  # we already have a newer snapshot of that day
+            ipv4, ipv6 = data.get('hosts_ipv4_2d', 0), data.get('hosts_ipv6_2d', 0)
+            tls = data.get('hosts_ipv4_tls_2d', 0) + data.get('hosts_ipv6_tls_2d', 0)
+            history.append(dict(
+                created=created,
+                hosts_total=data.get('hosts_total', 0),
+                hosts_ipv4_2d=ipv4,
+                hosts_ipv6_2d=ipv6,
+                hosts_tls_percent_2d=_percent(tls, ipv4 + ipv6),
+                users_total=data.get('users_total', 0),
+                users_created_2d=data.get('users_created_2d', 0),
+            ))
+        cache.set(('history', days), history, ttl=settings.STATUS_STATS_REFRESH)
+    return history
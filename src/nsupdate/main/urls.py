@@ -2,6 +2,7 @@
 Main application URL routing.
 """
 
+from django.conf import settings
 from django.urls import re_path
 
 from .views import (
@@ -11,7 +12,12 @@ from .views import (
     RelatedHostOverviewView, RelatedHostView, AddRelatedHostView, DeleteRelatedHostView, CustomTemplateView)
 from ..api.views import (
     myip_view, DetectIpView, AjaxGetIps, NicUpdateView, AuthorizedNicUpdateView,
-    NicDeleteView, AuthorizedNicDeleteView)
+    NicDeleteView, AuthorizedNicDeleteView, AsyncNicUpdateView, AsyncNicDeleteView)
+
+if settings.NIC_UPDATE_ASYNC:
+    nic_update_view, nic_delete_view = AsyncNicUpdateView.as_view(), AsyncNicDeleteView.as_view()
+else:
+    nic_update_view, nic_delete_view = NicUpdateView.as_view(), NicDeleteView.as_view()
 
 
 urlpatterns = (
@@ -47,8 +53,8 @@ urlpatterns = (
     re_path(r'^nic/delete_authorized$', AuthorizedNicDeleteView.as_view(), name='nic_delete_authorized'),
     # API (for update clients)
     re_path(r'^myip$', myip_view, name='myip'),
-    re_path(r'^nic/update$', NicUpdateView.as_view(), name='nic_update'),
-    re_path(r'^nic/delete$', NicDeleteView.as_view(), name='nic_delete'),  # API extension
+    re_path(r'^nic/update$', nic_update_view, name='nic_update'),
+    re_path(r'^nic/delete$', nic_delete_view, name='nic_delete'),  # API extension
     # For bots
     re_path(r'^robots.txt$', RobotsTxtView.as_view(), name='robots'),
 )
@@ -3,8 +3,6 @@
 Views for the interactive web user interface.
 """
 
-from datetime import timedelta
-
 import dns.name
 
 from django.db.models import Q
@@ -12,7 +10,6 @@ from django.views.generic import View, TemplateView, CreateView, DetailView
 from django.views.generic.edit import UpdateView, DeleteView
 from django.http import HttpResponse, HttpResponseRedirect
 from django.contrib.auth.decorators import login_required
-from django.contrib.auth import get_user_model
 from django.contrib import messages
 from django.utils.decorators import method_decorator
 from django.urls import reverse
@@ -20,12 +17,13 @@ from django.http import Http404
 from django import template
 from django.utils.timezone import now
 
-from . import dnstools
+from ..context_processors import create_session
+from . import dnstools, stats
 from .iptools import normalize_ip
 
 from .forms import (CreateHostForm, EditHostForm, CreateRelatedHostForm, EditRelatedHostForm,
                     CreateDomainForm, EditDomainForm, CreateUpdaterHostConfigForm, EditUpdaterHostConfigForm)
-from .models import Host, RelatedHost, Domain, ServiceUpdaterHostConfig
+from .models import Host, RelatedHost, Domain, ServiceUpdaterHostConfig, prefetch_ips
 
 
 class GenerateSecretView(DetailView):
@@ -97,6 +95,12 @@ class CustomTemplateView(TemplateView):
 class HomeView(TemplateView):
     template_name = "main/home.html"
 
+    def get(self, request, *args, **kwargs):
+        if request.session.session_key is None:
+            # we show the visitor's IPs, so we need a session (also for detecting them)
+            create_session(request)
+        return super(HomeView, self).get(request, *args, **kwargs)
+
     def get_context_data(self, **kwargs):
         context = super(HomeView, self).get_context_data(**kwargs)
         context['nav_home'] = True
@@ -114,45 +118,8 @@ class StatusView(TemplateView):
         context = super(
             StatusView, self).get_context_data(**kwargs)
         context['nav_status'] = True
-        context['domains_total'] = Domain.objects.count()
-        context['domains_unavailable'] = Domain.objects.filter(available=False).count()
-        context['domains_public'] = Domain.objects.filter(public=True).count()
-        context['hosts_total'] = Host.objects.count()
-        context['hosts_unavailable'] = Host.objects.filter(available=False).count()
-        context['hosts_abuse'] = Host.objects.filter(abuse=True).count()
-        context['hosts_abuse_blocked'] = Host.objects.filter(abuse_blocked=True).count()
-        t_now = now()
-        before_2d = t_now - timedelta(hours=48)
-        before_2w = t_now - timedelta(days=14)
-        before_2m = t_now - timedelta(days=61)
-        before_2y = t_now - timedelta(days=730)
-        context['hosts_ipv4_2d'] = Host.objects.filter(last_update_ipv4__gt=before_2d).count()
-        context['hosts_ipv6_2d'] = Host.objects.filter(last_update_ipv6__gt=before_2d).count()
-        context['hosts_ipv4_tls_2d'] = Host.objects.filter(last_update_ipv4__gt=before_2d, tls_update_ipv4=True).count()
-        context['hosts_ipv6_tls_2d'] = Host.objects.filter(last_update_ipv6__gt=before_2d, tls_update_ipv6=True).count()
-        context['hosts_ipv4_2w'] = Host.objects.filter(last_update_ipv4__gt=before_2w).count()
-        context['hosts_ipv6_2w'] = Host.objects.filter(last_update_ipv6__gt=before_2w).count()
-        context['hosts_ipv4_tls_2w'] = Host.objects.filter(last_update_ipv4__gt=before_2w, tls_update_ipv4=True).count()
-        context['hosts_ipv6_tls_2w'] = Host.objects.filter(last_update_ipv6__gt=before_2w, tls_update_ipv6=True).count()
-        context['hosts_ipv4_2m'] = Host.objects.filter(last_update_ipv4__gt=before_2m).count()
-        context['hosts_ipv6_2m'] = Host.objects.filter(last_update_ipv6__gt=before_2m).count()
-        context['hosts_ipv4_tls_2m'] = Host.objects.filter(last_update_ipv4__gt=before_2m, tls_update_ipv4=True).count()
-        context['hosts_ipv6_tls_2m'] = Host.objects.filter(last_update_ipv6__gt=before_2m, tls_update_ipv6=True).count()
-        context['hosts_ipv4_2y'] = Host.objects.filter(last_update_ipv4__gt=before_2y).count()
-        context['hosts_ipv6_2y'] = Host.objects.filter(last_update_ipv6__gt=before_2y).count()
-        context['hosts_ipv4_tls_2y'] = Host.objects.filter(last_update_ipv4__gt=before_2y, tls_update_ipv4=True).count()
-        context['hosts_ipv6_tls_2y'] = Host.objects.filter(last_update_ipv6__gt=before_2y, tls_update_ipv6=True).count()
-        user_model = get_user_model()
-        context['users_total'] = user_model.objects.count()
-        context['users_active'] = user_model.objects.filter(is_active=True).count()
-        context['users_created_2d'] = user_model.objects.filter(date_joined__gt=before_2d).count()
-        context['users_loggedin_2d'] = user_model.objects.filter(last_login__gt=before_2d).count()
-        context['users_created_2w'] = user_model.objects.filter(date_joined__gt=before_2w).count()
-        context['users_loggedin_2w'] = user_model.objects.filter(last_login__gt=before_2w).count()
-        context['users_created_2m'] = user_model.objects.filter(date_joined__gt=before_2m).count()
-        context['users_loggedin_2m'] = user_model.objects.filter(last_login__gt=before_2m).count()
-        context['users_created_2y'] = user_model.objects.filter(date_joined__gt=before_2y).count()
-        context['users_loggedin_2y'] = user_model.objects.filter(last_login__gt=before_2y).count()
+        context.update(stats.get_stats())
+        context['history'] = stats.get_history()
         return context
 
 
@@ -189,9 +156,12 @@ class OverviewView(TemplateView):
     def get_context_data(self, **kwargs):
         context = super(OverviewView, self).get_context_data(**kwargs)
         context['nav_overview'] = True
-        context['hosts'] = Host.objects.filter(created_by=self.request.user).select_related("domain")\
+        context['hosts'] = hosts = list(
+            Host.objects.filter(created_by=self.request.user).select_related("domain")
             .only("name", "comment", "available", "client_faults", "server_faults", "abuse_blocked", "abuse",
-                  "last_update_ipv4", "tls_update_ipv4", "last_update_ipv6", "tls_update_ipv6", "domain__name")
+                  "last_update_ipv4", "tls_update_ipv4", "last_update_ipv6", "tls_update_ipv6", "domain__name"))
+        # the template shows the IPs of all hosts, query them concurrently
+        prefetch_ips(hosts)
         context['your_domains'] = Domain.objects.filter(
             created_by=self.request.user).select_related("created_by")\
             .only("name", "public", "available", "comment", "created_by__username")
@@ -328,7 +298,9 @@ class RelatedHostOverviewView(TemplateView):
         context = super(RelatedHostOverviewView, self).get_context_data(**kwargs)
         context['nav_overview'] = True
         context['main_host'] = self.__main_host
-        context['related_hosts'] = RelatedHost.objects.filter(main_host=self.__main_host)
+        context['related_hosts'] = related_hosts = list(
+            RelatedHost.objects.filter(main_host=self.__main_host).select_related('main_host__domain'))
+        prefetch_ips(related_hosts)
         return context
 
 
@@ -0,0 +1,76 @@
+"""
+Tests for the domains command.
+"""
+
+import asyncio
+from datetime import timedelta
+from io import StringIO
+
+import dns.resolver
+import pytest
+
+from django.core import management
+from django.utils.timezone import now
+
+from nsupdate.conftest import TESTDOMAIN
+from nsupdate.main import dnstools
+from nsupdate.main.dnstools import get_ns_info, FQDN, NameServerNotAvailable
+from nsupdate.main.models import Domain
+
+
+class FakeResolver(object):
+    """answers SOA queries for the zones in answering after delay seconds"""
+    def __init__(self, answering, delay):
+        self.answering = answering
+        self.delay = delay
+
+    async def resolve(self, qname, rdtype, search=True):
+        await asyncio.sleep(self.delay)
+        if qname.rstrip('.') not in self.answering:
+            raise dns.resolver.NoNameservers
+        return ['ns.%s' % qname]
+
+
+@pytest.fixture
+def fake_resolver(monkeypatch):
+    def install(answering, delay=0.1):
+        resolver = FakeResolver(answering, delay)
+        monkeypatch.setattr(dnstools.resolvers, 'get', lambda *args, **kwargs: resolver)
+        return resolver
+    return install
+
+
+def test_check_available(fake_resolver):
+    fake_resolver([d.name for d in Domain.objects.all()])
+    management.call_command('domains', check=True, stdout=StringIO())
+    assert Domain.objects.get(name=TESTDOMAIN).available
+
+
+def test_check_unavailable(fake_resolver):
+    fake_resolver([])
+    out = StringIO()
+    management.call_command('domains', check=True, stdout=out)
+    d = Domain.objects.get(name=TESTDOMAIN)
+    assert not d.available and not d.public
+    assert 'Setting unavailable flag for domain %s' % TESTDOMAIN in out.getvalue()
+    # the domain cache must know about the (bulk) change
+    with pytest.raises(NameServerNotAvailable):
+        get_ns_info(FQDN('test', TESTDOMAIN))
+
+
+def test_check_unavailable_not_retried_immediately(fake_resolver):
+    # a domain that was last updated long ago
+    Domain.objects.filter(name=TESTDOMAIN).update(last_update=now() - timedelta(days=1))
+    fake_resolver([])
+    management.call_command('domains', check=True, stdout=StringIO())
+    with pytest.raises(NameServerNotAvailable):
+        get_ns_info(FQDN('test', TESTDOMAIN))
+    assert not Domain.objects.get(name=TESTDOMAIN).available
+
+
+def test_check_deadline(fake_resolver):
+    fake_resolver([], delay=10)
+    out = StringIO()
+    management.call_command('domains', check=True, deadline=0.3, stdout=out)
+    assert Domain.objects.get(name=TESTDOMAIN).available
+    assert 'Could not check domain %s' % TESTDOMAIN in out.getvalue()
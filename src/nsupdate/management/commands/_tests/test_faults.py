@@ -2,9 +2,13 @@
 Tests for the faults command.
 """
 
+from datetime import timedelta
+from io import StringIO
+
 from nsupdate.conftest import TEST_HOST
 
-from django.core import management
+from django.core import mail, management
+from django.utils.timezone import now
 from nsupdate.main.models import Host
 
 
@@ -60,3 +64,65 @@ def test_faults_abuse():
     h = Host.objects.get(name=hostname)
     assert h.client_faults == 0
     assert h.abuse is True
+
+
+def test_faults_abuse_deletes_from_dns(monkeypatch):
+    from nsupdate.management.commands import faults
+    deleted = []
+    monkeypatch.setattr(faults.Command, 'delete_from_dns', lambda self, fqdns: deleted.extend(fqdns))
+    hostname = TEST_HOST.host
+    Host.objects.filter(name=hostname).update(client_faults=42, abuse=False)
+    management.call_command('faults', flag_abuse=23, show_client=True, stdout=StringIO())
+    assert deleted == [TEST_HOST]
+    h = Host.objects.get(name=hostname)
+    assert h.abuse is True
+
+
+def test_faults_abuse_notifies_after_commit(django_capture_on_commit_callbacks, monkeypatch):
+    from nsupdate.management.commands import faults
+    monkeypatch.setattr(faults.Command, 'delete_from_dns', lambda self, fqdns: None)
+    hostname = TEST_HOST.host
+    Host.objects.filter(name=hostname).update(client_faults=42, abuse=False)
+    with django_capture_on_commit_callbacks(execute=True):
+        management.call_command('faults', flag_abuse=23, notify_user=True, stdout=StringIO())
+        # not sent within the transaction
+        assert len(mail.outbox) == 0
+    assert len(mail.outbox) == 1
+    assert str(TEST_HOST) in mail.outbox[0].subject
+
+
+def test_faults_reset_sets_last_update():
+    hostname = TEST_HOST.host
+    t_old = now() - timedelta(days=1)
+    Host.objects.filter(name=hostname).update(client_faults=1, last_update=t_old)
+    management.call_command('faults', reset_client=True)
+    assert Host.objects.get(name=hostname).last_update > t_old
+
+
+def test_faults_delete_from_dns_in_chunks(monkeypatch):
+    from nsupdate.main import dnstools
+    from nsupdate.management.commands import faults
+    monkeypatch.setattr(faults, 'DNS_DELETE_CHUNK_SIZE', 2)
+    sent = []
+
+    def send(batch):
+        fqdns = sorted(set(str(change.fqdn) for change in batch.changes))
+        sent.append(fqdns)
+        if len(sent) == 1:
+            raise dnstools.DnsUpdateError("first chunk fails")
+    monkeypatch.setattr(dnstools.UpdateBatch, 'send', send)
+    fqdns = [dnstools.FQDN('host%d' % i, 'example.org') for i in range(5)]
+    err = StringIO()
+    faults.Command(stderr=err).delete_from_dns(fqdns)
+    # the failed first chunk did not stop the others
+    assert len(sent) == 3
+    assert sent[2] == ['host4.example.org']
+    assert 'host0.example.org, host1.example.org' in err.getvalue()
+
+
+def test_faults_show_constant_queries(django_assert_max_num_queries):
+    out = StringIO()
+    with django_assert_max_num_queries(3):
+        management.call_command('faults', show_client=True, show_server=True, show_api_auth=True, stdout=out)
+    assert str(TEST_HOST) in out.getvalue()
+    assert len(out.getvalue().splitlines()) == Host.objects.count()
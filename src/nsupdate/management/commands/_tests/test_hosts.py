@@ -0,0 +1,54 @@
+"""
+Tests for the hosts command.
+"""
+
+import datetime
+from io import StringIO
+
+from django.core import management
+from django.utils import timezone
+
+from nsupdate.conftest import TEST_HOST
+from nsupdate.main.models import Host
+from nsupdate.management.commands.hosts import DAY, T_ip, T_react, S_unavailable, S_delete
+
+
+def stale_check():
+    out = StringIO()
+    management.call_command('hosts', stale_check=True, chunk_size=2, stdout=out)
+    return out.getvalue()
+
+
+def test_stale_check_not_stale():
+    t_now = timezone.now()
+    Host.objects.filter(name=TEST_HOST.host).update(last_update_ipv4=None, last_update_ipv6=t_now, staleness=2)
+    stale_check()
+    assert Host.objects.get(name=TEST_HOST.host).staleness == 0
+
+
+def test_stale_check_stale():
+    t_old = timezone.now() - datetime.timedelta(seconds=T_ip + DAY)
+    Host.objects.update(last_update_ipv4=t_old, last_update_ipv6=None,
+                        staleness=0, staleness_notification_timestamp=None)
+    output = stale_check()
+    assert str(TEST_HOST) in output
+    h = Host.objects.get(name=TEST_HOST.host)
+    assert h.staleness == 1
+    assert h.staleness_notification_timestamp is not None
+    # owner has T_react time to react before the next step
+    stale_check()
+    assert Host.objects.get(name=TEST_HOST.host).staleness == 1
+    t_notified = timezone.now() - datetime.timedelta(seconds=T_react + DAY)
+    Host.objects.update(staleness=S_unavailable - 1, staleness_notification_timestamp=t_notified)
+    stale_check()
+    h = Host.objects.get(name=TEST_HOST.host)
+    assert h.staleness == S_unavailable
+    assert h.available is False
+
+
+def test_stale_check_delete():
+    t_old = timezone.now() - datetime.timedelta(seconds=T_ip + DAY)
+    Host.objects.filter(name=TEST_HOST.host).update(last_update_ipv4=t_old, last_update_ipv6=t_old,
+                                                    staleness=S_delete - 1, staleness_notification_timestamp=None)
+    assert 'deleted host' in stale_check()
+    assert not Host.objects.filter(name=TEST_HOST.host).exists()
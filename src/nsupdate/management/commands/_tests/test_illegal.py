@@ -0,0 +1,67 @@
+"""
+Tests for the illegal command.
+"""
+
+import dns.resolver
+import pytest
+
+from django.core import management
+
+from nsupdate.conftest import TEST_HOST
+from nsupdate.main import dnstools
+from nsupdate.main.models import Host
+from nsupdate.management.commands.illegal import load_index, hosts_by_ip
+
+
+class FakeResolver(object):
+    """all hosts resolve to the same IPv4 address and have no IPv6 address"""
+    def __init__(self):
+        self.queries = 0
+
+    def resolve(self, qname, rdtype, search=True):
+        self.queries += 1
+        if rdtype == 'AAAA':
+            raise dns.resolver.NoAnswer
+        return ['192.0.2.1']
+
+
+class AsyncFakeResolver(object):
+    def __init__(self, resolver):
+        self.resolver = resolver
+
+    async def resolve(self, qname, rdtype, search=True):
+        return self.resolver.resolve(qname, rdtype, search)
+
+
+@pytest.fixture
+def resolver(monkeypatch):
+    resolver = FakeResolver()
+    monkeypatch.setattr(dnstools.resolvers, 'get', lambda *args, asynchronous=False, **kwargs: (
+        AsyncFakeResolver(resolver) if asynchronous else resolver))
+    monkeypatch.setattr(dnstools, 'answer_cache', dnstools.TTLCache())
+    monkeypatch.setattr('builtins.input', lambda prompt: 'n')
+    return resolver
+
+
+def test_index(resolver, tmp_path):
+    index_path = str(tmp_path / 'index.json')
+    management.call_command('illegal', index=index_path)
+    index = load_index(index_path)
+    host = Host.objects.get(name=TEST_HOST.host)
+    assert index['hosts'][host.pk] == ['192.0.2.1']
+    assert set(hosts_by_ip(index)['192.0.2.1']) == set(Host.objects.values_list('pk', flat=True))
+    queries = resolver.queries
+    assert queries == 2 * Host.objects.count()
+    # nothing changed, so nothing needs to be resolved again
+    dnstools.answer_cache.clear()
+    management.call_command('illegal', index=index_path)
+    assert resolver.queries == queries
+    # only the changed host gets resolved again
+    host.comment = 'changed'
+    host.save()
+    management.call_command('illegal', index=index_path, ip='192.0.2.1')
+    assert resolver.queries == queries + 2
+    # deleted hosts get removed from the index
+    Host.objects.filter(pk=host.pk).delete()
+    management.call_command('illegal', index=index_path)
+    assert host.pk not in load_index(index_path)['hosts']
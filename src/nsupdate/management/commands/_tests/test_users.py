@@ -0,0 +1,31 @@
+"""
+Tests for the users command.
+"""
+
+import datetime
+from io import StringIO
+
+from django.contrib.auth import get_user_model
+from django.core import management
+from django.utils import timezone
+
+from nsupdate.conftest import USERNAME
+from nsupdate.management.commands.users import DAY, T_age
+
+
+def test_stale_check():
+    User = get_user_model()
+    t_old = timezone.now() - datetime.timedelta(seconds=T_age + DAY)
+    for i in range(5):
+        User.objects.create_user('stale%d' % i, 'stale%d@example.org' % i, 'pw')
+    User.objects.create_user('fresh', 'fresh@example.org', 'pw')
+    User.objects.exclude(username='fresh').update(last_login=t_old, date_joined=t_old)
+    out = StringIO()
+    management.call_command('users', stale_check=True, chunk_size=2, stdout=out)
+    assert not User.objects.filter(username__startswith='stale').exists()
+    assert User.objects.filter(username='fresh').exists()
+    # the test user has hosts and domains, so it is kept
+    assert User.objects.filter(username=USERNAME).exists()
+    assert 'kept, has hosts' in out.getvalue()
+    assert 'deleted user' in out.getvalue()
+    assert "'fresh <fresh@example.org>' kept, was used recently." in out.getvalue()
@@ -7,10 +7,12 @@ import dns.message
 
 from django.core.management.base import BaseCommand
 from django.db import transaction
+from django.utils.timezone import now
 from django.utils.translation import gettext_lazy as _
 
+from nsupdate.main.domaincache import invalidate_domain_cache
 from nsupdate.main.models import Domain, Host
-from nsupdate.main.dnstools import FQDN, query_ns, NameServerNotAvailable
+from nsupdate.main.dnstools import FQDN, query_ns_many, NameServerNotAvailable, DeadlineExceeded, QUERY_CONCURRENCY
 from nsupdate.utils.mail import translate_for_user, send_mail_to_user
 
 MSG = _("""\
@@ -45,26 +47,40 @@ LOG_MSG_HAS_HOSTS = _('Domain %%(domain)s is not available, but has %(hosts)d ho
 LOG_MSG_DELETE = _('Domain %(domain)s is not available and has no hosts -> deleted domain.')
 
 
-def check_dns(domain):
+# errors that mean the nameserver is not reachable or does not answer for the domain
+CHECK_ERRORS = (dns.resolver.Timeout, dns.resolver.NoNameservers, dns.resolver.NXDOMAIN, dns.resolver.NoAnswer,
+                NameServerNotAvailable, dns.message.UnknownTSIGKey)
+
+
+def check_dns(domains, deadline=None, concurrency=None):
     """
-    Check whether the nameserver is reachable and answers queries for the domain.
+    Check whether the nameservers are reachable and answer queries for the domains.
+    The domains are checked concurrently.
 
     Note: We can't reasonably check for dynamic updates as the DNS admin might
     have put restrictions on which hosts are allowed to be updated.
 
-    :param domain: Domain name
-    :return: Available status
+    :param domains: list of Domain names
+    :param deadline: max. time for checking all domains [s]
+    :param concurrency: max. count of domains checked at the same time
+    :return: dict Domain name -> Available status (None if it could not be checked within the deadline)
     """
-    fqdn = FQDN(host=None, domain=domain)
-    try:
-        query_ns(fqdn, 'SOA', prefer_primary=True)
-        queries_ok = True
-    except (dns.resolver.Timeout, dns.resolver.NoNameservers,
-            dns.resolver.NXDOMAIN, dns.resolver.NoAnswer, NameServerNotAvailable, dns.message.UnknownTSIGKey):
-        # Note: Currently the domain is also set to unavailable as a
-        # side effect in query_ns().
-        queries_ok = False
-    return queries_ok
+    queries = {domain: (FQDN(host=None, domain=domain), 'SOA') for domain in domains}
+    # we flag the unavailable domains on our own, all at once
+    results = query_ns_many(queries.values(), deadline=deadline, prefer_primary=True,
+                            concurrency=concurrency, flag_unavailable=False)
+    status = {}
+    for domain, query in queries.items():
+        result = results[query]
+        if isinstance(result, DeadlineExceeded):
+            status[domain] = None
+        elif isinstance(result, CHECK_ERRORS):
+            status[domain] = False
+        elif isinstance(result, Exception):
+            raise result
+        else:
+            status[domain] = True
+    return status
 
 
 def check_staleness(d):
@@ -108,35 +124,59 @@ class Command(BaseCommand):
                             dest='stale_check',
                             default=False,
                             help='Check whether the domain is available or has hosts; delete if not.')
+        parser.add_argument('--deadline',
+                            action='store',
+                            dest='deadline',
+                            default=60.0,
+                            type=float,
+                            help='Max. time for --check [s] (default: 60). '
+                                 'Domains not checked within that time are left unchanged.')
+        parser.add_argument('--concurrency',
+                            action='store',
+                            dest='concurrency',
+                            default=QUERY_CONCURRENCY,
+                            type=int,
+                            help='Max. count of domains checked at the same time by --check (default: %(default)s).')
 
     def handle(self, *args, **options):
         check = options['check']
         stale_check = options['stale_check']
         notify_user = options['notify_user']
-        with transaction.atomic():
-            for d in Domain.objects.all():
-                domain = d.name
-                if check and d.available:
-                    comment = d.comment
-                    creator = d.created_by
-                    available = check_dns(domain)
-                    if not available:
-                        d.available = False  # see comment in check_dns()
-                        d.public = False
-                        if notify_user:
-                            subject, msg = translate_for_user(
-                                creator,
-                                _("Issue with your domain %(domain)s"),
-                                MSG
-                            )
-                            subject = subject % dict(domain=domain)
-                            msg = msg % dict(domain=domain, comment=comment)
-                            send_mail_to_user(creator, subject, msg)
-                        msg = "Setting unavailable flag for domain %s (created by %s)\n" % (domain, creator,)
-                        self.stdout.write(msg)
-                    d.save()
-                if stale_check:
+        if check:
+            self.check(notify_user, options['deadline'], options['concurrency'])
+        if stale_check:
+            with transaction.atomic():
+                for d in Domain.objects.all():
                     log_msg = check_staleness(d)
                     if log_msg:
-                        log_msg = log_msg % dict(domain=domain)
+                        log_msg = log_msg % dict(domain=d.name)
                         self.stdout.write(log_msg)
+
+    def check(self, notify_user, deadline, concurrency):
+        domains = list(Domain.objects.filter(available=True).select_related('created_by'))
+        status = check_dns([d.name for d in domains], deadline, concurrency)
+        unavailable = [d for d in domains if status[d.name] is False]
+        if unavailable:
+            # update() does not touch the auto_now last_update, but get_ns_info needs it
+            # to not retry unavailable domains immediately
+            Domain.objects.filter(pk__in=[d.pk for d in unavailable]).update(available=False, public=False,
+                                                                             last_update=now())
+            # update() does not send post_save, so we need to tell the domain cache
+            invalidate_domain_cache(sender=Domain)
+        for d in domains:
+            if status[d.name] is None:
+                self.stdout.write("Could not check domain %s within %.1fs\n" % (d.name, deadline))
+        for d in unavailable:
+            domain = d.name
+            creator = d.created_by
+            if notify_user:
+                subject, msg = translate_for_user(
+                    creator,
+                    _("Issue with your domain %(domain)s"),
+                    MSG
+                )
+                subject = subject % dict(domain=domain)
+                msg = msg % dict(domain=domain, comment=d.comment)
+                send_mail_to_user(creator, subject, msg)
+            msg = "Setting unavailable flag for domain %s (created by %s)\n" % (domain, creator,)
+            self.stdout.write(msg)
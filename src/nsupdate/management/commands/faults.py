@@ -2,15 +2,22 @@
 Deal with the fault counters and the available/abuse/abuse_blocked flags.
 """
 
+import functools
 import traceback
 
 from django.core.management.base import BaseCommand
 from django.db import transaction
+from django.utils.timezone import now
 from django.utils.translation import gettext_lazy as _
 
+from nsupdate.main import dnstools
 from nsupdate.main.models import Host
 from nsupdate.utils.mail import translate_for_user, send_mail_to_user
 
+# max. count of hosts whose records we delete with one dns update batch (one message per zone),
+# so the messages stay well below the 64KiB limit and one failure does not block all deletes
+DNS_DELETE_CHUNK_SIZE = 100
+
 ABUSE_MSG = _("""\
 Your host: %(fqdn)s (comment: %(comment)s)
 
@@ -105,6 +112,12 @@ class Command(BaseCommand):
                             dest='notify_user',
                             default=False,
                             help='Notify the user by email when the host gets flagged for abuse.')
+        parser.add_argument('--chunk-size',
+                            action='store',
+                            dest='chunk_size',
+                            default=2000,
+                            type=int,
+                            help='Process hosts in chunks of N (default: 2000).')
 
     def handle(self, *args, **options):
         show_client = options['show_client']
@@ -118,58 +131,115 @@ class Command(BaseCommand):
         reset_abuse_blocked = options['reset_abuse_blocked']
         flag_abuse = options['flag_abuse']
         notify_user = options['notify_user']
-        for h in Host.objects.all():
+        chunk_size = options['chunk_size']
+        if show_client or show_server or show_api_auth:
+            self.show(show_client, show_server, show_api_auth, chunk_size)
+        flagged = []
+        with transaction.atomic():
+            if flag_abuse is not None:
+                flagged = self.flag_abuse(flag_abuse, notify_user, chunk_size)
+            # all hosts get the same values, so we can do that with one UPDATE
+            # (which does not touch the auto_now last_update, so we set it, like save() did)
+            reset = {}
+            if reset_client:
+                reset['client_faults'] = 0
+            if reset_server:
+                reset['server_faults'] = 0
+            if reset_api_auth:
+                reset['api_auth_faults'] = 0
+            if reset_available:
+                reset['available'] = True
+            if reset_abuse:
+                reset['abuse'] = False
+            if reset_abuse_blocked:
+                reset['abuse_blocked'] = False
+            if reset:
+                Host.objects.update(last_update=now(), **reset)
+        if flagged and not reset_abuse:
+            # bulk updates do not send post_save, so remove the abusive hosts from dns here
+            self.delete_from_dns(flagged)
+
+    def show(self, show_client, show_server, show_api_auth, chunk_size):
+        hosts = (Host.objects.select_related('domain', 'created_by')
+                 .only('name', 'client_faults', 'server_faults', 'api_auth_faults',
+                       'domain__name', 'created_by__username')
+                 .order_by('pk'))
+        for h in hosts.iterator(chunk_size=chunk_size):
+            output = u""
+            if show_client:
+                output += u"%-6d " % h.client_faults
+            if show_server:
+                output += u"%-6d " % h.server_faults
+            if show_api_auth:
+                output += u"%-6d " % h.api_auth_faults
+            output += u"%s %s\n" % (h.created_by.username, h.get_fqdn(),)
+            self.stdout.write(output)
+
+    def flag_abuse(self, max_faults, notify_user, chunk_size):
+        """
+        set the abuse flag and reset the client faults of hosts with more than max_faults client faults.
+
+        if notify_user is set, the emails get sent after the transaction was committed,
+        so we neither hold it open while talking to the mail server nor send mails for
+        changes that get rolled back.
+
+        :return: list of fqdns of the flagged hosts
+        """
+        hosts = (Host.objects.filter(client_faults__gt=max_faults)
+                 .select_related('domain', 'created_by')
+                 .order_by('pk'))
+        flagged_pks, flagged, mails = [], [], []
+        for h in hosts.iterator(chunk_size=chunk_size):
+            fqdn = h.get_fqdn()
+            flagged_pks.append(h.pk)
+            flagged.append(fqdn)
+            try:
+                faults_count = h.client_faults
+                creator = h.created_by
+                self.stdout.write(
+                    "Setting abuse flag for host %s (created by %s, client faults: %d)\n" % (
+                        fqdn, creator, faults_count))
+                if notify_user:
+                    subject, msg = translate_for_user(
+                        creator,
+                        _("Issue with your host %(fqdn)s"),
+                        ABUSE_MSG
+                    )
+                    subject = subject % dict(fqdn=fqdn)
+                    msg = msg % dict(fqdn=fqdn, comment=h.comment, faults_count=faults_count)
+                    mails.append((fqdn, creator, subject, msg))
+            except Exception:
+                self.stderr.write(u"The following Exception occurred when processing host %s!\n" % (fqdn,))
+                traceback.print_exc()
+        for i in range(0, len(flagged_pks), chunk_size):
+            Host.objects.filter(pk__in=flagged_pks[i:i + chunk_size]).update(
+                abuse=True, client_faults=0, last_update=now())
+        if mails:
+            transaction.on_commit(functools.partial(self.send_mails, mails))
+        return flagged
+
+    def send_mails(self, mails):
+        for fqdn, creator, subject, msg in mails:
+            try:
+                send_mail_to_user(creator, subject, msg)
+            except Exception:
+                self.stderr.write(u"The following Exception occurred when notifying the user of host %s!\n" % (fqdn,))
+                traceback.print_exc()
+
+    def delete_from_dns(self, fqdns):
+        for i in range(0, len(fqdns), DNS_DELETE_CHUNK_SIZE):
+            chunk = fqdns[i:i + DNS_DELETE_CHUNK_SIZE]
+            batch = dnstools.UpdateBatch()
+            changes = [batch.delete(fqdn, rdtype) for fqdn in chunk for rdtype in ('A', 'AAAA')]
             try:
-                with transaction.atomic():
-                    if show_client or show_server or show_api_auth:
-                        output = u""
-                        if show_client:
-                            output += u"%-6d " % h.client_faults
-                        if show_server:
-                            output += u"%-6d " % h.server_faults
-                        if show_api_auth:
-                            output += u"%-6d " % h.api_auth_faults
-                        output += u"%s %s\n" % (h.created_by.username, h.get_fqdn(),)
-                        self.stdout.write(output)
-                    if (flag_abuse is not None or reset_client or reset_server or reset_api_auth or
-                        reset_available or reset_abuse or reset_abuse_blocked):
-                        if flag_abuse is not None:
-                            if h.client_faults > flag_abuse:
-                                h.abuse = True
-                                faults_count = h.client_faults
-                                h.client_faults = 0
-                                fqdn = h.get_fqdn()
-                                comment = h.comment
-                                creator = h.created_by
-                                self.stdout.write(
-                                    "Setting abuse flag for host %s (created by %s, client faults: %d)\n" % (
-                                        fqdn, creator, faults_count))
-                                if notify_user:
-                                    subject, msg = translate_for_user(
-                                        creator,
-                                        _("Issue with your host %(fqdn)s"),
-                                        ABUSE_MSG
-                                    )
-                                    subject = subject % dict(fqdn=fqdn)
-                                    msg = msg % dict(fqdn=fqdn, comment=comment, faults_count=faults_count)
-                                    send_mail_to_user(creator, subject, msg)
-                        if reset_client:
-                            h.client_faults = 0
-                        if reset_server:
-                            h.server_faults = 0
-                        if reset_api_auth:
-                            h.api_auth_faults = 0
-                        if reset_available:
-                            h.available = True
-                        if reset_abuse:
-                            h.abuse = False
-                        if reset_abuse_blocked:
-                            h.abuse_blocked = False
-                        h.save()
+                batch.send()
             except Exception:
-                try:
-                    msg = u"The following Exception occurred when processing host %s!\n" % (h.get_fqdn(),)
-                    self.stderr.write(msg)
-                except Exception:
-                    pass
+                self.stderr.write(u"The following Exception occurred when deleting the records of hosts %s!\n" % (
+                    ', '.join(str(fqdn) for fqdn in chunk),))
                 traceback.print_exc()
+                continue
+            for change in changes:
+                if change.error is not None and not isinstance(change.error, (
+                        dnstools.Timeout, dnstools.NameServerNotAvailable, dnstools.DnsUpdateError)):
+                    self.stderr.write(u"Could not delete %s record of host %s: %r\n" % (
+                        change.rdtype, change.fqdn, change.error))
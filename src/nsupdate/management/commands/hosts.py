@@ -6,6 +6,7 @@ import datetime
 
 from django.core.management.base import BaseCommand
 from django.db import transaction
+from django.db.models import F, Q
 from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 
@@ -76,56 +77,68 @@ time.
 """)
 
 
-def check_staleness(h):
+def reset_staleness(t_now):
     """
-    Check the staleness of host h and, if it is stale, react by increasing the
-    staleness counter. When the counter reaches certain thresholds, first make the host
-    unavailable, then remove the host.
+    Reset the staleness counter of all hosts that had an IP update recently.
 
-    Return email message and log message (each can be None).
+    :param t_now: current time
+    :return: count of hosts that are not stale anymore
+    """
+    before_ip = t_now - datetime.timedelta(seconds=T_ip)
+    recently_updated = Q(last_update_ipv4__gt=before_ip) | Q(last_update_ipv6__gt=before_ip)
+    return Host.objects.filter(recently_updated).exclude(staleness=S_notstale).update(staleness=S_notstale)
+
+
+def due_hosts(t_now):
+    """
+    Select the stale hosts whose owners had enough time to react since the last notification.
+
+    :param t_now: current time
+    :return: Host queryset
+    """
+    before_ip = t_now - datetime.timedelta(seconds=T_ip)
+    before_react = t_now - datetime.timedelta(seconds=T_react)
+    # note: exclude() also selects the hosts where the timestamp is NULL (never)
+    return (Host.objects.exclude(last_update_ipv4__gt=before_ip)
+            .exclude(last_update_ipv6__gt=before_ip)
+            .exclude(staleness_notification_timestamp__gt=before_react))
+
+
+def increase_staleness(hosts, t_now):
+    """
+    Increase the staleness counter of due hosts. When the counter reaches certain
+    thresholds, first make the host unavailable, then remove the host.
 
-    :param h: Host instance
-    :return: email_msg, log_msg
+    :param hosts: Host objects (see due_hosts)
+    :param t_now: current time
+    :return: list of (host, staleness, email_msg, log_msg)
     """
-    email_msg = log_msg = None
-    t_now = timezone.now()
-    last_update_ipv4 = h.last_update_ipv4 or NEVER
-    last_update_ipv6 = h.last_update_ipv6 or NEVER
-    last_update_ip = max(last_update_ipv4, last_update_ipv6)
-    ip_age = (t_now - last_update_ip).total_seconds()
-    staleness = old_staleness = h.staleness
-    last_notification = h.staleness_notification_timestamp or NEVER
-    notification_age = (t_now - last_notification).total_seconds()
-    changed = False
-    if ip_age < T_ip:
-        staleness = S_notstale
-        if old_staleness != staleness:
-            h.staleness = staleness  # IP has been updated recently.
-            changed = True
-    elif notification_age < T_react:
-        pass  # Since we notified, not enough time has passed for the owner to react.
-    else:
-        staleness = old_staleness + 1
+    EMAIL_MSG_STALE = u"%s%s%s" % (EMAIL_MSG_START, LOG_MSG_STALE, EMAIL_MSG_END)
+    EMAIL_MSG_UNAVAILABLE = u"%s%s%s" % (EMAIL_MSG_START, LOG_MSG_UNAVAILABLE, EMAIL_MSG_END)
+    EMAIL_MSG_DELETE = u"%s%s%s" % (EMAIL_MSG_START, LOG_MSG_DELETE, EMAIL_MSG_END_DELETED)
+    results = []
+    stale, unavailable, delete = [], [], []
+    for h in hosts:
+        staleness = h.staleness + 1
         if staleness >= S_delete:
-            h.delete()
-            EMAIL_MSG_DELETE = u"%s%s%s" % (EMAIL_MSG_START, LOG_MSG_DELETE, EMAIL_MSG_END_DELETED)
-            email_msg, log_msg = EMAIL_MSG_DELETE, LOG_MSG_DELETE
+            delete.append(h.pk)
+            results.append((h, staleness, EMAIL_MSG_DELETE, LOG_MSG_DELETE))
         elif staleness >= S_unavailable:
-            h.staleness = staleness
-            h.available = False  # TODO: Remove host from DNS also.
-            h.staleness_notification_timestamp = t_now
-            changed = True
-            EMAIL_MSG_UNAVAILABLE = u"%s%s%s" % (EMAIL_MSG_START, LOG_MSG_UNAVAILABLE, EMAIL_MSG_END)
-            email_msg, log_msg = EMAIL_MSG_UNAVAILABLE, LOG_MSG_UNAVAILABLE
+            unavailable.append(h.pk)
+            results.append((h, staleness, EMAIL_MSG_UNAVAILABLE, LOG_MSG_UNAVAILABLE))
         else:
-            h.staleness = staleness
-            h.staleness_notification_timestamp = t_now
-            changed = True
-            EMAIL_MSG_STALE = u"%s%s%s" % (EMAIL_MSG_START, LOG_MSG_STALE, EMAIL_MSG_END)
-            email_msg, log_msg = EMAIL_MSG_STALE, LOG_MSG_STALE
-    if changed:
-        h.save()
-    return staleness, email_msg, log_msg
+            stale.append(h.pk)
+            results.append((h, staleness, EMAIL_MSG_STALE, LOG_MSG_STALE))
+    if stale:
+        Host.objects.filter(pk__in=stale).update(
+            staleness=F('staleness') + 1, staleness_notification_timestamp=t_now)
+    if unavailable:
+        Host.objects.filter(pk__in=unavailable).update(
+            staleness=F('staleness') + 1, staleness_notification_timestamp=t_now,
+            available=False)  # TODO: Remove host from DNS also.
+    if delete:
+        Host.objects.filter(pk__in=delete).delete()
+    return results
 
 
 class Command(BaseCommand):
@@ -142,26 +155,36 @@ class Command(BaseCommand):
                             dest='notify_user',
                             default=False,
                             help='Notify the user by email when the staleness counter increases.')
+        parser.add_argument('--chunk-size',
+                            action='store',
+                            dest='chunk_size',
+                            default=1000,
+                            type=int,
+                            help='Process stale hosts in chunks of N, one transaction per chunk (default: 1000).')
 
     def handle(self, *args, **options):
         stale_check = options['stale_check']
         notify_user = options['notify_user']
-        with transaction.atomic():
-            for h in Host.objects.all():
-                if stale_check:
+        chunk_size = options['chunk_size']
+        if stale_check:
+            t_now = timezone.now()
+            reset_staleness(t_now)
+            pks = list(due_hosts(t_now).order_by('pk').values_list('pk', flat=True))
+            for i in range(0, len(pks), chunk_size):
+                with transaction.atomic():
+                    hosts = Host.objects.filter(pk__in=pks[i:i + chunk_size]).select_related('domain', 'created_by')
+                    results = increase_staleness(hosts, t_now)
+                for h, staleness, email_msg, log_msg in results:
                     host = h.name + "." + h.domain.name
-                    comment = h.comment
                     creator = h.created_by
-                    staleness, email_msg, log_msg = check_staleness(h)
-                    if email_msg and notify_user:
+                    if notify_user:
                         subject, msg = translate_for_user(
                             creator,
                             _("Issue with your host %(host)s"),
                             email_msg
                         )
                         subject = subject % dict(host=host)
-                        email_msg = email_msg % dict(host=host, staleness=staleness, comment=comment)
+                        email_msg = email_msg % dict(host=host, staleness=staleness, comment=h.comment)
                         send_mail_to_user(creator, subject, email_msg)
-                    if log_msg:
-                        log_msg = log_msg % dict(host=host, staleness=staleness, creator=creator)
-                        self.stdout.write(log_msg)
+                    log_msg = log_msg % dict(host=host, staleness=staleness, creator=creator)
+                    self.stdout.write(log_msg)
@@ -2,35 +2,190 @@
 Try to identify users/hosts doing illegal or questionable things.
 """
 
+import datetime
+import json
+import os
 import time
 from collections import defaultdict
 
+import dns.resolver
+
 from django.core.management.base import BaseCommand
 from django.db.utils import OperationalError
+from django.utils import timezone
 
 from nsupdate.main.models import Host
-from nsupdate.main import dnstools
+from nsupdate.main import dnstools, ippolicy
+
+# resolve the hosts in chunks of that many hosts, to bound memory usage
+CHUNK_SIZE = 1000
+
+
+def resolve_hosts(pks, deadline=None, concurrency=None):
+    """
+    Concurrently resolve the A and AAAA records of hosts.
+
+    :param pks: list of Host pks
+    :param deadline: max. time for resolving a chunk of hosts [s]
+    :param concurrency: max. count of queries in flight
+    :return: dict host pk -> list of IPs (hosts we could not resolve are missing)
+    """
+    ips_of_host = {}
+    for i in range(0, len(pks), CHUNK_SIZE):
+        hosts = Host.objects.filter(pk__in=pks[i:i + CHUNK_SIZE]).select_related('domain').only('name', 'domain__name')
+        chunk = [(host.pk, host.get_fqdn()) for host in hosts]
+        ips_of_host.update(_resolve_chunk(chunk, deadline, concurrency))
+    return ips_of_host
+
+
+def _resolve_chunk(chunk, deadline, concurrency):
+    queries = [(fqdn, rdtype) for pk, fqdn in chunk for rdtype in ('A', 'AAAA')]
+    results = dnstools.query_ns_many(queries, deadline=deadline, concurrency=concurrency)
+    ips_of_host = {}
+    for pk, fqdn in chunk:
+        ips, ok = [], True
+        for rdtype in ('A', 'AAAA'):
+            result = results[(fqdn, rdtype)]
+            if isinstance(result, (dns.resolver.NXDOMAIN, dns.resolver.NoAnswer)):
+                continue  # no such record
+            if isinstance(result, Exception):
+                ok = False  # try again next time
+                break
+            ips.append(result)
+        if ok:
+            ips_of_host[pk] = ips
+    return ips_of_host
+
+
+def load_index(path):
+    """
+    Load the IP index from a file (see update_index).
+
+    :param path: file name (or None)
+    :return: index dict, empty if there is no such file
+    """
+    if path is None or not os.path.exists(path):
+        return dict(scanned=None, hosts={})
+    with open(path) as f:
+        index = json.load(f)
+    # json only has str keys
+    index['hosts'] = {int(pk): ips for pk, ips in index['hosts'].items()}
+    return index
+
+
+def save_index(path, index):
+    """
+    Save the IP index to a file (atomically).
+
+    :param path: file name
+    :param index: index dict
+    """
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(index, f)
+    os.replace(tmp_path, path)
+
+
+def update_index(index, full=False, deadline=None, concurrency=None):
+    """
+    Bring the IP index up to date: resolve hosts that are new or were changed
+    (e.g. got an IP update) since the last scan, forget deleted hosts.
+
+    :param index: index dict, gets modified
+    :param full: whether to resolve all hosts
+    :param deadline: max. time for resolving a chunk of hosts [s]
+    :param concurrency: max. count of queries in flight
+    :return: count of resolved hosts
+    """
+    t_now = timezone.now()
+    ips_of_host = index['hosts']
+    pks = set(Host.objects.values_list('pk', flat=True))
+    if full or index['scanned'] is None:
+        ips_of_host.clear()
+        todo = pks
+    else:
+        for pk in set(ips_of_host) - pks:
+            del ips_of_host[pk]  # deleted host
+        scanned = datetime.datetime.fromisoformat(index['scanned'])
+        changed = set(Host.objects.filter(last_update__gte=scanned).values_list('pk', flat=True))
+        todo = (pks - set(ips_of_host)) | changed
+    resolved = resolve_hosts(sorted(todo), deadline, concurrency)
+    ips_of_host.update(resolved)
+    index['scanned'] = t_now.isoformat()
+    return len(resolved)
+
+
+def hosts_by_ip(index):
+    """
+    Invert the IP index.
+
+    :param index: index dict
+    :return: dict IP -> list of host pks
+    """
+    ip_to_hosts = defaultdict(list)
+    for pk, ips in index['hosts'].items():
+        for ip in ips:
+            ip_to_hosts[ip].append(pk)
+    return ip_to_hosts
 
 
 class Command(BaseCommand):
     help = 'Identify users/hosts doing illegal or questionable things.'
 
+    def add_arguments(self, parser):
+        parser.add_argument('--index',
+                            action='store',
+                            dest='index',
+                            default=None,
+                            help='Keep the IP -> hosts index in this file and only resolve new / changed hosts.')
+        parser.add_argument('--full',
+                            action='store_true',
+                            dest='full',
+                            default=False,
+                            help='Resolve all hosts, even if there is an index.')
+        parser.add_argument('--no-scan',
+                            action='store_true',
+                            dest='no_scan',
+                            default=False,
+                            help='Do not resolve any hosts, just use the index.')
+        parser.add_argument('--ip',
+                            action='store',
+                            dest='ip',
+                            default=None,
+                            help='Only deal with the hosts pointing to this IP.')
+        parser.add_argument('--concurrency',
+                            action='store',
+                            dest='concurrency',
+                            default=dnstools.QUERY_CONCURRENCY,
+                            type=int,
+                            help='Max. count of DNS queries in flight (default: %(default)s).')
+        parser.add_argument('--deadline',
+                            action='store',
+                            dest='deadline',
+                            default=60.0,
+                            type=float,
+                            help='Max. time for resolving a chunk of %d hosts [s] (default: 60).' % CHUNK_SIZE)
+
     def handle(self, *args, **options):
-        ip_to_hosts = defaultdict(list)
-        for host in Host.objects.all():
-            fqdn = host.get_fqdn()
-            try:
-                ip = dnstools.query_ns(fqdn, 'A')
-                ip_to_hosts[ip].append(host)
-            except:
-                pass
-        ips = sorted(ip_to_hosts.keys(), key=lambda ip: len(ip_to_hosts[ip]), reverse=True)
+        index_path = options['index']
+        index = load_index(index_path)
+        if not options['no_scan']:
+            count = update_index(index, options['full'], options['deadline'], options['concurrency'])
+            print("Resolved %d hosts, the index has %d hosts." % (count, len(index['hosts'])))
+            if index_path is not None:
+                save_index(index_path, index)
+        ip_to_hosts = hosts_by_ip(index)
+        if options['ip'] is not None:
+            ips = [options['ip']] if options['ip'] in ip_to_hosts else []
+        else:
+            ips = sorted(ip_to_hosts.keys(), key=lambda ip: len(ip_to_hosts[ip]), reverse=True)
         for ip in ips:
             users = {}
             hosts_of_user = defaultdict(list)
-            hosts = ip_to_hosts[ip]
-            ip_refcount = len(hosts)
-            print("IP %s is referred to by %d hosts." % (ip, ip_refcount))
+            hosts = Host.objects.filter(pk__in=ip_to_hosts[ip]).select_related('created_by')
+            ip_refcount = len(ip_to_hosts[ip])
+            blocked = ' (blocked by the IP policy)' if ippolicy.is_blocked(ip) else ''
+            print("IP %s is referred to by %d hosts%s." % (ip, ip_refcount, blocked))
             for host in hosts:
                 user = host.created_by
                 users[user.id] = user
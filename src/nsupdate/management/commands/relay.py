@@ -0,0 +1,39 @@
+"""
+Relay queued updates to other services.
+"""
+
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from nsupdate.main import relay
+
+
+class Command(BaseCommand):
+    help = 'Relay queued updates to other services.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loop',
+                            action='store_true',
+                            dest='loop',
+                            default=False,
+                            help='Run forever, check for due updates every --interval seconds.')
+        parser.add_argument('--interval',
+                            action='store',
+                            dest='interval',
+                            default=5.0,
+                            type=float,
+                            help='Time between checks in --loop mode [s] (default: 5).')
+
+    def handle(self, *args, **options):
+        loop = options['loop']
+        interval = options['interval']
+        while True:
+            done, failed = relay.process()
+            if done or failed:
+                self.stdout.write("Relayed %d updates, %d failed." % (done, failed))
+            if not loop:
+                break
+            time.sleep(interval)
+            close_old_connections()
@@ -0,0 +1,32 @@
+"""
+Record the statistics shown on the status page.
+"""
+
+import datetime
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from nsupdate.main.models import StatsSnapshot
+from nsupdate.main.stats import take_snapshot
+
+
+class Command(BaseCommand):
+    help = 'Record a snapshot of the statistics.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--keep-days',
+                            action='store',
+                            dest='keep_days',
+                            default=0,
+                            type=int,
+                            help='Delete snapshots older than that many days (0 = keep all).')
+
+    def handle(self, *args, **options):
+        keep_days = options['keep_days']
+        snapshot = take_snapshot()
+        self.stdout.write('Recorded statistics snapshot at %s' % snapshot.created)
+        if keep_days > 0:
+            before = timezone.now() - datetime.timedelta(days=keep_days)
+            deleted, _ = StatsSnapshot.objects.filter(created__lt=before).delete()
+            self.stdout.write('Deleted %d old statistics snapshots' % deleted)
@@ -7,6 +7,8 @@ import datetime
 from django.contrib.auth import get_user_model
 from django.core.management.base import BaseCommand
 from django.db import transaction
+from django.db.models import Count, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce
 from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 
@@ -23,39 +25,67 @@ LOG_MSG_HAS_DOMAINS = _("%%(user)r kept, has domains. age: %(age)fy, hosts: %(ho
 LOG_MSG_RECENTLY_USED = _("%(user)r kept, was used recently.")
 
 
-def check_staleness(u):
+def _count_of(model):
     """
-    Check the staleness of user u (has not logged in for a long time,
-    has no hosts and no domains) and, if it is stale, delete it.
+    Subquery counting the records of model created by the user (OuterRef pk).
 
-    Return log message (can be None).
+    Unlike Count() over the reverse relations, this does not need to join
+    (and to de-duplicate the product of) the hosts and domains of the user.
+    """
+    counts = (model.objects.filter(created_by=OuterRef('pk')).order_by()
+              .values('created_by').annotate(count=Count('pk')).values('count'))
+    return Coalesce(Subquery(counts), 0)
+
+
+def stale_candidates(t_now):
+    """
+    Select the users that have not logged in (and have not been created) for a
+    long time, annotated with their host_count and domain_count.
+
+    :param t_now: current time
+    :return: User queryset
+    """
+    return (get_user_model().objects
+            .filter(_stale_q(t_now))
+            .annotate(host_count=_count_of(Host), domain_count=_count_of(Domain)))
+
+
+def recently_used(t_now):
+    """
+    Select the users that are no stale candidates (see stale_candidates).
 
-    :param u: User instance
-    :return: log_msg
+    :param t_now: current time
+    :return: User queryset
+    """
+    return get_user_model().objects.exclude(_stale_q(t_now))
+
+
+def _stale_q(t_now):
+    before = t_now - datetime.timedelta(seconds=T_age)
+    # a user is stale if BOTH last_login and date_joined are old
+    return ((Q(last_login__lte=before) | Q(last_login__isnull=True)) &
+            (Q(date_joined__lte=before) | Q(date_joined__isnull=True)))
+
+
+def check_staleness(u, t_now):
+    """
+    Check the staleness of user u (see stale_candidates), return the log message
+    and whether the user shall be deleted (has no hosts and no domains).
+
+    :param u: User instance, annotated with host_count and domain_count
+    :param t_now: current time
+    :return: log_msg, delete
     """
-    t_now = timezone.now()
     t_last_login = u.last_login or NEVER
     t_date_joined = u.date_joined or NEVER
-    age_last_login = (t_now - t_last_login).total_seconds()
-    age_date_joined = (t_now - t_date_joined).total_seconds()
-    # a user is stale if BOTH last_login and date_joined are old
-    age = min(age_last_login, age_date_joined)
-    if age < T_age:
-        log_msg = LOG_MSG_RECENTLY_USED
-    else:
-        age_y = age / 365.0 / DAY
-        host_count = Host.objects.filter(created_by=u).count()
-        if host_count > 0:
-            log_msg = LOG_MSG_HAS_HOSTS % dict(age=age_y, hosts=host_count)
-        else:
-            domain_count = Domain.objects.filter(created_by=u).count()
-            if domain_count > 0:
-                log_msg = LOG_MSG_HAS_DOMAINS % dict(age=age_y, hosts=host_count, domains=domain_count)
-            else:
-                # Not recently used; has no hosts and no domains.
-                u.delete()
-                log_msg = LOG_MSG_DELETE % dict(age=age_y)
-    return log_msg
+    age = min((t_now - t_last_login).total_seconds(), (t_now - t_date_joined).total_seconds())
+    age_y = age / 365.0 / DAY
+    if u.host_count > 0:
+        return LOG_MSG_HAS_HOSTS % dict(age=age_y, hosts=u.host_count), False
+    if u.domain_count > 0:
+        return LOG_MSG_HAS_DOMAINS % dict(age=age_y, hosts=u.host_count, domains=u.domain_count), False
+    # Not recently used; has no hosts and no domains.
+    return LOG_MSG_DELETE % dict(age=age_y), True
 
 
 class Command(BaseCommand):
@@ -67,6 +97,12 @@ class Command(BaseCommand):
                             dest='stale_check',
                             default=False,
                             help='Check whether the user has logged in recently and has hosts or domains; delete if not.')
+        parser.add_argument('--chunk-size',
+                            action='store',
+                            dest='chunk_size',
+                            default=1000,
+                            type=int,
+                            help='Process users in chunks of N, one transaction per chunk (default: 1000).')
 
     def handle(self, *args, **options):
         def print_stats(when):
@@ -76,18 +112,42 @@ class Command(BaseCommand):
             print("%s: users: %d, hosts: %d, domains: %d" % (when, user_count, host_count, domain_count))
 
         stale_check = options['stale_check']
+        chunk_size = options['chunk_size']
         User = get_user_model()
-        with transaction.atomic():
-            print_stats("before")  # Print statistics before processing.
-            for u in User.objects.all():
-                user = "%s <%s>" % (u.username, u.email)
-                log_msg = None
-                if stale_check:
-                    log_msg = check_staleness(u)
-                if log_msg:
-                    log_msg = log_msg % dict(user=user)
+        print_stats("before")  # Print statistics before processing.
+        if stale_check:
+            t_now = timezone.now()
+            recent = recently_used(t_now).order_by('pk').values_list('username', 'email')
+            for username, email in recent.iterator(chunk_size=chunk_size):
+                try:
+                    self.stdout.write(LOG_MSG_RECENTLY_USED % dict(user="%s <%s>" % (username, email)))
+                except UnicodeError:
+                    pass
+            candidates = stale_candidates(t_now).order_by('pk')
+            checked = deleted = 0
+            last_pk = None
+            while True:
+                # keyset pagination, so we neither keep all users in memory nor iterate over what we delete
+                chunk = candidates if last_pk is None else candidates.filter(pk__gt=last_pk)
+                chunk = list(chunk[:chunk_size])
+                if not chunk:
+                    break
+                last_pk = chunk[-1].pk
+                delete = []
+                for u in chunk:
+                    log_msg, stale = check_staleness(u, t_now)
+                    if stale:
+                        delete.append(u.pk)
                     try:
-                        self.stdout.write(log_msg)
+                        self.stdout.write(log_msg % dict(user="%s <%s>" % (u.username, u.email)))
                     except UnicodeError:
                         pass
-            print_stats("after")  # Print statistics after processing.
+                if delete:
+                    with transaction.atomic():
+                        # re-check, the user might have created a host / domain meanwhile
+                        _, counts = User.objects.filter(pk__in=delete, hosts__isnull=True,
+                                                        domains__isnull=True).delete()
+                    deleted += counts.get(User._meta.label, 0)
+                checked += len(chunk)
+                print("progress: checked %d stale candidates, deleted %d users" % (checked, deleted))
+        print_stats("after")  # Print statistics after processing.
@@ -59,6 +59,34 @@ BAD_IPS_HOST = IPSet([])  # Inner list can have IPAddress and IPNetwork elements
 # delete the host from django admin.
 BAD_HOSTS = set([])
 
+# use the async variants of the /nic/update and /nic/delete views. this only
+# makes sense if you run nsupdate.info as an ASGI application (see nsupdate.asgi),
+# then a process can handle many updates concurrently while waiting for the
+# nameserver. under WSGI, keep it False.
+NIC_UPDATE_ASYNC = False
+
+# after a successful api authentication, remember the (HMACed) update secret for
+# that many seconds, so repeated updates do not need to compute the password hash
+# again. 0 disables this.
+UPDATE_SECRET_CACHE_TTL = 300
+# max. count of hosts we remember a verified update secret for.
+UPDATE_SECRET_CACHE_SIZE = 10000
+
+# updates relayed to other services (see ServiceUpdater) are queued and sent by
+# the relay management command. failed attempts are retried after RELAY_BACKOFF
+# seconds, doubling the wait time for each further attempt (up to RELAY_BACKOFF_MAX),
+# we give up after RELAY_MAX_ATTEMPTS attempts.
+RELAY_BACKOFF = 60
+RELAY_BACKOFF_MAX = 3600
+RELAY_MAX_ATTEMPTS = 8
+
+# the statistics on the status page are recomputed at most every that many seconds.
+# 0 recomputes them for every request.
+STATUS_STATS_REFRESH = 60
+# the status page shows the history of the statistics snapshots (see the stats
+# management command) of that many days.
+STATUS_HISTORY_DAYS = 30
+
 # nameservers used e.g. for MX lookups in the registration email validation.
 # google / cloudflare DNS IPs are only given as example / fallback -
 # please configure your own nameservers in your local settings file.
@@ -161,11 +189,11 @@ TEMPLATES = [
 ]
 
 MIDDLEWARE = (
+    'nsupdate.api.middleware.FastPathMiddleware',  # keep this first
     'django.middleware.common.CommonMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.locale.LocaleMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
-    'django_referrer_policy.middleware.ReferrerPolicyMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'social_django.middleware.SocialAuthExceptionMiddleware',
@@ -173,6 +201,11 @@ MIDDLEWARE = (
     'django.middleware.security.SecurityMiddleware',
 )
 
+# url names of API views served by FastPathMiddleware, bypassing the other middleware
+# (it still checks ALLOWED_HOSTS and adds the headers of SecurityMiddleware and
+# XFrameOptionsMiddleware). 'myip', 'nic_update' and 'nic_delete' can be used.
+FAST_PATH_VIEWS = ['myip', ]
+
 ROOT_URLCONF = 'nsupdate.urls'
 
 # Python dotted path to the WSGI application used by Django's runserver.
@@ -274,7 +307,7 @@ LOGOUT_REDIRECT_URL = '/'
 X_FRAME_OPTIONS = 'DENY'  # for clickjacking middleware
 SECURE_BROWSER_XSS_FILTER = True
 SECURE_CONTENT_TYPE_NOSNIFF = True
-REFERRER_POLICY = 'same-origin'
+SECURE_REFERRER_POLICY = 'same-origin'  # for security middleware
 
 CSRF_FAILURE_VIEW = 'nsupdate.main.views.csrf_failure_view'
 
@@ -290,6 +323,12 @@ SESSION_COOKIE_HTTPONLY = True
 SESSION_COOKIE_AGE = 10 * 60 * 60  # 10 hours, in seconds (remember_me is True), see #381
 SESSION_EXPIRE_AT_BROWSER_CLOSE = True  # more safe (remember_me is False)
 
+# Avoid writing sessions on page views: keep the "last seen" timestamps of the
+# session IPs in the django cache and do not create sessions for anonymous
+# visitors of pages that do not show their IPs (like crawlers getting 404s).
+# If you run multiple processes, use a shared cache (like for the detectip tokens).
+MINIMIZE_SESSION_WRITES = True
+
 PASSWORD_HASHERS = [
     'django.contrib.auth.hashers.Argon2PasswordHasher',
     'django.contrib.auth.hashers.PBKDF2PasswordHasher',
@@ -4,7 +4,7 @@ Tests for the ddns_client module.
 
 import pytest
 
-from ..ddns_client import dyndns2_update, Timeout, ConnectionError
+from ..ddns_client import dyndns2_update, get_session, close_sessions, Timeout, ConnectionError
 
 # See also conftest.py.
 BASEDOMAIN = 'nsupdate.info'
@@ -53,3 +53,50 @@ class TestDynDns2Client(object):
                                       hostname=HOSTNAME, myip=ip, secure=SECURE)
         assert status == 200
         assert text in ["good %s" % ip, "nochg %s" % ip]
+
+
+class TestSessionPool(object):
+    @pytest.fixture
+    def server(self):
+        """local dyndns2 "server", counting the connections it accepted"""
+        import threading
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'  # keep-alive
+
+            def setup(self):
+                super().setup()
+                self.server.connections += 1
+
+            def do_GET(self):
+                body = b'good 1.2.3.4'
+                self.send_response(200)
+                self.send_header('Content-Length', str(len(body)))
+                self.send_header('Set-Cookie', 'session=secret')
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        httpd.connections = 0
+        thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+        thread.start()
+        yield httpd
+        httpd.shutdown()
+        httpd.server_close()
+        close_sessions()
+
+    def test_connection_reuse(self, server):
+        address = '127.0.0.1:%d' % server.server_address[1]
+        for i in range(5):
+            status, text = dyndns2_update('user', 'password', address, hostname='host', myip='1.2.3.4',
+                                          secure=False)
+            assert (status, text) == (200, 'good 1.2.3.4')
+        assert server.connections == 1
+        session = get_session('http', address)
+        assert session is get_session('http', address)
+        assert session is not get_session('https', address)
+        assert not session.cookies  # no cookies shared between users
@@ -0,0 +1,62 @@
+"""
+Tests for the log module.
+"""
+
+import logging
+
+import pytest
+
+from django.test import RequestFactory
+
+from ..log import get_logger, logger
+
+
+class Capture(logging.Handler):
+    def __init__(self, fmt):
+        super().__init__()
+        self.setFormatter(logging.Formatter(fmt))
+        self.lines = []
+
+    def emit(self, record):
+        self.lines.append(self.format(record))
+
+
+class ExplodingUser(object):
+    @property
+    def username(self):
+        raise AssertionError("user must not be touched")
+
+
+@pytest.fixture
+def capture():
+    log = logging.getLogger('nsupdate.tests.log')
+    handler = Capture('%(message)s [ip: %(request.META.REMOTE_ADDR)s, user: %(request.user.username)s]')
+    log.addHandler(handler)
+    log.setLevel(logging.INFO)
+    yield handler
+    log.removeHandler(handler)
+
+
+def test_referenced_fields(capture):
+    request = RequestFactory().get('/', REMOTE_ADDR='192.0.2.1')
+    log = get_logger('nsupdate.tests.log', request)
+    log.info('hello')
+    assert capture.lines == ['hello [ip: 192.0.2.1, user: unknown]']  # RequestFactory requests have no user
+
+
+def test_lazy(capture):
+    request = RequestFactory().get('/')
+    request.user = ExplodingUser()
+    log = get_logger('nsupdate.tests.log', request)
+    log.debug('not emitted, so the user is not touched')
+    assert capture.lines == []
+
+
+def test_decorator(capture):
+    @logger('nsupdate.tests.log')
+    def view(request, logger=None):
+        logger.info('view')
+
+    view(RequestFactory().get('/', REMOTE_ADDR='192.0.2.2'))
+    view(None)
+    assert capture.lines == ['view [ip: 192.0.2.2, user: unknown]', 'view [ip: unknown, user: unknown]']
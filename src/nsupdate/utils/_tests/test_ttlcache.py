@@ -0,0 +1,44 @@
+"""
+Tests for the ttlcache module.
+"""
+
+from ..ttlcache import TTLCache
+
+
+class TestTTLCache(object):
+    def test_get_set(self):
+        c = TTLCache()
+        assert c.get('a') is None
+        assert c.get('a', 42) == 42
+        c.set('a', 1)
+        assert c.get('a') == 1
+        assert (c.hits, c.misses) == (1, 2)
+        c.delete('a')
+        assert c.get('a') is None
+
+    def test_expiry(self):
+        c = TTLCache(ttl=60)
+        c.set('a', 1, ttl=-1)  # not stored
+        assert c.get('a') is None
+        c.set('a', 1)
+        c._data['a'] = (0, 1)  # expired long ago
+        assert c.get('a') is None
+        assert len(c) == 0
+
+    def test_lru(self):
+        c = TTLCache(maxsize=2)
+        c.set('a', 1)
+        c.set('b', 2)
+        c.get('a')  # now b is the least recently used entry
+        c.set('c', 3)
+        assert c.get('b') is None
+        assert c.get('a') == 1
+        assert c.get('c') == 3
+
+    def test_disabled(self):
+        c = TTLCache(maxsize=0)
+        c.set('a', 1)
+        assert c.get('a') is None
+        c = TTLCache(ttl=0)
+        c.set('a', 1)
+        assert c.get('a') is None
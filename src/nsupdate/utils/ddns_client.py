@@ -1,16 +1,72 @@
 """
 DynDNS2 client utilities.
+
+We usually send updates to only a few servers, so we keep a requests.Session
+(with a connection pool) per server: connections (and TLS sessions) get
+reused instead of doing a new TCP and TLS handshake for every update.
 """
 
+import os
+
+# max. count of connections we keep open per server
+POOL_SIZE = int(os.environ.get('DDNS_CLIENT_POOL_SIZE', '4'))
+
+# how often we retry a request if we could not connect.
+# note: read errors are not retried, the server might have processed the update already.
+RETRIES = int(os.environ.get('DDNS_CLIENT_RETRIES', '1'))
+
+
+import threading
+from http.cookiejar import DefaultCookiePolicy
+
 import logging
 logger = logging.getLogger(__name__)
 
 import requests
 from requests import Timeout, ConnectionError  # Keep; re-exported from here.
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 
 TIMEOUT = 30.0  # Timeout for HTTP request response [s].
 
+_sessions = {}  # (scheme, server) -> requests.Session
+_sessions_lock = threading.Lock()
+
+
+def get_session(scheme, server):
+    """
+    get the shared session for a server
+
+    the session does not store cookies, as it is used for the updates of many users.
+
+    :param scheme: 'http' or 'https'
+    :param server: server name or IP (optionally with :port)
+    :return: requests.Session
+    """
+    key = (scheme, server)
+    session = _sessions.get(key)
+    if session is None:
+        with _sessions_lock:
+            session = _sessions.get(key)
+            if session is None:
+                session = requests.Session()
+                session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+                retries = Retry(total=RETRIES, read=False, status=0, redirect=0, backoff_factor=0.1)
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=POOL_SIZE, pool_block=False,
+                                      max_retries=retries)
+                session.mount('%s://' % scheme, adapter)
+                _sessions[key] = session
+    return session
+
+
+def close_sessions():
+    """close all sessions (and their pooled connections)"""
+    with _sessions_lock:
+        for session in _sessions.values():
+            session.close()
+        _sessions.clear()
+
 
 def dyndns2_update(name, password,
                    server, hostname=None, myip=None,
@@ -35,9 +91,11 @@ def dyndns2_update(name, password,
         params['hostname'] = hostname
     if myip is not None:
         params['myip'] = myip
-    url = "%s://%s%s" % ('https' if secure else 'http', server, path)
+    scheme = 'https' if secure else 'http'
+    url = "%s://%s%s" % (scheme, server, path)
     logger.debug("update request: %s %r" % (url, params, ))
-    r = requests.get(url, params=params, auth=(name, password), timeout=timeout)
+    r = get_session(scheme, server).get(url, params=params, auth=(name, password), timeout=timeout)
+    text = r.text  # reading the complete response lets the connection go back into the pool
     r.close()
-    logger.debug("update response: %d %s" % (r.status_code, r.text, ))
-    return r.status_code, r.text.strip()
+    logger.debug("update response: %d %s" % (r.status_code, text, ))
+    return r.status_code, text.strip()
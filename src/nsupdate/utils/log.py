@@ -10,87 +10,106 @@ Usage:
         logger.info('User performed some action')
 
     Class-based views work the same way; just decorate or modify the view's method(s).
+    Async views (coroutine functions) are supported, too.
 
     Logging formatter configuration:
 
     'format': '[%(asctime)s] %(levelname)s %(message)s ' \
               '[ip: %(request.META.REMOTE_ADDR)s, ua: "%(request.META.HTTP_USER_AGENT)s"]'
 
+    The request.* fields are only computed when a record gets emitted and only
+    the fields referenced by the formatters of the handlers are computed
+    (request.META.<key>, request.<attr>, request.session.<attr>, request.user.<attr>).
+
 Based on code from (but heavily modified/refactored):
     https://derrickpetzold.com/p/django-requst-logging-json/
     which is (c) Derrick Petzold — Creative Commons BY-SA license.
 """
 
+import functools
+import inspect
 import logging
+import re
 
 from django.http.request import HttpRequest
 
 
-def _get_attrdict(obj, basename, excluded=None):
-    """
-    Get a dictionary of (basename-prefixed) attribute names/values,
-    excluding the excluded names, internal attributes, and callables.
+# request.* fields used in the format strings of the formatters
+_FIELD_RE = re.compile(r'%\((request\.[^)]+)\)|\{(request\.[^}!:]+)[}!:]|\$\{?(request\.[\w.]+)')
 
-    :param obj: The object to inspect
-    :param basename: The prefix for the names in the result dictionary
-    :param excluded: Excluded attribute names; do not even touch (set or list)
-    :return: Dict of names to values
-    """
-    if excluded is None:
-        excluded = set()
-    d = {}
-    names = set(dir(obj)) - set(excluded)
-    for name in names:
-        if not name.startswith('_'):
-            try:
-                attr = getattr(obj, name)
-                if not callable(attr):
-                    d[basename + name] = attr
-            except AttributeError:
-                pass
-    return d
-
-
-def _get_elementdict(dct, basename, excluded=None):
+
+@functools.lru_cache(maxsize=None)
+def _formatter_fields(formatter):
     """
-    Get a dictionary of (basename-prefixed) dictionary elements,
-    excluding the excluded names.
+    Get the request.* field names referenced by a formatter.
 
-    :param dct: The dict to inspect
-    :param basename: The prefix for the names in the result dictionary
-    :param excluded: Excluded dictionary keys (set or list)
-    :return: Dict of names to values
+    :param formatter: logging.Formatter (or None)
+    :return: Tuple of field names
     """
-    if excluded is None:
-        excluded = set()
-    names = set(dct) - set(excluded)
-    return dict((basename + name, dct[name]) for name in names)
+    fmt = getattr(getattr(formatter, '_style', None), '_fmt', None) or ''
+    return tuple(name for match in _FIELD_RE.finditer(fmt) for name in match.groups() if name)
 
 
-def _build_request_info(request):
+def _referenced_fields(logger):
+    """
+    Get the request.* field names referenced by the formatters of all handlers
+    a record logged to logger might get emitted by.
+
+    :param logger: logging.Logger
+    :return: Set of field names
+    """
+    fields = set()
+    current = logger
+    while current is not None:
+        for handler in current.handlers:
+            fields.update(_formatter_fields(handler.formatter))
+        if not current.propagate:
+            break
+        current = current.parent
+    return fields
+
+
+def _get_request_field(request, name):
     """
-    Build a dictionary with extra information extracted from the request object.
+    Get a request.* field value, e.g. request.META.REMOTE_ADDR or request.user.username.
 
     :param request: Django HttpRequest object or None
-    :return: Dict of names to values
+    :param name: Field name
+    :return: Value or 'unknown' (to avoid KeyErrors when formatting)
     """
-    d = {}
-    if request:
-        d.update(_get_elementdict(request.META, "request.META."))
-        d.update(_get_attrdict(request, "request.", ['raw_post_data', ]))
-        d.update(_get_attrdict(request.session, "request.session."))
-        d.update(_get_attrdict(request.user, "request.user."))
-    # Note: Avoid KeyErrors at least for the default logging format string.
-    # Using a defaultdict as d does not help, as it gets iterated and keys/values
-    # are transferred into a normal dict and then the logging format() is still
-    # failing when it encounters an unknown key.
-    # XXX This is ugly and prone to fail for other format strings.
-    for key in ['request.META.REMOTE_ADDR',
-                'request.META.HTTP_USER_AGENT',
-                ]:
-        if key not in d:
-            d[key] = 'unknown'
-    return d
+    if request is None:
+        return 'unknown'
+    parts = name.split('.')[1:]
+    try:
+        if parts[0] == 'META':
+            return request.META.get('.'.join(parts[1:]), 'unknown')
+        value = request
+        for part in parts:
+            value = getattr(value, part)
+    except Exception:
+        # e.g. AttributeError, or SynchronousOnlyOperation if we would need to
+        # load the user or session from the DB while running in an async context.
+        return 'unknown'
+    return value
+
+
+class RequestLoggerAdapter(logging.LoggerAdapter):
+    """
+    LoggerAdapter adding information from the request to the log records.
+
+    This is lazy: the information is only computed if a record actually gets
+    logged (LoggerAdapter checks the level before calling process) and only
+    the request.* fields used by the formatters are computed.
+    """
+    def __init__(self, logger, request):
+        super().__init__(logger, {})
+        self.request = request
+
+    def process(self, msg, kwargs):
+        extra = {name: _get_request_field(self.request, name) for name in _referenced_fields(self.logger)}
+        extra.update(kwargs.get('extra') or {})
+        kwargs['extra'] = extra
+        return msg, kwargs
 
 
 def get_logger(name, request=None):
@@ -102,7 +121,7 @@ def get_logger(name, request=None):
     :param request: Django's HttpRequest object
     :return: Logger instance
     """
-    return logging.LoggerAdapter(logging.getLogger(name), _build_request_info(request))
+    return RequestLoggerAdapter(logging.getLogger(name), request)
 
 
 def logger(name):
@@ -113,14 +132,22 @@ def logger(name):
     :return: Decorated function or method
     """
     def wrap(func):
+        if inspect.iscoroutinefunction(func):
+            async def acaller(*args, **kwargs):
+                if 'logger' not in kwargs:
+                    kwargs['logger'] = get_logger(name, _find_request(args))
+                return await func(*args, **kwargs)
+            return acaller
+
         def caller(*args, **kwargs):
-            request = None
-            for arg in args:
-                if isinstance(arg, HttpRequest):
-                    request = arg
-                    break
             if 'logger' not in kwargs:
-                kwargs['logger'] = get_logger(name, request)
+                kwargs['logger'] = get_logger(name, _find_request(args))
             return func(*args, **kwargs)
         return caller
     return wrap
+
+
+def _find_request(args):
+    for arg in args:
+        if isinstance(arg, HttpRequest):
+            return arg
@@ -0,0 +1,79 @@
+"""
+A small thread-safe in-process cache with a time-to-live and a bounded size.
+
+Entries expire ttl seconds after they were set. If the cache is full, the
+least recently used entry gets dropped.
+"""
+
+from collections import OrderedDict
+import threading
+import time
+
+
+class TTLCache:
+    """
+    LRU cache with per-entry expiry.
+
+    :param maxsize: maximum count of entries (0 disables the cache)
+    :param ttl: time to live of entries [s] (0 disables the cache)
+    """
+    def __init__(self, maxsize=1000, ttl=60.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()  # key -> (expires, value)
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """
+        get the value for key
+
+        :param key: the key (hashable)
+        :param default: returned if key is not cached (or expired)
+        :return: value or default
+        """
+        with self._lock:
+            try:
+                expires, value = self._data[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            if expires <= time.monotonic():
+                del self._data[key]
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, ttl=None):
+        """
+        set the value for key
+
+        :param key: the key (hashable)
+        :param value: the value
+        :param ttl: time to live [s], default: the ttl of the cache
+        """
+        if ttl is None:
+            ttl = self.ttl
+        if not self.maxsize or ttl <= 0:
+            return
+        with self._lock:
+            self._data[key] = (time.monotonic() + ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        """remove key from the cache (if it is there)"""
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        """remove all entries"""
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)